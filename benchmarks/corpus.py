@@ -0,0 +1,198 @@
+"""Webhook payloads to replay against the workflows.
+
+`Generator` builds a deterministic mix of the events a busy organization
+sends, shaped like the payloads github delivers. Recorded deliveries can
+be replayed instead, see `load`."""
+
+import json
+import random
+import uuid
+import zlib
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Text
+
+# relative frequency of the generated events
+DEFAULT_MIX = {
+    "push": 30,
+    "project_card.moved": 25,
+    "project_card.created": 10,
+    "issue_comment": 15,
+    "issue_comment.move": 2,
+    "label.created": 5,
+    "label.edited": 3,
+    "label.deleted": 2,
+    # events no workflow handles, e.g. from other integrations
+    "issues.labeled": 8,
+}
+
+
+class Delivery(NamedTuple):
+    event_type: Text
+    payload: Dict[Text, Any]
+    delivery_id: Text
+
+    @property
+    def body(self) -> bytes:
+        return json.dumps(self.payload).encode("utf-8")
+
+
+def _repository(base_url: Text, full_name: Text) -> Dict[Text, Any]:
+    owner, name = full_name.split("/")
+    return {"id": zlib.crc32(full_name.encode()),
+            "name": name,
+            "full_name": full_name,
+            "private": False,
+            "owner": {"login": owner, "type": "Organization"},
+            "html_url": "https://github.com/" + full_name,
+            "url": "{}/repos/{}".format(base_url, full_name)}
+
+
+def _sender(login: Text) -> Dict[Text, Any]:
+    return {"login": login, "id": zlib.crc32(login.encode()),
+            "type": "User", "site_admin": False}
+
+
+class Generator:
+    """Builds payloads referencing the state of a fake github.
+
+    `board` is a project as returned by `FakeGithub.add_board`, the
+    cards and labels that are referenced exist on `github`."""
+
+    def __init__(self, github, org: Text, board: Dict[Text, Any],
+                 repositories: List[Text], users: List[Text],
+                 seed: int = 42):
+        self.github = github
+        self.org = org
+        self.board = board
+        self.repositories = repositories
+        self.users = users
+        self.random = random.Random(seed)
+        self._labels = 0
+
+    def _card(self) -> Dict[Text, Any]:
+        column_id = self.random.choice(self.board["columns"])
+        cards = self.github.columns[column_id]["cards"]
+        return self.github._card_json(self.random.choice(cards))
+
+    def _base(self, repository: Text, action: Optional[Text] = None):
+        payload = {"repository": _repository(self.github.url, repository),
+                   "organization": {"login": self.org},
+                   "sender": _sender(self.random.choice(self.users))}
+        if action:
+            payload["action"] = action
+        return payload
+
+    def push(self):
+        repository = self.random.choice(self.repositories)
+        issues = len(self.github.repos[repository.lower()]["issues"])
+        commits = []
+        for i in range(self.random.randint(1, 5)):
+            message = "Fix a thing"
+            if self.random.random() < 0.6:
+                message += " (#{})".format(self.random.randint(1, issues))
+            commits.append({"id": uuid.UUID(int=self.random.getrandbits(128)
+                                            ).hex,
+                            "message": message,
+                            "distinct": True,
+                            "added": [], "removed": [],
+                            "modified": ["src/module_{}.py".format(i)],
+                            "author": {"name": "dev", "email": "d@x.com"}})
+        payload = self._base(repository)
+        payload.update({"ref": "refs/heads/master",
+                        "before": "0" * 40,
+                        "after": commits[-1]["id"],
+                        "pusher": {"name": payload["sender"]["login"]},
+                        "commits": commits,
+                        "head_commit": commits[-1]})
+        return "push", payload
+
+    def project_card(self, action):
+        card = self._card()
+        payload = self._base(self.random.choice(self.repositories), action)
+        if action == "moved":
+            payload["changes"] = {"column_id": {"from": card["column_id"]}}
+            card["column_id"] = self.random.choice(self.board["columns"])
+        payload["project_card"] = card
+        return "project_card", payload
+
+    def issue_comment(self, move=False):
+        repository = self.random.choice(self.repositories)
+        issue = self.random.randint(
+                1, len(self.github.repos[repository.lower()]["issues"]))
+        body = "Looks good to me"
+        if move:
+            targets = [r for r in self.repositories if r != repository]
+            body = "/move to {}".format(self.random.choice(targets))
+        payload = self._base(repository, "created")
+        payload.update({
+            "issue": {"number": issue, "title": "Issue {}".format(issue),
+                      "state": "open", "labels": [],
+                      "body": "Something is broken\n" * 5},
+            "comment": {"id": self.random.getrandbits(31), "body": body,
+                        "user": payload["sender"]}})
+        return "issue_comment", payload
+
+    def label(self, action):
+        repository = self.random.choice(self.repositories)
+        payload = self._base(repository, action)
+        if action == "created":
+            self._labels += 1
+            name = "label-{}".format(self._labels)
+        else:
+            last = max(1, self._labels)
+            name = "label-{}".format(self.random.randint(1, last))
+        payload["label"] = {"name": name, "color": "ff0000",
+                            "description": "", "default": False}
+        if action == "edited":
+            payload["changes"] = {"color": {"from": "00ff00"}}
+        return "label", payload
+
+    def issues_labeled(self):
+        repository = self.random.choice(self.repositories)
+        payload = self._base(repository, "labeled")
+        payload.update({"issue": {"number": 1, "labels": []},
+                        "label": {"name": "bug"}})
+        return "issues", payload
+
+    def generate(self, count: int,
+                 mix: Optional[Dict[Text, int]] = None) -> List[Delivery]:
+        mix = mix or DEFAULT_MIX
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        deliveries = []
+        for _ in range(count):
+            kind = self.random.choices(kinds, weights)[0]
+            if kind == "push":
+                event = self.push()
+            elif kind.startswith("project_card."):
+                event = self.project_card(kind.split(".")[1])
+            elif kind.startswith("issue_comment"):
+                event = self.issue_comment(move=kind.endswith(".move"))
+            elif kind.startswith("label."):
+                event = self.label(kind.split(".")[1])
+            else:
+                event = self.issues_labeled()
+            delivery_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+            deliveries.append(Delivery(event[0], event[1], delivery_id))
+        return deliveries
+
+
+def load(path: Text) -> Iterator[Delivery]:
+    """Read recorded deliveries, one json object per line with the
+    `event_type`, `payload` and optionally `delivery_id`."""
+
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield Delivery(record["event_type"],
+                           record["payload"],
+                           record.get("delivery_id") or "recorded-{}".format(i))
+
+
+def save(path: Text, deliveries: List[Delivery]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for d in deliveries:
+            f.write(json.dumps({"event_type": d.event_type,
+                                "payload": d.payload,
+                                "delivery_id": d.delivery_id}) + "\n")
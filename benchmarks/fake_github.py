@@ -0,0 +1,487 @@
+"""A local stand-in for the parts of the github REST API gflows uses.
+
+Keeps projects, cards, repositories, labels, issues, comments and
+collaborators in memory. Every response is delayed by `latency` seconds
+and carries rate limit headers, every request is counted by endpoint.
+GET responses carry an ETag, a matching `If-None-Match` is answered with
+a `304 Not Modified` that isn't counted against the rate limit."""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import (
+    Any, Callable, Dict, List, Mapping, Optional, Text, Tuple)
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from gflows.metrics import endpoint
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGithub:
+    """Serves a fake github API on `url` until `stop` is called."""
+
+    def __init__(self, latency: float = 0.0,
+                 rate_limit: int = 5000, reset: int = 3600,
+                 port: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.remaining = rate_limit
+        self.reset = int(time.time()) + reset
+        self.calls = Counter()
+        # requests answered with a 304
+        self.not_modified = 0
+        self._ids = iter(range(1000, 10 ** 12))
+        self._lock = threading.RLock()
+
+        # org -> project name -> project
+        self.projects: Dict[Text, Dict[Text, Dict]] = {}
+        self.columns: Dict[int, Dict] = {}
+        self.cards: Dict[int, Dict] = {}
+        # full name -> repository state
+        self.repos: Dict[Text, Dict] = {}
+        # answers GraphQL requests with the query and variables, there is
+        # no GraphQL schema behind the fake
+        self.graphql: Optional[Callable[[Text, Dict], Dict]] = None
+
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self.url = "http://127.0.0.1:{}".format(self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="fake-github",
+                                        daemon=True)
+        self._routes = [
+            ("GET", r"/orgs/([^/]+)/projects", self._list_projects),
+            ("GET", r"/projects/(\d+)", self._get_project),
+            ("GET", r"/projects/(\d+)/columns", self._list_columns),
+            ("GET", r"/projects/columns/(\d+)/cards", self._list_cards),
+            ("POST", r"/projects/columns/(\d+)/cards", self._create_card),
+            ("GET", r"/projects/columns/cards/(\d+)", self._get_card),
+            ("DELETE", r"/projects/columns/cards/(\d+)", self._delete_card),
+            ("POST", r"/projects/columns/cards/(\d+)/moves",
+             self._move_card),
+            ("GET", r"/repos/([^/]+/[^/]+)", self._get_repo),
+            ("GET", r"/repos/([^/]+/[^/]+)/labels", self._list_labels),
+            ("POST", r"/repos/([^/]+/[^/]+)/labels", self._create_label),
+            ("GET", r"/repos/([^/]+/[^/]+)/labels/([^/]+)", self._get_label),
+            ("PATCH", r"/repos/([^/]+/[^/]+)/labels/([^/]+)",
+             self._edit_label),
+            ("DELETE", r"/repos/([^/]+/[^/]+)/labels/([^/]+)",
+             self._delete_label),
+            ("POST", r"/repos/([^/]+/[^/]+)/issues", self._create_issue),
+            ("GET", r"/repos/([^/]+/[^/]+)/issues/(\d+)", self._get_issue),
+            ("PATCH", r"/repos/([^/]+/[^/]+)/issues/(\d+)",
+             self._edit_issue),
+            ("GET", r"/repos/([^/]+/[^/]+)/issues/(\d+)/comments",
+             self._list_comments),
+            ("POST", r"/repos/([^/]+/[^/]+)/issues/(\d+)/comments",
+             self._create_comment),
+            ("GET", r"/repos/([^/]+/[^/]+)/collaborators/([^/]+)/permission",
+             self._get_permission),
+            ("POST", r"(?:/api)?/graphql", self._graphql),
+        ]
+        self._routes = [(verb, re.compile(pattern + "$"), handler)
+                        for verb, pattern, handler in self._routes]
+
+    def start(self) -> "FakeGithub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    # --- fixtures
+
+    def add_repo(self, full_name: Text, labels: List[Text] = (),
+                 issues: int = 0,
+                 collaborators: Optional[Dict[Text, Text]] = None) -> None:
+        repo = self.repos[full_name.lower()] = {
+            "id": self._next_id(),
+            "full_name": full_name,
+            "labels": {},
+            "issues": {},
+            "collaborators": dict(collaborators or {}),
+        }
+        for name in labels:
+            repo["labels"][name] = self._label_json(full_name, name)
+        for number in range(1, issues + 1):
+            self._add_issue(repo, number, "Issue {}".format(number), "")
+
+    def add_board(self, org: Text, name: Text, columns: List[Text],
+                  cards: int, repo: Text) -> Dict[Text, Any]:
+        """Add a project with `cards` issue cards spread over the
+        columns, the issues are created on `repo` as needed."""
+
+        project_id = self._next_id()
+        project = {"id": project_id,
+                   "node_id": "P{}".format(project_id),
+                   "name": name,
+                   "url": "{}/projects/{}".format(self.url, project_id),
+                   "columns_url": "{}/projects/{}/columns".format(
+                           self.url, project_id),
+                   "columns": []}
+        self.projects.setdefault(org.lower(), {})[name] = project
+
+        for column_name in columns:
+            column_id = self._next_id()
+            self.columns[column_id] = {
+                "id": column_id,
+                "name": column_name,
+                "project_id": project_id,
+                "url": "{}/projects/columns/{}".format(self.url, column_id),
+                "project_url": project["url"],
+                "cards": []}
+            project["columns"].append(column_id)
+
+        state = self.repos[repo.lower()]
+        for i in range(cards):
+            number = i + 1
+            if number not in state["issues"]:
+                self._add_issue(state, number, "Issue {}".format(number), "")
+            column_id = project["columns"][i % len(columns)]
+            self._add_card(column_id, state["issues"][number], top=False)
+        return project
+
+    def _label_json(self, repo, name, color="ededed", description=""):
+        return {"id": self._next_id(),
+                "name": name,
+                "color": color,
+                "description": description,
+                "url": "{}/repos/{}/labels/{}".format(self.url, repo,
+                                                      quote(name))}
+
+    def _add_issue(self, repo, number, title, body):
+        issue_url = "{}/repos/{}/issues/{}".format(
+                self.url, repo["full_name"], number)
+        issue = repo["issues"][number] = {
+            "id": self._next_id(),
+            "number": number,
+            "title": title,
+            "body": body,
+            "state": "open",
+            "url": issue_url,
+            "html_url": issue_url,
+            "labels": [],
+            "assignees": [],
+            "user": {"login": "octocat"},
+            "comments": []}
+        return issue
+
+    def _add_card(self, column_id, issue, top=True):
+        card_id = self._next_id()
+        self.cards[card_id] = {"id": card_id,
+                               "node_id": "C{}".format(card_id),
+                               "content_url": issue["url"],
+                               "column_id": column_id,
+                               "note": None}
+        cards = self.columns[column_id]["cards"]
+        if top:
+            cards.insert(0, card_id)
+        else:
+            cards.append(card_id)
+        return card_id
+
+    def _card_json(self, card_id):
+        card = dict(self.cards[card_id])
+        card["url"] = "{}/projects/columns/cards/{}".format(self.url, card_id)
+        card["column_url"] = self.columns[card["column_id"]]["url"]
+        card["project_url"] = self.columns[card["column_id"]]["project_url"]
+        return card
+
+    # --- request handling
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, data, headers = fake.handle(self.command, self.path,
+                                                    body, self.headers)
+                output = json.dumps(data).encode() if data is not None \
+                    else b""
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(output)))
+                self.end_headers()
+                self.wfile.write(output)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, verb: Text, path: Text, body: bytes,
+               request_headers: Optional[Mapping[Text, Text]] = None
+               ) -> Tuple[int, Any, Dict[Text, Text]]:
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = urlsplit(path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        self.calls[(verb, endpoint(parts.path))] += 1
+
+        with self._lock:
+            self.remaining = max(0, self.remaining - 1)
+            headers = {"X-RateLimit-Limit": str(self.rate_limit),
+                       "X-RateLimit-Remaining": str(self.remaining),
+                       "X-RateLimit-Reset": str(self.reset)}
+
+        path = parts.path
+        if path.startswith("/api/v3/"):
+            # github enterprise
+            path = path[len("/api/v3"):]
+
+        for route_verb, pattern, handler in self._routes:
+            match = pattern.match(path)
+            if route_verb == verb and match:
+                args = [unquote(a) for a in match.groups()]
+                payload = json.loads(body.decode()) if body else None
+                with self._lock:
+                    result = handler(query, payload, *args)
+                status, data = result[:2]
+                if len(result) > 2:
+                    headers.update(result[2])
+                if verb == "GET" and status == 200:
+                    return self._conditional(path, data, headers,
+                                             request_headers or {})
+                return status, data, headers
+        return 404, {"message": "Not Found"}, headers
+
+    def _conditional(self, path, data, headers, request_headers):
+        """Tag a response, answer `304 Not Modified` if it is unchanged."""
+
+        # the url makes the etags of different servers differ
+        digest = hashlib.sha1(json.dumps([self.url, path, data],
+                                         sort_keys=True).encode())
+        etag = '"{}"'.format(digest.hexdigest())
+        headers["ETag"] = etag
+        if request_headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified += 1
+                # github doesn't count conditional requests answered
+                # with a 304
+                self.remaining += 1
+                headers["X-RateLimit-Remaining"] = str(self.remaining)
+            return 304, None, headers
+        return 200, data, headers
+
+    def _page(self, path, query, items, render=None):
+        """Return a page of a listing with a link to the next page."""
+
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            headers["Link"] = '<{}{}?per_page={}&page={}>; rel="next"'.format(
+                    self.url, path, per_page, page + 1)
+        page_items = items[start:start + per_page]
+        if render:
+            page_items = [render(item) for item in page_items]
+        return 200, page_items, headers
+
+    def _list_projects(self, query, payload, org):
+        projects = [{k: v for k, v in p.items() if k != "columns"}
+                    for p in self.projects.get(org.lower(), {}).values()]
+        return self._page("/orgs/{}/projects".format(org), query, projects)
+
+    def _find_project(self, project_id):
+        for projects in self.projects.values():
+            for project in projects.values():
+                if project["id"] == project_id:
+                    return project
+        return None
+
+    def _get_project(self, query, payload, project_id):
+        project = self._find_project(int(project_id))
+        if project is None:
+            return 404, {"message": "Not Found"}
+        return 200, {k: v for k, v in project.items() if k != "columns"}
+
+    def _list_columns(self, query, payload, project_id):
+        project = self._find_project(int(project_id))
+        if project is None:
+            return 404, {"message": "Not Found"}
+        columns = [{k: v for k, v in self.columns[c].items() if k != "cards"}
+                   for c in project["columns"]]
+        return self._page("/projects/{}/columns".format(project_id), query,
+                          columns)
+
+    def _list_cards(self, query, payload, column_id):
+        column = self.columns.get(int(column_id))
+        if column is None:
+            return 404, {"message": "Not Found"}
+        return self._page("/projects/columns/{}/cards".format(column_id),
+                          query, column["cards"], self._card_json)
+
+    def _create_card(self, query, payload, column_id):
+        issue = None
+        for repo in self.repos.values():
+            for candidate in repo["issues"].values():
+                if candidate["id"] == payload["content_id"]:
+                    issue = candidate
+        if issue is None or int(column_id) not in self.columns:
+            return 422, {"message": "Validation Failed"}
+        return 201, self._card_json(self._add_card(int(column_id), issue))
+
+    def _get_card(self, query, payload, card_id):
+        if int(card_id) not in self.cards:
+            return 404, {"message": "Not Found"}
+        return 200, self._card_json(int(card_id))
+
+    def _delete_card(self, query, payload, card_id):
+        card = self.cards.pop(int(card_id), None)
+        if card is None:
+            return 404, {"message": "Not Found"}
+        self.columns[card["column_id"]]["cards"].remove(int(card_id))
+        return 204, None
+
+    def _move_card(self, query, payload, card_id):
+        card = self.cards.get(int(card_id))
+        target = self.columns.get(payload["column_id"])
+        if card is None or target is None:
+            return 422, {"message": "Validation Failed"}
+        self.columns[card["column_id"]]["cards"].remove(card["id"])
+        target["cards"].insert(0, card["id"])
+        card["column_id"] = target["id"]
+        return 201, {}
+
+    def _repo(self, full_name):
+        return self.repos.get(full_name.lower())
+
+    def _get_repo(self, query, payload, full_name):
+        repo = self._repo(full_name)
+        if repo is None:
+            return 404, {"message": "Not Found"}
+        owner, name = repo["full_name"].split("/")
+        return 200, {"id": repo["id"],
+                     "name": name,
+                     "full_name": repo["full_name"],
+                     "owner": {"login": owner},
+                     "private": False,
+                     "url": "{}/repos/{}".format(self.url,
+                                                 repo["full_name"])}
+
+    def _list_labels(self, query, payload, full_name):
+        repo = self._repo(full_name)
+        if repo is None:
+            return 404, {"message": "Not Found"}
+        return self._page("/repos/{}/labels".format(full_name), query,
+                          list(repo["labels"].values()))
+
+    def _create_label(self, query, payload, full_name):
+        repo = self._repo(full_name)
+        if repo is None or payload["name"] in repo["labels"]:
+            return 422, {"message": "Validation Failed"}
+        label = repo["labels"][payload["name"]] = self._label_json(
+                repo["full_name"], payload["name"], payload.get("color"),
+                payload.get("description", ""))
+        return 201, label
+
+    def _get_label(self, query, payload, full_name, name):
+        repo = self._repo(full_name)
+        if repo is None or name not in repo["labels"]:
+            return 404, {"message": "Not Found"}
+        return 200, repo["labels"][name]
+
+    def _edit_label(self, query, payload, full_name, name):
+        repo = self._repo(full_name)
+        if repo is None or name not in repo["labels"]:
+            return 404, {"message": "Not Found"}
+        # like github, fields that aren't sent are kept
+        label = repo["labels"].pop(name)
+        new_name = payload.get("new_name", payload.get("name", name))
+        label = repo["labels"][new_name] = self._label_json(
+                repo["full_name"], new_name,
+                payload.get("color", label["color"]),
+                payload.get("description", label["description"]))
+        return 200, label
+
+    def _delete_label(self, query, payload, full_name, name):
+        repo = self._repo(full_name)
+        if repo is None or repo["labels"].pop(name, None) is None:
+            return 404, {"message": "Not Found"}
+        return 204, None
+
+    def _issue_json(self, issue):
+        return {k: v for k, v in issue.items() if k != "comments"}
+
+    def _create_issue(self, query, payload, full_name):
+        repo = self._repo(full_name)
+        if repo is None:
+            return 404, {"message": "Not Found"}
+        issue = self._add_issue(repo, len(repo["issues"]) + 1,
+                                payload["title"], payload.get("body", ""))
+        return 201, self._issue_json(issue)
+
+    def _get_issue(self, query, payload, full_name, number):
+        repo = self._repo(full_name)
+        if repo is None or int(number) not in repo["issues"]:
+            return 404, {"message": "Not Found"}
+        return 200, self._issue_json(repo["issues"][int(number)])
+
+    def _edit_issue(self, query, payload, full_name, number):
+        repo = self._repo(full_name)
+        if repo is None or int(number) not in repo["issues"]:
+            return 404, {"message": "Not Found"}
+        issue = repo["issues"][int(number)]
+        issue.update({k: v for k, v in payload.items()
+                      if k in ("title", "body", "state")})
+        return 200, self._issue_json(issue)
+
+    def _list_comments(self, query, payload, full_name, number):
+        repo = self._repo(full_name)
+        if repo is None or int(number) not in repo["issues"]:
+            return 404, {"message": "Not Found"}
+        return self._page(
+                "/repos/{}/issues/{}/comments".format(full_name, number),
+                query, repo["issues"][int(number)]["comments"])
+
+    def _create_comment(self, query, payload, full_name, number):
+        repo = self._repo(full_name)
+        if repo is None or int(number) not in repo["issues"]:
+            return 404, {"message": "Not Found"}
+        comment = {"id": self._next_id(),
+                   "body": payload["body"],
+                   "user": {"login": "gflows",
+                            "html_url": "https://github.com/gflows"},
+                   "created_at": "2019-01-01T00:00:00Z"}
+        repo["issues"][int(number)]["comments"].append(comment)
+        return 201, comment
+
+    def _get_permission(self, query, payload, full_name, user):
+        repo = self._repo(full_name)
+        if repo is None:
+            return 404, {"message": "Not Found"}
+        return 200, {"permission": repo["collaborators"].get(user, "read"),
+                     "user": {"login": user}}
+
+    def _graphql(self, query, payload):
+        if self.graphql is None:
+            return 404, {"message": "Not Found"}
+        return 200, self.graphql(payload["query"],
+                                 payload.get("variables") or {})
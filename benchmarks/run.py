@@ -0,0 +1,306 @@
+"""Measure how fast the workflows handle webhooks against a fake github.
+
+Replays a corpus of deliveries through the webhook server and reports
+the throughput, latency percentiles and github requests per event, then
+times `MoveIssues.start` on boards of different sizes. Results are
+written as json, a previous result can be given to spot regressions:
+
+    python -m benchmarks.run --output results.json --compare baseline.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Text
+
+from benchmarks import corpus
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.flows import (
+    CloseIssuesInColumn, MoveIssues, ShareLabelsAccrossRepositories)
+from gflows.version import __version__
+
+logger = logging.getLogger(__name__)
+
+ORG = "bench"
+PROJECT = "Sprint Board"
+COLUMNS = ["To do", "In progress", "Review", "Done"]
+REPOSITORIES = ["bench/api", "bench/web", "bench/docs"]
+USERS = ["alice", "bob", "carol", "dave"]
+
+# metrics where a higher value is worse, see `compare`
+LOWER_IS_BETTER = ("_ms", "api_calls_per_event", "api_calls", "seconds")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Return the `q` percentile (0 - 100) using the nearest rank."""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, int(round(q / 100.0 * len(ordered) + 0.5)) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _summary(latencies: List[float], calls: int,
+             events: int) -> Dict[Text, Any]:
+    return {"events": events,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "api_calls_per_event": round(calls / max(1, events), 3)}
+
+
+def _workflows(github: FakeGithub) -> Workflows:
+    workflows = Workflows("benchmark-token",
+                          base_url=github.url,
+                          per_page=100)
+    workflows.add(MoveIssues(org=ORG,
+                             project_name=PROJECT,
+                             origin_column="In progress",
+                             target_column="Review"))
+    workflows.add(CloseIssuesInColumn(org=ORG,
+                                      project_name=PROJECT,
+                                      column="Done"))
+    workflows.add(ShareLabelsAccrossRepositories(REPOSITORIES))
+    return workflows
+
+
+def replay(github: FakeGithub, deliveries: List[corpus.Delivery],
+           concurrency: int = 1) -> Dict[Text, Any]:
+    """Post the deliveries to the webhook server.
+
+    Without a dispatcher the hooks run before the server answers, so
+    the latency covers handling the event. The github requests of an
+    event type are only known with a `concurrency` of 1."""
+
+    workflows = _workflows(github)
+    app = workflows.app()
+    local = threading.local()
+    results = []
+
+    def post(delivery: corpus.Delivery):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        calls = github.total_calls
+        started = time.perf_counter()
+        response = client.post("/postreceive",
+                               data=delivery.body,
+                               content_type="application/json",
+                               headers={"X-Github-Event": delivery.event_type,
+                                        "X-Github-Delivery":
+                                            delivery.delivery_id})
+        latency = time.perf_counter() - started
+        results.append((delivery.event_type, latency,
+                        github.total_calls - calls, response.status_code))
+
+    calls = github.total_calls
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, deliveries))
+    duration = time.perf_counter() - started
+    calls = github.total_calls - calls
+    workflows.shutdown()
+
+    by_type = defaultdict(list)
+    for result in results:
+        by_type[result[0]].append(result)
+
+    event_types = {}
+    for event_type, rows in sorted(by_type.items()):
+        event_types[event_type] = _summary(
+                [r[1] for r in rows],
+                sum(r[2] for r in rows),
+                len(rows))
+        if concurrency > 1:
+            event_types[event_type]["api_calls_per_event"] = None
+
+    total = _summary([r[1] for r in results], calls, len(results))
+    total.update({
+        "seconds": round(duration, 3),
+        "events_per_second": round(len(results) / duration, 2),
+        "errors": sum(1 for r in results if r[3] >= 400),
+        "event_types": event_types,
+    })
+    return total
+
+
+def startup(sizes: List[int], latency: float,
+            rate_limit: int = 5000, reset: int = 3600,
+            scan_workers: int = 8) -> List[Dict[Text, Any]]:
+    """Time `MoveIssues.start` on boards with `sizes` cards, each on a
+    fake github announcing a fresh `rate_limit`."""
+
+    results = []
+    for size in sizes:
+        github = FakeGithub(latency=latency,
+                            rate_limit=rate_limit,
+                            reset=reset).start()
+        try:
+            # a fresh org per board, project ids are cached by org
+            org = "startup-{}".format(size)
+            repo = "{}/issues".format(org)
+            github.add_repo(repo)
+            github.add_board(org, PROJECT, COLUMNS, size, repo)
+
+            workflows = Workflows("benchmark-token",
+                                  base_url=github.url,
+                                  per_page=100)
+            workflow = MoveIssues(org=org,
+                                  project_name=PROJECT,
+                                  origin_column="In progress",
+                                  target_column="Review",
+                                  scan_workers=scan_workers)
+            started = time.perf_counter()
+            workflow.start(workflows.gh)
+            duration = time.perf_counter() - started
+            results.append({"cards": size,
+                            "indexed": len(workflow.cards),
+                            "seconds": round(duration, 3),
+                            "api_calls": github.total_calls})
+            logger.info("Indexed {} cards in {:.2f}s.".format(size,
+                                                              duration))
+        finally:
+            github.stop()
+    return results
+
+
+def compare(result: Dict[Text, Any], baseline: Dict[Text, Any],
+            tolerance: float) -> List[Text]:
+    """Return the metrics that got worse by more than `tolerance`."""
+
+    def flatten(data, prefix=""):
+        values = {}
+        if isinstance(data, dict):
+            for key, value in data.items():
+                values.update(flatten(value, prefix + key + "."))
+        elif isinstance(data, list):
+            for item in data:
+                # startup results are identified by the board size
+                values.update(flatten(
+                        item, "{}{}.".format(prefix, item.get("cards"))))
+        elif (isinstance(data, (int, float))
+              and not isinstance(data, bool)):
+            values[prefix[:-1]] = data
+        return values
+
+    current = flatten({"replay": result.get("replay"),
+                       "startup": result.get("startup")})
+    previous = flatten({"replay": baseline.get("replay"),
+                        "startup": baseline.get("startup")})
+
+    regressions = []
+    for key, value in sorted(current.items()):
+        old = previous.get(key)
+        if not old:
+            continue
+        if key.endswith(LOWER_IS_BETTER):
+            change = (value - old) / old
+        elif key.endswith("events_per_second"):
+            change = (old - value) / old
+        else:
+            continue
+        if change > tolerance:
+            regressions.append("{}: {} -> {} ({:.0%} worse)".format(
+                    key, old, value, change))
+    return regressions
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(
+            description="Benchmark gflows against a fake github.")
+    parser.add_argument("--events", type=int, default=500,
+                        help="number of generated deliveries to replay")
+    parser.add_argument("--corpus",
+                        help="replay recorded deliveries from this file "
+                             "(json lines) instead of generated ones")
+    parser.add_argument("--save-corpus",
+                        help="write the replayed deliveries to this file")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="deliveries posted at the same time")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the fake github takes per request")
+    parser.add_argument("--rate-limit", type=int, default=5000,
+                        help="rate limit announced by the fake github, "
+                             "github allows 5000 requests an hour")
+    parser.add_argument("--reset", type=int, default=3600,
+                        help="seconds until the announced limit resets")
+    parser.add_argument("--issues", type=int, default=500,
+                        help="issues per repository of the replay")
+    parser.add_argument("--boards", default="100,10000,100000",
+                        help="card counts of the startup boards, an "
+                             "empty value skips the startup benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slow down before --compare fails")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="WARNING")
+    logger.setLevel("INFO")
+
+    github = FakeGithub(latency=args.latency,
+                        rate_limit=args.rate_limit,
+                        reset=args.reset).start()
+    try:
+        for repo in REPOSITORIES:
+            github.add_repo(repo,
+                            labels=["bug", "enhancement"],
+                            issues=args.issues,
+                            collaborators={u: "write" for u in USERS})
+        board = github.add_board(ORG, PROJECT, COLUMNS, args.issues,
+                                 REPOSITORIES[0])
+        if args.corpus:
+            deliveries = list(corpus.load(args.corpus))
+        else:
+            deliveries = corpus.Generator(github, ORG, board, REPOSITORIES,
+                                          USERS, args.seed
+                                          ).generate(args.events)
+        if args.save_corpus:
+            corpus.save(args.save_corpus, deliveries)
+
+        logger.info("Replaying {} deliveries.".format(len(deliveries)))
+        replay_result = replay(github, deliveries, args.concurrency)
+    finally:
+        github.stop()
+
+    sizes = [int(s) for s in args.boards.split(",") if s.strip()]
+    result = {
+        "meta": {
+            "gflows": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "parameters": vars(args),
+        },
+        "replay": replay_result,
+        "startup": startup(sizes, args.latency, args.rate_limit,
+                           args.reset),
+    }
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
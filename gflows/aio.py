@@ -0,0 +1,378 @@
+"""Asyncio webhook server and github client.
+
+Needs the `aio` extra (`pip install gflows[aio]`)."""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Collection, Dict, Optional, Text, Tuple
+
+import aiohttp
+from aiohttp import web
+from github import (
+    GithubException, BadCredentialsException, UnknownObjectException)
+from github.MainClass import DEFAULT_BASE_URL, DEFAULT_TIMEOUT
+
+from gflows import metrics
+from gflows.coalesce import Coalescer
+from gflows.dedup import Deduplicator
+from gflows.dispatch import QueueFullError
+from gflows.journal import Journal
+from gflows.scheduler import scheduler, NORMAL
+from gflows.server import _adapt_hook, _decode, _format_event
+from gflows.tracing import tracer, child_span
+from gflows.workflow import Workflows, _HookRun
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGithub:
+    """Asyncio client for the github REST API.
+
+    Keeps a pool of up to `limit` connections open, so many requests can
+    be in flight without a thread each. Requests are paced by the same
+    scheduler as the PyGithub requests of the process."""
+
+    def __init__(self, login_or_token=None, password=None,
+                 base_url: Text = DEFAULT_BASE_URL,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 limit: int = 100):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limit = limit
+        self._headers = {"User-Agent": "gflows"}
+        self._auth = None
+        if password is not None:
+            self._auth = aiohttp.BasicAuth(login_or_token, password)
+        elif login_or_token is not None:
+            self._headers["Authorization"] = "token " + login_or_token
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.limit),
+                    headers=self._headers,
+                    auth=self._auth,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def request_json(self, verb: Text, url: Text,
+                           parameters: Optional[Dict[Text, Any]] = None,
+                           headers: Optional[Dict[Text, Text]] = None,
+                           input: Optional[Any] = None,
+                           priority: int = NORMAL
+                           ) -> Tuple[int, Dict[Text, Text], Text]:
+        """Send a request, returns the status, headers and raw body.
+
+        Throttled requests are retried like the PyGithub ones."""
+
+        if not url.startswith("http"):
+            url = self.base_url + url
+        headers = dict(headers or {})
+        data = None
+        if input is not None:
+            headers["Content-Type"] = "application/json"
+            data = json.dumps(input)
+
+        for attempt in range(scheduler.max_retries + 1):
+            await scheduler.acquire_async(priority)
+            async with self.session.request(verb, url,
+                                            params=parameters,
+                                            headers=headers,
+                                            data=data) as response:
+                status = response.status
+                response_headers = {k.lower(): v
+                                    for k, v in response.headers.items()}
+                output = await response.text()
+            metrics.github_requests.inc(verb,
+                                        metrics.endpoint(response.url.path),
+                                        status)
+            throttled = scheduler.update(status, response.headers, output,
+                                         priority)
+            if not throttled:
+                break
+        return status, response_headers, output
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+def check(status: int, headers: Dict[Text, Text],
+          output: Text) -> Tuple[Dict[Text, Text], Any]:
+    """Decode a response, raising the exceptions of PyGithub for failed
+    requests."""
+
+    data = json.loads(output) if output else None
+    if status == 401:
+        raise BadCredentialsException(status, data)
+    elif status == 404:
+        raise UnknownObjectException(status, data)
+    elif status >= 400:
+        raise GithubException(status, data)
+    return headers, data
+
+
+def create_app(hook, gh_secret=None, accepts=None, ready=None,
+               decode=None, debug=False) -> web.Application:
+    """Create an aiohttp app receiving the github webhooks.
+
+    Takes the same arguments as `server.create_app`. `hook` can also be
+    a coroutine function, other hooks are run on the default executor."""
+
+    app = web.Application()
+    decode = decode or _decode
+    hook = _adapt_hook(hook)
+
+    def is_ready():
+        return ready is None or ready()
+
+    def get_header(request, key):
+        try:
+            return request.headers[key]
+        except KeyError:
+            raise web.HTTPBadRequest(text='Missing header: ' + key)
+
+    async def health(request):
+        if not is_ready():
+            return web.Response(text="starting up", status=503)
+        return web.Response(text="all save and sound")
+
+    async def prometheus_metrics(request):
+        return web.Response(text=metrics.registry.render())
+
+    async def on_push(request):
+        if not is_ready():
+            raise web.HTTPServiceUnavailable(text='Starting up')
+
+        event_type = get_header(request, 'X-Github-Event')
+        if accepts is not None and not accepts(event_type):
+            logger.debug('Skipping unsubscribed event %s', event_type)
+            return web.Response(status=204)
+
+        raw = await request.read()
+
+        if gh_secret:
+            digest = hmac.new(gh_secret, raw, hashlib.sha1).hexdigest()
+            sig_parts = get_header(request, 'X-Hub-Signature').split('=', 1)
+
+            if (len(sig_parts) < 2 or sig_parts[0] != 'sha1'
+                    or not hmac.compare_digest(sig_parts[1], digest)):
+                raise web.HTTPBadRequest(text='Invalid signature')
+
+        # forged deliveries must not push out the traces of real ones
+        delivery_id = request.headers.get('X-Github-Delivery')
+        trace = tracer.begin(delivery_id)
+        try:
+            with child_span(trace.root if trace else None, "receive",
+                            event_type=event_type) as span:
+                return await receive(request, raw, event_type, span)
+        except Exception:
+            tracer.discard(delivery_id)
+            raise
+
+    async def receive(request, raw, event_type, span):
+        with child_span(span, "decode"):
+            try:
+                data = decode(event_type, raw)
+            except ValueError:
+                raise web.HTTPBadRequest(
+                        text='Request body must contain json')
+
+        delivery_id = get_header(request, 'X-Github-Delivery')
+
+        if data is None:
+            logger.debug('Skipping unhandled %s event', event_type)
+            tracer.discard(delivery_id)
+            return web.Response(status=204)
+
+        logger.info('%s (%s)', _format_event(event_type, data), delivery_id)
+
+        try:
+            with child_span(span, "dispatch"):
+                if asyncio.iscoroutinefunction(hook):
+                    await hook(event_type, data, delivery_id)
+                else:
+                    await asyncio.get_event_loop().run_in_executor(
+                            None, hook, event_type, data, delivery_id)
+        except QueueFullError:
+            raise web.HTTPServiceUnavailable(text='Too many queued events')
+
+        return web.Response(status=204)
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", prometheus_metrics)
+
+    if debug:
+        async def slow_deliveries(request):
+            return web.json_response(
+                    [{"delivery_id": t.delivery_id,
+                      "duration_ms": round(t.root.duration * 1000)}
+                     for t in tracer.traces])
+
+        async def delivery_trace(request):
+            delivery_id = request.match_info["delivery_id"]
+            trace = tracer.get(delivery_id)
+            if trace is None:
+                raise web.HTTPNotFound(
+                        text='No trace of delivery ' + delivery_id)
+            return web.json_response(trace.as_dict())
+
+        async def set_sampling(request):
+            """Change the tracing with `?rate=0.1&threshold=2.5`"""
+
+            try:
+                tracer.sample_rate = float(request.query.get(
+                        "rate", tracer.sample_rate))
+                tracer.threshold = float(request.query.get(
+                        "threshold", tracer.threshold))
+            except ValueError:
+                raise web.HTTPBadRequest(text='Invalid number')
+            return web.json_response({"rate": tracer.sample_rate,
+                                      "threshold": tracer.threshold})
+
+        app.router.add_get("/deliveries", slow_deliveries)
+        app.router.add_put("/deliveries/sampling", set_sampling)
+        app.router.add_get("/deliveries/{delivery_id}", delivery_trace)
+    app.router.add_post("/postreceive", on_push)
+    return app
+
+
+class AsyncWorkflows(Workflows):
+    """Runs the workflows on an asyncio event loop.
+
+    Workflows with an `async def hook` are called with an `AsyncGithub`
+    client instead of a `Github` one and run on the loop. Other hooks
+    run on a pool of `workers` threads. At most `max_pending` events are
+    handled at once, further deliveries are rejected with a 503."""
+
+    def __init__(self, login_or_token=None, password=None, secret=None,
+                 journal: Optional[Journal] = None,
+                 deduplicator: Optional[Deduplicator] = None,
+                 coalescer: Optional[Coalescer] = None,
+                 workers: int = 4,
+                 max_pending: int = 100,
+                 connections: int = 100,
+                 **kwargs):
+        if kwargs.get("dispatcher") is not None:
+            raise ValueError("AsyncWorkflows runs the hooks itself, use "
+                             "`workers` and `max_pending` instead of a "
+                             "dispatcher.")
+        super().__init__(login_or_token, password, secret,
+                         journal=journal,
+                         deduplicator=deduplicator,
+                         coalescer=coalescer,
+                         **kwargs)
+        self.agh = AsyncGithub(login_or_token, password,
+                               base_url=kwargs.get(
+                                       "base_url", DEFAULT_BASE_URL),
+                               limit=connections)
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="gflows-hook")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _submit(self, event_type, payload, delivery_id=None,
+                completed: Collection[Text] = ()):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise QueueFullError("{} events pending."
+                                     "".format(self.pending))
+            self.pending += 1
+
+        # called from the server executor and the journal replay thread
+        future = asyncio.run_coroutine_threadsafe(
+                self.hook_async(event_type, payload, delivery_id, completed),
+                self._loop)
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    async def hook_async(self, event_type, payload, delivery_id=None,
+                         completed: Collection[Text] = ()):
+        """Run the subscribed workflows on an event.
+
+        Workflows listed in `completed` already handled the event."""
+
+        run = _HookRun(self, event_type, payload, delivery_id, completed,
+                       None)
+        for workflow in run:
+            with run.call(workflow), \
+                    child_span(tracer.root(delivery_id), "hook",
+                               workflow=workflow.name) as span:
+                workflow.observe(event_type, payload)
+                if asyncio.iscoroutinefunction(workflow.hook):
+                    await workflow.hook(event_type, payload, self.agh)
+                else:
+                    await self._loop.run_in_executor(
+                            self._executor, self._run_hook, span,
+                            workflow, event_type, payload)
+
+        self._settle(delivery_id, run.failed)
+
+    def _run_hook(self, span, workflow, event_type, payload):
+        with tracer.activate(span):
+            workflow.hook(event_type, payload, self.gh)
+
+    def _pending_events(self) -> Optional[int]:
+        return self.pending
+
+    def app(self, wait=True) -> web.Application:
+        """Create the webhook server.
+
+        If `wait` is `False`, the workflows are started in the background
+        and the server answers with a 503 until they are ready."""
+
+        app = create_app(self.receive, self.secret,
+                         accepts=self.subscribed,
+                         ready=self.ready.is_set,
+                         decode=self.decode,
+                         debug=self.debug)
+
+        async def on_startup(app):
+            self._loop = asyncio.get_event_loop()
+            started = self._loop.run_in_executor(None, self.start)
+            if wait:
+                await started
+            else:
+                started.add_done_callback(self._log_start_failure)
+
+        async def on_cleanup(app):
+            await self.shutdown_async()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+    @staticmethod
+    def _log_start_failure(future):
+        if future.exception() is not None:
+            logger.error("Failed to start the workflows.",
+                         exc_info=future.exception())
+
+    async def shutdown_async(self):
+        """Wait for pending events to be processed."""
+
+        self.ready.clear()
+        if self.coalescer:
+            # held events are added to the pending ones
+            await self._loop.run_in_executor(None, self.coalescer.shutdown)
+        logger.info("Waiting for {} pending events.".format(self.pending))
+        while self.pending:
+            await asyncio.sleep(0.1)
+        await self._loop.run_in_executor(None, self.shutdown)
+        self._executor.shutdown()
+        await self.agh.close()
+
+    def run(self, port=8383, wait=True):
+        web.run_app(self.app(wait), host="0.0.0.0", port=port)
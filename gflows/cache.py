@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Size bounded LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int = 4096, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Return the cached value, calling `load` if there is none."""
+
+        value = self.peek(key, _MISSING)
+        if value is _MISSING:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or `default` if there is none."""
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = time.time() + self.ttl, value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry, returns `default` if it is missing or expired."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return entry[1]
+
+    def invalidate(self, kind: Text, repo: Optional[Text] = None) -> None:
+        """Drop all entries of a kind, optionally only for one repo.
+
+        Keys are tuples starting with the kind and the repository."""
+
+        repo = repo.lower() if repo else None
+        with self._lock:
+            stale = [k
+                     for k in self._entries
+                     if k[0] == kind and (repo is None or k[1] == repo)]
+            for k in stale:
+                del self._entries[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class GithubCache(TTLCache):
+    """Cache for github objects that is kept fresh by webhook events."""
+
+    # kinds of entries that go stale on an event type
+    INVALIDATED_BY = {
+        "member": ["permission"],
+        "membership": ["permission"],
+        "team": ["permission"],
+        "team_add": ["permission"],
+        "label": ["labels"],
+        "repository": ["repo", "labels", "permission"],
+    }
+
+    def observe(self, event_type: Text, payload: Dict[Text, Any]) -> None:
+        """Invalidate the entries affected by a webhook event."""
+
+        kinds = self.INVALIDATED_BY.get(event_type)
+        if not kinds:
+            return
+
+        if (event_type == "membership"
+                or payload.get("action") in {"renamed", "transferred"}):
+            # affects all repositories of a team or the repo's old name
+            repo = None
+        else:
+            repo = (payload.get("repository") or {}).get("full_name")
+
+        for kind in kinds:
+            self.invalidate(kind, repo)
+        logger.debug("Invalidated cached {} of {} after {} event".format(
+                ", ".join(kinds), repo or "all repositories", event_type))
+
+
+# shared by all flows
+github_cache = GithubCache()
@@ -0,0 +1,205 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Text
+
+from gflows import metrics
+from gflows.dispatch import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# how long to wait before forwarding again if the workers are busy
+RETRY_INTERVAL = 0.05
+
+
+def coalesce_key(event_type: Text,
+                 payload: Dict[Text, Any]) -> Optional[Text]:
+    """Return the entity whose whole state an event carries.
+
+    Cards are keyed by id, labels by repository and name (a rename
+    belongs to the old name). Labels are not merged across the
+    repositories sharing them: a change in one repository could be
+    merged into the echo of our own change in another, which is ignored.
+    Returns `None` for all other events. `replay` skips superseded
+    events by the same key."""
+
+    if event_type == "project_card" and "project_card" in payload:
+        return "card:{}".format(payload["project_card"]["id"])
+    elif event_type == "label" and "label" in payload:
+        repository = (payload.get("repository") or {}).get("full_name")
+        if not repository:
+            return None
+        changed = (payload.get("changes") or {}).get("name") or {}
+        name = changed.get("from") or payload["label"]["name"]
+        return "label:{}:{}".format(repository.lower(), name.lower())
+    return None
+
+
+def replaceable(event_type: Text, payload: Dict[Text, Any]) -> bool:
+    """Check if a later event of the same entity makes an event obsolete.
+
+    Label renames aren't, a later event of the old name is about a new
+    label and the rename would never reach the other repositories."""
+
+    return not (event_type == "label"
+                and (payload.get("changes") or {}).get("name"))
+
+
+class _Held:
+    __slots__ = ("args", "first", "deadline")
+
+    def __init__(self, first: float):
+        self.args = ()
+        self.first = first
+        self.deadline = first
+
+
+class Coalescer:
+    """Holds bursts of events about the same card or label and forwards
+    only the latest one, e.g. of a card dragged across three columns.
+
+    Every event of an entity restarts its `window`, but no event is held
+    longer than `max_delay` seconds after the first event of the burst.
+    Events without a `key` are not held, neither are new entities once
+    `max_size` entities are waiting. A held event that isn't
+    `replaceable` is sent on when the next event of its entity arrives.
+    """
+
+    def __init__(self, window: float = 2.0, max_delay: float = 10.0,
+                 max_size: int = 10000,
+                 key: Callable[[Text, Dict[Text, Any]],
+                               Optional[Text]] = coalesce_key,
+                 replaceable: Callable[[Text, Dict[Text, Any]],
+                                       bool] = replaceable):
+        self.window = window
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.key = key
+        self.replaceable = replaceable
+        # number of events that were merged into a later one
+        self.merged = 0
+        self._held: Dict[Any, _Held] = {}
+        self._flushed = itertools.count()
+        self._forward: Optional[Callable[..., Any]] = None
+        self._on_merged: Optional[Callable[..., Any]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    @property
+    def pending(self) -> int:
+        """Number of entities with an event waiting."""
+
+        return len(self._held)
+
+    def start(self, forward: Callable[..., Any],
+              on_merged: Optional[Callable[..., Any]] = None) -> None:
+        """Pass the latest event of an entity to `forward` once its
+        window closed, and every merged event to `on_merged`."""
+
+        self._forward = forward
+        self._on_merged = on_merged
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="gflows-coalesce",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, event_type: Text, payload: Dict[Text, Any],
+               *args: Any) -> bool:
+        """Hold an event, the arguments are passed on to `forward`.
+
+        Returns `False` if the event isn't held and should be handled
+        right away."""
+
+        key = self.key(event_type, payload)
+        if key is None or self._thread is None:
+            return False
+
+        now = time.monotonic()
+        merged = None
+        with self._cond:
+            if self._stopped:
+                return False
+            held = self._held.get(key)
+            if held is not None and not self.replaceable(*held.args[:2]):
+                # send it as it is, the new event starts another burst
+                held.deadline = now
+                self._held[(key, next(self._flushed))] = self._held.pop(key)
+                held = None
+            if held is None:
+                if len(self._held) >= self.max_size:
+                    return False
+                held = self._held[key] = _Held(now)
+            else:
+                merged = held.args
+            held.args = (event_type, payload) + args
+            held.deadline = min(now + self.window,
+                                held.first + self.max_delay)
+            self._cond.notify()
+
+        if merged:
+            self._merge(merged)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Forward all held events and stop."""
+
+        if self._thread is None:
+            return
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _merge(self, args):
+        with self._cond:
+            self.merged += 1
+        metrics.coalesced_events.inc(args[0])
+        try:
+            if self._on_merged:
+                self._on_merged(*args)
+        except Exception:
+            logger.exception("Settling a merged event failed.")
+
+    def _due(self):
+        """Wait for events whose window closed, all of them once
+        stopped. Returns an empty list when stopped and empty."""
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = [k
+                       for k, held in self._held.items()
+                       if self._stopped or held.deadline <= now]
+                if due or self._stopped:
+                    break
+                deadlines = [h.deadline for h in self._held.values()]
+                self._cond.wait(min(deadlines) - now if deadlines else None)
+
+            held = [self._held.pop(k) for k in due]
+        return sorted(held, key=lambda h: h.deadline)
+
+    def _run(self):
+        while True:
+            due = self._due()
+            if not due:
+                return
+            for held in due:
+                self._send(held)
+
+    def _send(self, held):
+        metrics.coalesce_delay.observe(time.monotonic() - held.first,
+                                       held.args[0])
+        while True:
+            try:
+                self._forward(*held.args)
+                return
+            except QueueFullError:
+                time.sleep(RETRY_INTERVAL)
+            except Exception:
+                logger.exception("Forwarding a held event failed.")
+                return
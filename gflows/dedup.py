@@ -0,0 +1,103 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Text
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteBackend:
+    """Shares seen delivery ids between processes through a sqlite file.
+
+    Any object with the same `add` and `remove` methods can be used as
+    a backend, e.g. a thin wrapper around redis' `SET key 1 NX EX ttl`."""
+
+    def __init__(self, path: Text):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute("CREATE TABLE IF NOT EXISTS deliveries ("
+                                "id TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add(self, key: Text, ttl: float) -> bool:
+        """Store a key, returns `False` if it is already present."""
+
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM deliveries WHERE expires < ?", (now,))
+            row = db.execute("SELECT 1 FROM deliveries WHERE id = ?",
+                             (key,)).fetchone()
+            if row is None:
+                db.execute("INSERT INTO deliveries (id, expires) "
+                           "VALUES (?, ?)", (key, now + ttl))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return row is None
+
+    def remove(self, key: Text) -> None:
+        self._connect().execute("DELETE FROM deliveries WHERE id = ?", (key,))
+
+
+class Deduplicator:
+    """Remembers recent delivery ids to skip redelivered events.
+
+    Keeps the last `max_size` ids seen within `window` seconds in an LRU.
+    With a shared `backend`, ids seen by other processes are detected as
+    well."""
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 window: float = 3600.0,
+                 backend: Optional[SqliteBackend] = None):
+        self.max_size = max_size
+        self.window = window
+        self.backend = backend
+        # number of duplicate deliveries that were skipped
+        self.suppressed = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, delivery_id: Text) -> bool:
+        """Record a delivery, returns `True` if it is a duplicate."""
+
+        now = time.time()
+        with self._lock:
+            first_seen = self._seen.get(delivery_id)
+            duplicate = (first_seen is not None
+                         and now - first_seen < self.window)
+            if not duplicate:
+                self._seen[delivery_id] = now
+            self._seen.move_to_end(delivery_id)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+        if not duplicate and self.backend is not None:
+            duplicate = not self.backend.add(delivery_id, self.window)
+
+        if duplicate:
+            with self._lock:
+                self.suppressed += 1
+            logger.info("Skipping duplicate delivery {}".format(delivery_id))
+        return duplicate
+
+    def forget(self, delivery_id: Text) -> None:
+        """Remove a delivery, e.g. if it got rejected and will be resent."""
+
+        with self._lock:
+            self._seen.pop(delivery_id, None)
+        if self.backend is not None:
+            self.backend.remove(delivery_id)
@@ -0,0 +1,374 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Text
+
+from gflows.transport import transport
+
+logger = logging.getLogger(__name__)
+
+# put on the queue once per worker to tell it to stop
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """Raised if an event can't be queued because the queue is full."""
+
+
+class QueueDispatcher:
+    """Runs the workflow hooks on a pool of worker threads.
+
+    Events are put on a bounded queue and the webhook is acknowledged
+    right away. If the queue is full, `submit` raises a `QueueFullError`.
+    With a journal the delivery is retried later, otherwise the server
+    answers with a 503. Github doesn't redeliver failed deliveries on
+    its own."""
+
+    def __init__(self, workers: int = 4, max_size: int = 100):
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max_size)
+        self._handler: Optional[Callable[..., Any]] = None
+        self._threads: List[threading.Thread] = []
+        self._accepting = False
+
+    @property
+    def pending(self) -> int:
+        """Number of events waiting for a worker."""
+
+        return self.queue.qsize()
+
+    def start(self, handler: Callable[..., Any]) -> None:
+        """Start the workers, each event is passed to `handler`."""
+
+        self._handler = handler
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work,
+                                 name="gflows-worker-{}".format(i),
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._accepting = True
+        atexit.register(self.shutdown)
+
+    def submit(self, *args: Any) -> None:
+        """Queue an event, the arguments are passed on to the handler."""
+
+        if not self._accepting:
+            raise QueueFullError("Dispatcher is not accepting events.")
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            raise QueueFullError("Queue is full ({} events)."
+                                 "".format(self.queue.maxsize))
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting events and wait until the queue is drained."""
+
+        if not self._threads:
+            return
+
+        self._accepting = False
+        logger.info("Draining {} queued events.".format(self.pending))
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while True:
+            args = self.queue.get()
+            try:
+                if args is _STOP:
+                    return
+                self._handler(*args)
+            except Exception:
+                logger.exception("Dispatching event failed.")
+            finally:
+                self.queue.task_done()
+
+
+def partition_key(event_type: Text,
+                  payload: Dict[Text, Any]) -> Optional[Text]:
+    """Return the key of the state an event changes.
+
+    Cards are keyed by card, labels by name (across repositories, as
+    they are shared) and project changes by project. Other events are
+    keyed by repository. Returns `None` for events without any of them."""
+
+    if event_type == "project_card" and "project_card" in payload:
+        return "card:{}".format(payload["project_card"]["id"])
+    elif event_type == "label" and "label" in payload:
+        # a rename belongs to the events of the old name
+        changed = (payload.get("changes") or {}).get("name") or {}
+        name = changed.get("from") or payload["label"]["name"]
+        return "label:{}".format(name.lower())
+    elif event_type == "project" and "project" in payload:
+        return "project:{}".format(payload["project"]["id"])
+    elif event_type == "project_column" and "project_column" in payload:
+        project_url = payload["project_column"]["project_url"]
+        return "project:{}".format(project_url.split("/")[-1])
+
+    repository = (payload.get("repository") or {}).get("full_name")
+    if repository:
+        return "repository:{}".format(repository.lower())
+    return None
+
+
+class PartitionedDispatcher:
+    """Runs the workflow hooks in parallel, but in order per partition.
+
+    Every event is assigned to one of the `workers` by the hash of its
+    partition `key` (see `partition_key`), each worker handles its events
+    one after the other. Events with the same key are never handled
+    concurrently or out of order, events with different keys usually
+    are. Each worker queues up to `max_size` events.
+
+    With `processes` the workers are forked processes instead of threads.
+    Every process has its own copy of the workflows and caches, so this
+    only suits workflows whose state is partitioned by the same key
+    (`Workflows` refuses workflows that aren't `process_safe`). The
+    value returned by the handler is passed to `on_result` in the parent
+    process. Metrics recorded in a worker process, like the github
+    requests it sent, aren't served by the parent unless they are
+    returned this way.
+
+    The processes are forked by `start`, which has to be called before
+    the parent starts any thread: a child only inherits the thread that
+    forked it, locks held by the others are never released."""
+
+    def __init__(self, workers: int = 4, max_size: int = 100,
+                 key: Callable[[Text, Dict[Text, Any]],
+                               Optional[Text]] = partition_key,
+                 processes: bool = False):
+        self.workers = workers
+        self.max_size = max_size
+        self.key = key
+        self.processes = processes
+        self._queues = []
+        self._workers = []
+        self._results: Optional[multiprocessing.Queue] = None
+        self._collector: Optional[threading.Thread] = None
+        self._handler: Optional[Callable[..., Any]] = None
+        self._observer: Optional[Callable[..., Any]] = None
+        self._on_result: Optional[Callable[..., Any]] = None
+        self._unkeyed = itertools.count()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._accepting = False
+        # set once every worker process ran the initializer
+        self._started = threading.Event()
+        self._starting = 0
+        self._start_errors: List[Text] = []
+
+    @property
+    def pending(self) -> int:
+        """Number of events submitted but not yet handled."""
+
+        return self._pending
+
+    def start(self, handler: Callable[..., Any],
+              on_result: Optional[Callable[..., Any]] = None,
+              initializer: Optional[Callable[[], Any]] = None,
+              observer: Optional[Callable[..., Any]] = None) -> None:
+        """Start the workers, each event is passed to `handler`.
+
+        Worker processes call `initializer` before they take events, see
+        `wait_started`. Events passed to `broadcast` are passed to
+        `observer`."""
+
+        self._handler = handler
+        self._on_result = on_result
+        self._observer = observer
+
+        if self.processes:
+            context = multiprocessing.get_context("fork")
+            self._results = context.Queue()
+            self._starting = self.workers
+            for i in range(self.workers):
+                q = context.Queue(maxsize=self.max_size)
+                p = context.Process(target=self._work_in_process,
+                                    args=(q, initializer),
+                                    name="gflows-shard-{}".format(i),
+                                    daemon=True)
+                p.start()
+                self._queues.append(q)
+                self._workers.append(p)
+            self._collector = threading.Thread(target=self._collect,
+                                               name="gflows-results",
+                                               daemon=True)
+            self._collector.start()
+        else:
+            self._started.set()
+            for i in range(self.workers):
+                q = queue.Queue(maxsize=self.max_size)
+                t = threading.Thread(target=self._work,
+                                     args=(q,),
+                                     name="gflows-worker-{}".format(i),
+                                     daemon=True)
+                t.start()
+                self._queues.append(q)
+                self._workers.append(t)
+
+        self._accepting = True
+        atexit.register(self.shutdown)
+
+    def wait_started(self) -> None:
+        """Wait until every worker process ran the initializer.
+
+        Raises a `RuntimeError` if it failed in any of them."""
+
+        while not self._started.wait(0.1):
+            if any(w.exitcode not in (None, 0) for w in self._workers):
+                raise RuntimeError("A worker process died while starting.")
+        if self._start_errors:
+            raise RuntimeError("Starting the worker processes failed: {}"
+                               "".format("; ".join(self._start_errors)))
+
+    def shard(self, event_type: Text, payload: Dict[Text, Any]) -> int:
+        """Return the worker handling an event."""
+
+        key = self.key(event_type, payload)
+        if key is None:
+            # no ordering needed, spread the events
+            return next(self._unkeyed) % self.workers
+        # stable across processes, unlike `hash`
+        return zlib.crc32(key.encode("utf-8")) % self.workers
+
+    def submit(self, event_type: Text, payload: Dict[Text, Any],
+               *args: Any) -> None:
+        """Queue an event, the arguments are passed on to the handler."""
+
+        if not self._accepting:
+            raise QueueFullError("Dispatcher is not accepting events.")
+
+        q = self._queues[self.shard(event_type, payload)]
+        with self._lock:
+            try:
+                q.put_nowait((False, (event_type, payload) + args))
+            except queue.Full:
+                raise QueueFullError("Queue is full ({} events)."
+                                     "".format(self.max_size))
+            self._pending += 1
+
+    def broadcast(self, event_type: Text, payload: Dict[Text, Any],
+                  *args: Any) -> None:
+        """Pass an event to the observer of every worker except the one
+        `submit` assigns it to, e.g. to have worker processes forget
+        state the event changed.
+
+        Each worker gets the event in order with the events submitted to
+        it. Waits for room in full queues."""
+
+        if not self._accepting:
+            raise QueueFullError("Dispatcher is not accepting events.")
+        if self._observer is None:
+            return
+
+        key = self.key(event_type, payload)
+        owner = None if key is None else self.shard(event_type, payload)
+        for i, q in enumerate(self._queues):
+            if i != owner:
+                q.put((True, (event_type, payload) + args))
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting events and wait until the queues are drained."""
+
+        if not self._workers:
+            return
+
+        self._accepting = False
+        logger.info("Draining {} queued events.".format(self.pending))
+        for q in self._queues:
+            q.put(None)
+        for w in self._workers:
+            w.join(timeout)
+        if self._collector:
+            self._results.put(None)
+            self._collector.join(timeout)
+            self._collector = None
+        self._workers = []
+        self._queues = []
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _observe(self, args):
+        try:
+            self._observer(*args)
+        except Exception:
+            logger.exception("Observing event failed.")
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            observe, args = item
+            if observe:
+                self._observe(args)
+                continue
+            try:
+                self._handler(*args)
+            except Exception:
+                logger.exception("Dispatching event failed.")
+            finally:
+                self._done()
+
+    def _work_in_process(self, q, initializer):
+        # connections of the parent can't be shared with a forked child
+        transport.configure(transport.pool_size, transport.retries,
+                            transport.backoff)
+        if initializer:
+            try:
+                initializer()
+            except Exception as e:
+                logger.exception("Starting the worker process failed.")
+                self._results.put((None, repr(e)))
+                return
+        self._results.put((None, None))
+
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            observe, args = item
+            if observe:
+                self._observe(args)
+                continue
+            try:
+                result = self._handler(*args)
+            except Exception:
+                logger.exception("Dispatching event failed.")
+                result = None
+            self._results.put((args, result))
+
+    def _collect(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            args, result = item
+            if args is None:
+                self._worker_started(result)
+                continue
+            try:
+                if self._on_result:
+                    self._on_result(args, result)
+            except Exception:
+                logger.exception("Handling the result of an event failed.")
+            finally:
+                self._done()
+
+    def _worker_started(self, error: Optional[Text]) -> None:
+        with self._lock:
+            if error:
+                self._start_errors.append(error)
+            self._starting -= 1
+            if not self._starting:
+                self._started.set()
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# etag, last modified and raw body of a response
+Entry = Tuple[Optional[Text], Optional[Text], Text]
+
+
+def request_key(verb: Text, url: Text,
+                parameters: Optional[Dict[Text, Any]],
+                headers: Mapping[Text, Text]) -> Optional[Text]:
+    """Return the key a response is stored under, `None` for requests
+    other than GET."""
+
+    if verb != "GET":
+        return None
+    return json.dumps([url, parameters, headers.get("Accept")],
+                      sort_keys=True)
+
+
+def with_validators(headers: Dict[Text, Text],
+                    entry: Optional[Entry]) -> Dict[Text, Text]:
+    """Add the headers asking github to only send a changed response."""
+
+    if entry:
+        etag, last_modified, _ = entry
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+class ConditionalCache:
+    """Stores validators and bodies of GET responses for revalidation.
+
+    Keeps up to `max_entries` responses in memory. If a `path` is given,
+    responses are also written to a sqlite file, so entries evicted from
+    memory (or stored by an earlier run) can still be revalidated. The
+    file keeps at most `max_disk_entries` responses, the least recently
+    stored are deleted first.
+
+    The sqlite file is read and written by the calling thread, coroutines
+    use `get_async` and `store_async` to do it in an executor."""
+
+    def __init__(self, max_entries: int = 1024, path: Optional[Text] = None,
+                 max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        # requests answered with a 304 from the cache
+        self.revalidated = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if path:
+            self._db().execute("CREATE TABLE IF NOT EXISTS responses ("
+                               "key TEXT PRIMARY KEY, etag TEXT, "
+                               "last_modified TEXT, body TEXT NOT NULL)")
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: Text) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.path:
+            entry = self._db().execute(
+                    "SELECT etag, last_modified, body FROM responses "
+                    "WHERE key = ?", (key,)).fetchone()
+            if entry is not None:
+                self._remember(key, entry)
+        return entry
+
+    def set(self, key: Text, entry: Entry) -> None:
+        self._remember(key, entry)
+        if self.path:
+            db = self._db()
+            rowid = db.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, etag, last_modified, body) VALUES (?, ?, ?, ?)",
+                    (key,) + tuple(entry)).lastrowid
+            # a replaced response gets a new rowid, so the rowids are in
+            # the order the responses were stored
+            db.execute("DELETE FROM responses WHERE rowid <= ?",
+                       (rowid - self.max_disk_entries,))
+
+    def revalidate(self, entry: Entry) -> Any:
+        """Return the decoded body of a stored response github answered
+        with a `304 Not Modified`."""
+
+        self.revalidated += 1
+        return json.loads(entry[2])
+
+    def store(self, key: Optional[Text],
+              response_headers: Mapping[Text, Text],
+              output: Any) -> None:
+        """Store a response if it can be revalidated later."""
+
+        if key and ("etag" in response_headers
+                    or "last-modified" in response_headers):
+            if isinstance(output, bytes):
+                output = output.decode("utf-8")
+            self.set(key, (response_headers.get("etag"),
+                           response_headers.get("last-modified"),
+                           output))
+
+    async def get_async(self, key: Text) -> Optional[Entry]:
+        if not self.path:
+            return self.get(key)
+        return await asyncio.get_event_loop().run_in_executor(
+                None, self.get, key)
+
+    async def store_async(self, key: Optional[Text],
+                          response_headers: Mapping[Text, Text],
+                          output: Any) -> None:
+        if not self.path:
+            return self.store(key, response_headers, output)
+        await asyncio.get_event_loop().run_in_executor(
+                None, self.store, key, response_headers, output)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = tuple(entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# used by `utils.gh_request`, replace it to change the limits or persist
+# the responses, e.g. `ConditionalCache(path="etags.db")`
+conditional_cache = ConditionalCache()
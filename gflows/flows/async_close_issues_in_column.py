@@ -0,0 +1,38 @@
+import logging
+
+from gflows.aio import AsyncGithub
+from gflows.flows import async_utils
+from gflows.flows.close_issues_in_column import CloseIssuesInColumn
+from gflows.flows.projects import registry
+from gflows.scheduler import INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCloseIssuesInColumn(CloseIssuesInColumn):
+    """`CloseIssuesInColumn` with an async hook for `aio.AsyncWorkflows`.
+
+    Card events are handled on the event loop instead of a worker
+    thread. Needs the `aio` extra."""
+
+    async def hook(self, event_type, data, gh: AsyncGithub):
+        if event_type == "project_card":
+            await self._handle_card_update_async(data, gh)
+
+    async def _handle_card_update_async(self, data, gh):
+        project_id = int(data["project_card"]["project_url"].split("/")[-1])
+        if not project_id == self.project_id:
+            return
+
+        column_id = await registry.column_id_async(self.project_id,
+                                                   self.column, gh)
+        if (data["action"] == "moved"
+                and data["project_card"]["column_id"] == column_id):
+
+            issue = await async_utils.issue_from_card_id(
+                    data["project_card"]["id"], gh, INTERACTIVE)
+            if issue and issue["state"] != "closed":
+                await async_utils.gh_request(gh, "PATCH", issue["url"],
+                                             input={"state": "closed"},
+                                             priority=INTERACTIVE)
+                logger.info("Closed issue {}".format(issue["url"]))
@@ -0,0 +1,215 @@
+"""Async counterparts of the github requests in `utils`.
+
+The functions take an `aio.AsyncGithub` client and share the caches of
+their blocking versions."""
+
+import logging
+from github import Consts
+from typing import Text, Optional, Any, Dict, Set, List
+
+from gflows import etags
+from gflows.aio import AsyncGithub, check
+from gflows.cache import github_cache
+from gflows.scheduler import NORMAL
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+async def id_from_project_name(org: Text, name: Text, gh: AsyncGithub,
+                               priority: int = NORMAL) -> int:
+    """Return the id of a project on an organization.
+
+    Workflows should use the cached `projects.registry` instead."""
+
+    for p in await gh_request_pages(gh, "/orgs/{}/projects".format(org),
+                                    priority=priority):
+        if p.get("name") == name:
+            return p.get("id")
+
+    raise ValueError("Unknown project name '{}'".format(name))
+
+
+async def issue_from_card_id(card_id: Text, gh: AsyncGithub,
+                             priority: int = NORMAL
+                             ) -> Optional[Dict[Text, Any]]:
+    """Fetch the dict representation of the issue of a card."""
+
+    data = await get_card_json(card_id, gh, priority)
+    content_url = data.get("content_url", "")
+    if content_url:
+        _, issue = await gh_request(gh, "GET", content_url,
+                                    priority=priority)
+        return issue
+    else:
+        return None
+
+
+async def get_card_json(card_id: Text, gh: AsyncGithub,
+                        priority: int = NORMAL) -> Dict[Text, Any]:
+    """Return the dict representation of a card."""
+
+    _, data = await gh_request(
+            gh,
+            "GET",
+            "/projects/columns/cards/{}".format(card_id),
+            headers={"Accept": Consts.mediaTypeProjectsPreview},
+            priority=priority
+    )
+    return data
+
+
+async def move_card_to_column(card_id: Text,
+                              target_column_id: int,
+                              gh: AsyncGithub,
+                              priority: int = NORMAL) -> None:
+    """Move a card on a project board to a column."""
+
+    json = {
+        "position": "top",
+        "column_id": target_column_id
+    }
+
+    await gh_request(
+            gh,
+            "POST",
+            "/projects/columns/cards/{}/moves".format(card_id),
+            input=json,
+            headers={"Accept": Consts.mediaTypeProjectsPreview},
+            priority=priority
+    )
+
+
+async def create_card_on_column(issue_id: Text,
+                                column_id: Text,
+                                gh: AsyncGithub,
+                                priority: int = NORMAL) -> None:
+    """Create a card for an issue on a column."""
+
+    json = {
+        "content_type": "Issue",
+        "content_id": issue_id
+    }
+
+    await gh_request(
+            gh,
+            "POST",
+            "/projects/columns/{}/cards".format(column_id),
+            input=json,
+            headers={"Accept": Consts.mediaTypeProjectsPreview},
+            priority=priority
+    )
+
+
+async def remove_card(card_id: Text, gh: AsyncGithub,
+                      priority: int = NORMAL) -> None:
+    """Remove a card from a project board."""
+
+    await gh_request(
+            gh,
+            "DELETE",
+            "/projects/columns/cards/{}".format(card_id),
+            headers={"Accept": Consts.mediaTypeProjectsPreview},
+            priority=priority
+    )
+
+
+async def get_repo(full_name: Text, gh: AsyncGithub,
+                   priority: int = NORMAL) -> Dict[Text, Any]:
+    """Return the dict representation of a repository, cached until a
+    `repository` event arrives."""
+
+    # the blocking version caches `Repository` objects under the kind
+    # and name alone
+    key = ("repo", full_name.lower(), "json")
+    repo = github_cache.peek(key, _MISSING)
+    if repo is _MISSING:
+        _, repo = await gh_request(gh, "GET", "/repos/{}".format(full_name),
+                                   priority=priority)
+        github_cache.set(key, repo)
+    return repo
+
+
+async def get_label_names(full_name: Text, gh: AsyncGithub,
+                          priority: int = NORMAL) -> Set[Text]:
+    """Return the label names of a repository.
+
+    Cached until a `label` event for the repository arrives."""
+
+    key = ("labels", full_name.lower())
+    names = github_cache.peek(key, _MISSING)
+    if names is _MISSING:
+        labels = await gh_request_pages(
+                gh, "/repos/{}/labels".format(full_name), priority=priority)
+        names = {l["name"] for l in labels}
+        github_cache.set(key, names)
+    return names
+
+
+async def has_write_permissions(user: Text, repo: Text, gh: AsyncGithub,
+                                priority: int = NORMAL) -> bool:
+    key = ("permission", repo.lower(), user)
+    p = github_cache.peek(key, _MISSING)
+    if p is _MISSING:
+        _, data = await gh_request(
+                gh,
+                "GET",
+                "/repos/{}/collaborators/{}/permission".format(repo, user),
+                priority=priority)
+        p = data["permission"]
+        github_cache.set(key, p)
+    return p in ["admin", "write"]
+
+
+async def gh_request_pages(gh: AsyncGithub,
+                           url: Text,
+                           per_page: int = 100,
+                           priority: int = NORMAL) -> List[Dict[Text, Any]]:
+    """Fetch all pages of an API listing."""
+
+    items = []
+    page = 1
+    while True:
+        _, data = await gh_request(
+                gh,
+                "GET",
+                url,
+                parameters={"per_page": per_page, "page": page},
+                headers={"Accept": Consts.mediaTypeProjectsPreview},
+                priority=priority)
+        items.extend(data or [])
+        if not data or len(data) < per_page:
+            return items
+        page += 1
+
+
+async def gh_request(gh: AsyncGithub,
+                     verb: Text,
+                     url: Text,
+                     parameters: Optional[Dict[Text, Any]] = None,
+                     headers: Optional[Dict[Text, Text]] = None,
+                     input: Optional[Any] = None,
+                     priority: int = NORMAL):
+    """Send a request to the github endpoint.
+
+    Like `utils.gh_request`, GET requests are sent conditionally and
+    share the stored responses with the blocking requests."""
+
+    logger.debug("fetching {}, {}".format(verb, url))
+
+    cache = etags.conditional_cache
+    key = etags.request_key(verb, url, parameters, headers or {})
+    cached = await cache.get_async(key) if key else None
+    headers = etags.with_validators(dict(headers or {}), cached)
+
+    status, response_headers, output = await gh.request_json(
+            verb, url, parameters, headers, input, priority)
+
+    if status == 304 and cached:
+        return response_headers, cache.revalidate(cached)
+
+    response_headers, data = check(status, response_headers, output)
+
+    await cache.store_async(key, response_headers, output)
+    return response_headers, data
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Set, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# issue key ("owner/repo/number") and column id of a card
+CardLocation = Tuple[Text, int]
+
+
+class CardIndex:
+    """Bidirectional index between issues and the cards on a board.
+
+    Issues are identified by "owner/repo/number" (case insensitive).
+    All updates are O(1).
+    While a reconciliation with the full board is running, the cards
+    updated by webhooks are tracked so the (older) scan result doesn't
+    overwrite them."""
+
+    def __init__(self):
+        # issue key -> (card id, column id)
+        self._by_issue: Dict[Text, Tuple[int, int]] = {}
+        # card id -> issue key
+        self._by_card: Dict[int, Text] = {}
+        self._touched: Optional[Set[int]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_card)
+
+    def get(self, issue_key: Text, default: Any = None) -> Any:
+        """Return the card id and column id of an issue."""
+
+        return self._by_issue.get(issue_key.lower(), default)
+
+    def issue_of(self, card_id: int) -> Optional[Text]:
+        return self._by_card.get(card_id)
+
+    def set(self, card_id: int, issue_key: Text, column_id: int) -> None:
+        with self._lock:
+            self._set(card_id, issue_key, column_id)
+            if self._touched is not None:
+                self._touched.add(card_id)
+
+    def remove_card(self, card_id: int) -> None:
+        with self._lock:
+            self._remove(card_id)
+            if self._touched is not None:
+                self._touched.add(card_id)
+
+    def begin_reconcile(self) -> None:
+        """Start tracking updates that happen during a full scan."""
+
+        with self._lock:
+            self._touched = set()
+
+    def abort_reconcile(self) -> None:
+        with self._lock:
+            self._touched = None
+
+    def finish_reconcile(self, cards: Dict[int, CardLocation]) -> None:
+        """Replace the index with the result of a full scan.
+
+        Cards updated since `begin_reconcile` keep their current state."""
+
+        with self._lock:
+            touched = self._touched or set()
+            self._touched = None
+
+            for card_id in list(self._by_card):
+                if card_id not in cards and card_id not in touched:
+                    self._remove(card_id)
+            for card_id, (issue_key, column_id) in cards.items():
+                if card_id not in touched:
+                    self._set(card_id, issue_key, column_id)
+
+    def _set(self, card_id, issue_key, column_id):
+        issue_key = issue_key.lower()
+        previous = self._by_card.get(card_id)
+        if previous is not None and previous != issue_key:
+            self._by_issue.pop(previous, None)
+        self._by_card[card_id] = issue_key
+        self._by_issue[issue_key] = card_id, column_id
+
+    def _remove(self, card_id):
+        issue_key = self._by_card.pop(card_id, None)
+        if issue_key is not None:
+            self._by_issue.pop(issue_key, None)
+
+    def save(self, path: Text, project_id: int) -> None:
+        """Write a snapshot of the index to a file."""
+
+        with self._lock:
+            cards = [[card_id, column_id, issue_key]
+                     for issue_key, (card_id, column_id)
+                     in self._by_issue.items()]
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"project_id": project_id, "cards": cards}, f,
+                      separators=(",", ":"))
+        os.replace(tmp_path, path)
+        logger.debug("Saved {} cards to {}".format(len(cards), path))
+
+    def load(self, path: Text, project_id: int) -> bool:
+        """Fill the index from a snapshot of the same project.
+
+        Returns `False` if there is no usable snapshot."""
+
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            logger.warning("Can't read card snapshot {}".format(path))
+            return False
+
+        if snapshot.get("project_id") != project_id:
+            return False
+
+        with self._lock:
+            for card_id, column_id, issue_key in snapshot["cards"]:
+                self._set(card_id, issue_key, column_id)
+        logger.info("Loaded {} cards from {}".format(len(self), path))
+        return True
@@ -0,0 +1,47 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoints:
+    """Progress of multi step operations, so a retry resumes where the
+    failed attempt stopped.
+
+    Kept in memory and, if a `path` is given, in a json file that
+    survives restarts."""
+
+    def __init__(self, path: Optional[Text] = None):
+        self.path = path
+        self._entries: Dict[Text, Dict[Text, Any]] = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def get(self, key: Text) -> Dict[Text, Any]:
+        with self._lock:
+            return dict(self._entries.get(key, {}))
+
+    def update(self, key: Text, **values: Any) -> None:
+        with self._lock:
+            self._entries.setdefault(key, {}).update(values)
+            self._save()
+
+    def remove(self, key: Text) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
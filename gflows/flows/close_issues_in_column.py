@@ -1,8 +1,10 @@
 import logging
 from github import Github
-from typing import Text
+from typing import Text, Union
 
-from gflows.flows import utils
+from gflows.flows import graphql, utils
+from gflows.flows.projects import registry
+from gflows.scheduler import scheduler, INTERACTIVE
 from gflows.workflow import Workflow
 
 logger = logging.getLogger(__name__)
@@ -12,34 +14,77 @@ class CloseIssuesInColumn(Workflow):
     """Makes sure that issues that get moved to a certain column get closed.
 
     Listens to events for a certain project and its done column. If
-    an issue is moved to that column, it will automatically get closed."""
+    an issue is moved to that column, it will automatically get closed.
+    The column can be given by id or by name. With `use_graphql` the
+    issue of a card is looked up and closed with two GraphQL requests
+    instead of four REST requests."""
 
     name = "close_issues_in_column"
 
-    def __init__(self, org, project_name, column):
+    events = {
+        "project_card": {"moved"},
+        "project": None,
+        "project_column": None,
+    }
+
+    payload_paths = [
+        "action",
+        "project_card.id",
+        "project_card.column_id",
+        "project_card.project_url",
+        "project.id",
+        "organization.login",
+        "project_column.project_url",
+    ]
+
+    def __init__(self, org, project_name, column: Union[int, Text],
+                 use_graphql: bool = False):
         self.org = org
         self.project_name = project_name
-        self.column_id = column
+        self.column = column
+        self.use_graphql = use_graphql
         self.project_id = None
 
     def start(self, gh: Github):
-        self.project_id = utils.id_from_project_name(
+        self.project_id = registry.project_id(
                 self.org, self.project_name, gh)
+        # fail early on unknown column names
+        registry.column_id(self.project_id, self.column, gh)
+
+    def observe(self, event_type, data):
+        if event_type in {"project", "project_column"}:
+            registry.observe(event_type, data)
 
     def hook(self, event_type, data, gh):
         if event_type == "project_card":
-            self._handle_card_update(data, gh)
+            with scheduler.priority(INTERACTIVE):
+                self._handle_card_update(data, gh)
 
     def _handle_card_update(self, data, gh):
         project_id = int(data["project_card"]["project_url"].split("/")[-1])
         if not project_id == self.project_id:
             return
 
+        column_id = registry.column_id(self.project_id, self.column, gh)
         if (data["action"] == "moved"
-                and data["project_card"]["column_id"] == self.column_id):
+                and data["project_card"]["column_id"] == column_id):
 
             card_id = data["project_card"]["id"]
-            self._close_issue_of_card(card_id, gh)
+            if self.use_graphql:
+                self._close_issue_of_card_graphql(card_id, gh)
+            else:
+                self._close_issue_of_card(card_id, gh)
+
+    @staticmethod
+    def _close_issue_of_card_graphql(card_id: int, gh):
+        issue = graphql.card_content(card_id, gh)
+        if issue and issue["state"] == "OPEN":
+            # like with REST, the cards of pull requests close them too
+            if issue["__typename"] == "PullRequest":
+                graphql.close_pull_request(issue["id"], gh)
+            else:
+                graphql.close_issue(issue["id"], gh)
+            logger.info("Closed issue {}".format(issue["url"]))
 
     @staticmethod
     def _close_issue_of_card(card_id: Text, gh):
@@ -0,0 +1,209 @@
+"""GraphQL versions of the project board requests in `utils`.
+
+A whole board is fetched in a few paginated queries instead of one
+request per column and card page, and card moves are combined into a
+single mutation."""
+
+import base64
+import logging
+from github import Consts, Github, GithubException
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from gflows.flows import utils
+from gflows.flows.card_index import CardLocation
+
+logger = logging.getLogger(__name__)
+
+# card content is either an issue or a pull request
+_CARD_FIELDS = """
+databaseId
+content {
+  __typename
+  ... on Issue { id number state url repository { nameWithOwner } }
+  ... on PullRequest { id number state url repository { nameWithOwner } }
+}
+"""
+
+BOARD_QUERY = """
+query($project: ID!, $after: String) {
+  node(id: $project) {
+    ... on Project {
+      columns(first: 50, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          id
+          databaseId
+          cards(first: 100) {
+            pageInfo { hasNextPage endCursor }
+            nodes { %s }
+          }
+        }
+      }
+    }
+  }
+}
+""" % _CARD_FIELDS
+
+COLUMN_CARDS_QUERY = """
+query($column: ID!, $after: String) {
+  node(id: $column) {
+    ... on ProjectColumn {
+      cards(first: 100, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes { %s }
+      }
+    }
+  }
+}
+""" % _CARD_FIELDS
+
+CARD_QUERY = """
+query($card: ID!) {
+  node(id: $card) {
+    ... on ProjectCard { %s }
+  }
+}
+""" % _CARD_FIELDS
+
+
+def node_id(type_name: Text, database_id: int) -> Text:
+    """Return the global node id of an object with a REST id.
+
+    Uses the (legacy) encoding github still accepts for project objects,
+    e.g. "011:ProjectCard123"."""
+
+    raw = "0{}:{}{}".format(len(type_name), type_name, database_id)
+    return base64.b64encode(raw.encode("ascii")).decode("ascii")
+
+
+def url(gh: Github) -> Text:
+    """Return the GraphQL endpoint of the API `gh` talks to.
+
+    Github serves it on "/graphql", GitHub Enterprise on "/api/graphql"
+    next to the REST API on "/api/v3"."""
+
+    # noinspection PyProtectedMember,PyUnresolvedReferences
+    base_url = gh._Github__requester._Requester__base_url.rstrip("/")
+    if base_url.endswith("/api/v3"):
+        return base_url[:-len("v3")] + "graphql"
+    return "/graphql"
+
+
+def request(gh: Github, query: Text,
+            variables: Optional[Dict[Text, Any]] = None) -> Dict[Text, Any]:
+    """Run a GraphQL query, raises a `GithubException` on errors."""
+
+    _, data = utils.gh_request(gh,
+                               "POST",
+                               url(gh),
+                               input={"query": query,
+                                      "variables": variables or {}})
+    if data.get("errors"):
+        raise GithubException(200, data)
+    return data["data"]
+
+
+def _issue_key(card: Dict[Text, Any]) -> Optional[Text]:
+    content = card.get("content")
+    if content:
+        return "{}/{}".format(content["repository"]["nameWithOwner"],
+                              content["number"])
+    else:
+        return None
+
+
+def board_cards(project_id: int, gh: Github) -> Dict[int, CardLocation]:
+    """Return the issue key and column id of every card on a board.
+
+    Notes and other cards without an issue are left out."""
+
+    # the only REST call, the response is stored for conditional requests
+    _, project = utils.gh_request(
+            gh,
+            "GET",
+            "/projects/{}".format(project_id),
+            headers={"Accept": Consts.mediaTypeProjectsPreview})
+
+    cards = {}
+
+    def add(column_id, nodes):
+        for card in nodes:
+            issue_key = _issue_key(card)
+            if issue_key:
+                cards[card["databaseId"]] = issue_key, column_id
+
+    after = None
+    while True:
+        columns = request(gh, BOARD_QUERY,
+                          {"project": project["node_id"],
+                           "after": after})["node"]["columns"]
+        for column in columns["nodes"]:
+            add(column["databaseId"], column["cards"]["nodes"])
+            page = column["cards"]["pageInfo"]
+            while page["hasNextPage"]:
+                more = request(gh, COLUMN_CARDS_QUERY,
+                               {"column": column["id"],
+                                "after": page["endCursor"]}
+                               )["node"]["cards"]
+                add(column["databaseId"], more["nodes"])
+                page = more["pageInfo"]
+
+        if not columns["pageInfo"]["hasNextPage"]:
+            return cards
+        after = columns["pageInfo"]["endCursor"]
+
+
+def card_content(card_id: int, gh: Github) -> Optional[Dict[Text, Any]]:
+    """Return the issue or pull request of a card in a single request.
+
+    Contains the `__typename`, node `id`, `number`, `state`, `url` and
+    `repository`."""
+
+    card = request(gh, CARD_QUERY,
+                   {"card": node_id("ProjectCard", card_id)})["node"]
+    return card.get("content") if card else None
+
+
+def close_issue(issue_node_id: Text, gh: Github) -> None:
+    request(gh,
+            "mutation($issue: ID!) {"
+            "  closeIssue(input: {issueId: $issue}) { clientMutationId }"
+            "}",
+            {"issue": issue_node_id})
+
+
+def close_pull_request(pull_request_node_id: Text, gh: Github) -> None:
+    request(gh,
+            "mutation($pullRequest: ID!) {"
+            "  closePullRequest(input: {pullRequestId: $pullRequest}) {"
+            "    clientMutationId"
+            "  }"
+            "}",
+            {"pullRequest": pull_request_node_id})
+
+
+def move_cards(moves: List[Tuple[int, int]], gh: Github,
+               batch_size: int = 50) -> None:
+    """Move cards to the top of columns, given as (card id, column id).
+
+    Up to `batch_size` moves are sent as a single mutation."""
+
+    for start in range(0, len(moves), batch_size):
+        batch = moves[start:start + batch_size]
+        parameters = []
+        fields = []
+        variables = {}
+        for i, (card_id, column_id) in enumerate(batch):
+            parameters.append("$card{0}: ID!, $column{0}: ID!".format(i))
+            fields.append("move{0}: moveProjectCard(input: {{"
+                          "cardId: $card{0}, columnId: $column{0}}}) {{"
+                          "clientMutationId }}".format(i))
+            variables["card{}".format(i)] = node_id("ProjectCard", card_id)
+            variables["column{}".format(i)] = node_id("ProjectColumn",
+                                                      column_id)
+
+        request(gh,
+                "mutation({}) {{ {} }}".format(", ".join(parameters),
+                                               " ".join(fields)),
+                variables)
+        logger.debug("Moved {} cards in one request".format(len(batch)))
@@ -1,12 +1,19 @@
 import logging
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from github import Github, UnknownObjectException
 from github.GithubObject import NotSet
 from github.Issue import Issue
 from github.Repository import Repository
-from typing import Text
+from typing import Text, Dict, Optional, Union
 
-from gflows.flows import utils
+from gflows.flows import graphql, utils
+from gflows.flows.card_index import CardIndex, CardLocation
+from gflows.flows.checkpoints import Checkpoints
+from gflows.flows.projects import registry
+from gflows.scheduler import scheduler, BULK, INTERACTIVE
 from gflows.workflow import Workflow
 
 logger = logging.getLogger(__name__)
@@ -16,29 +23,135 @@ class MoveIssues(Workflow):
     """Automatically moves issues on a project board when there is a commit.
 
     If a commit to the issue is made, and the issue has been in the
-    origin column, it will be moved to the target column."""
+    origin column, it will be moved to the target column. Columns can be
+    given by id or by name.
+
+    If a `snapshot_path` is given, the card index is saved there and
+    loaded on the next start. The full board scan then runs in the
+    background instead of blocking the start. Progress of `/move`
+    commands is kept in memory, or in `checkpoint_path` if given.
+
+    With `use_graphql` the board is loaded and the cards of a push are
+    moved with a few GraphQL requests instead of one REST request per
+    column page and card."""
 
     name = "project_issues"
 
-    def __init__(self, org, project_name, origin_column, target_column):
+    events = {
+        "push": None,
+        "project_card": {"created", "converted", "moved", "deleted"},
+        "issue_comment": None,
+        "project": None,
+        "project_column": None,
+    }
+
+    payload_paths = [
+        "action",
+        "commits.message",
+        "commits.distinct",
+        "repository.full_name",
+        "project_card",
+        "comment.body",
+        "sender.login",
+        "issue.number",
+        "project.id",
+        "organization.login",
+        "project_column.project_url",
+    ]
+
+    # the card index is updated by card events but read by pushes and
+    # comments, which are partitioned by repository
+    process_safe = False
+
+    def __init__(self, org, project_name,
+                 origin_column: Union[int, Text],
+                 target_column: Union[int, Text],
+                 snapshot_path: Optional[Text] = None,
+                 scan_workers: int = 8,
+                 checkpoint_path: Optional[Text] = None,
+                 use_graphql: bool = False):
         self.org = org
         self.project_name = project_name
         self.origin_column = origin_column
         self.target_column = target_column
-        self.cards = {}
+        self.snapshot_path = snapshot_path
+        self.scan_workers = scan_workers
+        self.use_graphql = use_graphql
+        # progress of issue moves, so failed moves can be resumed
+        self.checkpoints = Checkpoints(checkpoint_path)
+        self.cards = CardIndex()
         self.project_id = None
 
     def start(self, gh: Github):
-        self.project_id = utils.id_from_project_name(
+        self.project_id = registry.project_id(
                 self.org, self.project_name, gh)
-        self._request_all_cards(gh)
+        # fail early on unknown column names
+        self._column_id(self.origin_column, gh)
+        self._column_id(self.target_column, gh)
+
+        if (self.snapshot_path
+                and self.cards.load(self.snapshot_path, self.project_id)):
+            # serve from the snapshot while we catch up with the board
+            threading.Thread(target=self._reconcile_in_background,
+                             args=(gh,),
+                             name="gflows-reconcile-cards",
+                             daemon=True).start()
+        else:
+            self._reconcile(gh)
+
+    def stop(self):
+        if self.snapshot_path and self.project_id is not None:
+            self.cards.save(self.snapshot_path, self.project_id)
+
+    def _reconcile(self, gh):
+        """Sync the card index with the full project board."""
+
+        self.cards.begin_reconcile()
+        try:
+            cards = self._request_all_cards(gh)
+        except Exception:
+            self.cards.abort_reconcile()
+            raise
+
+        self.cards.finish_reconcile(cards)
+        logger.info("Indexed {} cards of project '{}'.".format(
+                len(self.cards), self.project_name))
+        self.stop()
 
-    def _request_all_cards(self, gh):
-        project = gh.get_project(self.project_id)
-        for column in project.get_columns():
+    def _reconcile_in_background(self, gh):
+        try:
+            self._reconcile(gh)
+        except Exception:
+            logger.exception("Failed to request the cards of project '{}'."
+                             "".format(self.project_name))
+
+    def _request_all_cards(self, gh) -> Dict[int, CardLocation]:
+        if self.use_graphql:
+            with scheduler.priority(BULK):
+                return graphql.board_cards(self.project_id, gh)
+
+        with scheduler.priority(BULK):
+            project = gh.get_project(self.project_id)
+            columns = list(project.get_columns())
+
+        # the columns are paged through concurrently
+        cards = {}
+        with ThreadPoolExecutor(max_workers=self.scan_workers,
+                                thread_name_prefix="gflows-scan") as pool:
+            for column_cards in pool.map(self._request_column_cards,
+                                         columns):
+                cards.update(column_cards)
+        return cards
+
+    def _request_column_cards(self, column) -> Dict[int, CardLocation]:
+        cards = {}
+        with scheduler.priority(BULK):
             for card in column.get_cards():
                 column_id = int(card.column_url.split("/")[-1])
-                self._set_card(card.id, card.content_url, column_id)
+                issue_key = self._issue_key(card.content_url)
+                if issue_key:
+                    cards[card.id] = issue_key, column_id
+        return cards
 
     @staticmethod
     def _extract_move_target(text: Text):
@@ -54,15 +167,23 @@ class MoveIssues(Workflow):
         return (utils.has_write_permissions(user, source_repo, gh) and
                 utils.has_write_permissions(user, target_repo, gh))
 
+    def observe(self, event_type, data):
+        if event_type in {"project", "project_column"}:
+            registry.observe(event_type, data)
+
     def hook(self, event_type, data, gh):
-        if event_type == "push":
-            self._handle_commit(data, gh)
+        with scheduler.priority(INTERACTIVE):
+            if event_type == "push":
+                self._handle_commit(data, gh)
+
+            elif event_type == "project_card":
+                self._handle_card_update(data, gh)
 
-        elif event_type == "project_card":
-            self._handle_card_update(data, gh)
+            elif event_type == "issue_comment":
+                self._handle_move_command(data, gh)
 
-        elif event_type == "issue_comment":
-            self._handle_move_command(data, gh)
+    def _column_id(self, column, gh) -> int:
+        return registry.column_id(self.project_id, column, gh)
 
     def _handle_move_command(self, data, gh):
         target_repo = self._extract_move_target(data["comment"]["body"])
@@ -95,59 +216,106 @@ class MoveIssues(Workflow):
 
     def _comment_invalid_target(self, issue_number, source_name, target_repo,
                                 gh):
-        source: Repository = gh.get_repo(source_name)
+        source: Repository = utils.get_repo(source_name, gh)
 
         issue = source.get_issue(issue_number)
         issue.create_comment("Can't move, I don't know the repo '{}' 😅"
                              "".format(target_repo))
 
     def _comment_same_repo(self, issue_number, source_name, gh):
-        source: Repository = gh.get_repo(source_name)
+        source: Repository = utils.get_repo(source_name, gh)
 
         issue = source.get_issue(issue_number)
         issue.create_comment("Can't move, issue is already on this repo. 😅")
 
     def _move_issue(self, issue_number, source_name, target_name, gh):
+        """Copy an issue with its comments to another repo.
+
+        Progress is checkpointed, if a move fails the next attempt
+        continues with the already created issue."""
+
         logger.info("Moved Issue #{} from '{}' to '{}'.".format(
                 issue_number,
                 source_name,
                 target_name))
 
-        target: Repository = gh.get_repo(target_name)
-        source: Repository = gh.get_repo(source_name)
+        target: Repository = utils.get_repo(target_name, gh)
+        source: Repository = utils.get_repo(source_name, gh)
 
         issue = source.get_issue(issue_number)
 
+        key = "{}/{}".format(source_name, issue_number)
+        progress = self.checkpoints.get(key)
+        if progress.get("target") != target_name.lower():
+            # e.g. the issue is moved elsewhere after a failed move, the
+            # steps done for the other target don't count
+            self.checkpoints.remove(key)
+            progress = {}
+
+        if progress:
+            moved_issue: Issue = target.get_issue(progress["issue"])
+            logger.info("Resuming move of {} to {} after {} comments."
+                        "".format(key, moved_issue.html_url,
+                                  progress["comments"]))
+        else:
+            moved_issue: Issue = self._create_moved_issue(
+                    issue, source, target, target_name, gh)
+            self.checkpoints.update(key,
+                                    target=target_name.lower(),
+                                    issue=moved_issue.number,
+                                    comments=0)
+
+        self._copy_comments(key, issue, moved_issue, progress)
+
+        if not progress.get("announced"):
+            if source.private or not target.private:
+                issue.create_comment(
+                        "Moved to {}".format(moved_issue.html_url))
+            self.checkpoints.update(key, announced=True)
+
+        issue.edit(state="closed")
+
+        card_id, column_id = self.cards.get(key, (None, None))
+
+        if card_id and column_id:
+            if not progress.get("card_created"):
+                utils.create_card_on_column(moved_issue.id, column_id, gh)
+                self.checkpoints.update(key, card_created=True)
+            utils.remove_card(card_id, gh)
+
+        self.checkpoints.remove(key)
+
+    @staticmethod
+    def _create_moved_issue(issue, source, target, target_name, gh):
         if target.private or not source.private:
             body = issue.body + "\n\n Moved from {}".format(issue.html_url)
         else:
             body = issue.body
 
-        valid_labels = {l.name for l in target.get_labels()}
+        valid_labels = utils.get_label_names(target_name, gh)
         issue_labels = [l.name for l in issue.labels if l.name in valid_labels]
-        moved_issue: Issue = target.create_issue(
+        return target.create_issue(
                 issue.title,
                 body or NotSet,
                 labels=issue_labels or NotSet,
                 assignees=issue.assignees or NotSet)
 
-        for c in issue.get_comments():
-            if not self._extract_move_target(c.body):
-                comment = "[{}]({}) commented on _{}_:\n\n{}".format(
-                        c.user.login, c.user.html_url, c.created_at, c.body)
-                moved_issue.create_comment(comment)
-
-        if source.private or not target.private:
-            issue.create_comment("Moved to {}".format(moved_issue.html_url))
-
-        issue.edit(state="closed")
+    def _copy_comments(self, key, issue, moved_issue, progress):
+        """Post the comments in order, the next pages are fetched while
+        the current ones are posted."""
 
-        card_id, column_id = self.cards.get(
-                "{}/{}".format(source_name, issue_number), (None, None))
+        copied = progress.get("comments", 0)
+        comments = (c
+                    for c in utils.prefetch(issue.get_comments())
+                    if not self._extract_move_target(c.body))
 
-        if card_id and column_id:
-            utils.create_card_on_column(moved_issue.id, column_id, gh)
-            utils.remove_card(card_id, gh)
+        for i, c in enumerate(comments):
+            if i < copied:
+                continue
+            comment = "[{}]({}) commented on _{}_:\n\n{}".format(
+                    c.user.login, c.user.html_url, c.created_at, c.body)
+            moved_issue.create_comment(comment)
+            self.checkpoints.update(key, comments=i + 1)
 
     def _handle_card_update(self, data, gh):
         project_id = int(data["project_card"]["project_url"].split("/")[-1])
@@ -160,11 +328,13 @@ class MoveIssues(Workflow):
         elif data["action"] == "converted":
             card_id = data["project_card"]["id"]
             self._update_card(card_id, gh)
+        elif data["action"] == "moved":
+            card = data["project_card"]
+            self._set_card(card["id"], card.get("content_url"),
+                           card["column_id"])
         elif data["action"] == "deleted":
             card_id = data["project_card"]["id"]
-            self.cards = {k: v
-                          for k, v in self.cards.items()
-                          if v != card_id}
+            self.cards.remove_card(card_id)
 
     def _update_card(self, card_id, gh):
         data = utils.get_card_json(card_id, gh)
@@ -173,38 +343,51 @@ class MoveIssues(Workflow):
             column_id = int(data["column_url"].split("/")[-1])
             self._set_card(card_id, content_url, column_id)
 
-    def _set_card(self, card_id, content_url, column_id):
+    @staticmethod
+    def _issue_key(content_url: Optional[Text]) -> Optional[Text]:
         if content_url:
             full_repo_name = "/".join(content_url.split("/")[-4:-2])
             issue_number = content_url.split("/")[-1]
-            self.cards[full_repo_name + "/" + issue_number] = card_id, column_id
-
-    def _move_card(self, card_id, column_id, gh):
-        utils.move_card_to_column(card_id, column_id, gh)
-
-        data = utils.get_card_json(card_id, gh)
-        logger.info("Moved Card {} to column {} in project '{}'.".format(
-                data.get("url"),
-                data.get("column_url"),
-                self.project_name))
+            return full_repo_name + "/" + issue_number
+        else:
+            return None
 
-        content_url = data.get("content_url", "")
-        if content_url:
-            column_id = int(data["column_url"].split("/")[-1])
-            self._set_card(card_id, content_url, column_id)
+    def _set_card(self, card_id, content_url, column_id):
+        issue_key = self._issue_key(content_url)
+        if issue_key:
+            self.cards.set(card_id, issue_key, column_id)
 
-    def _handle_commit(self, data, gh):
-        for c in data["commits"]:
-            if not c["distinct"]:
-                continue
+    def _move_cards(self, card_ids, column_id, gh):
+        if self.use_graphql:
+            graphql.move_cards([(c, column_id) for c in card_ids], gh)
+        else:
+            for card_id in card_ids:
+                utils.move_card_to_column(card_id, column_id, gh)
 
-            issue_number = utils.issue_id_from_commit_message(c["message"])
-            if not issue_number:
-                continue
+        for card_id in card_ids:
+            logger.info("Moved Card {} to column {} in project '{}'.".format(
+                    card_id,
+                    column_id,
+                    self.project_name))
 
-            repository_name = data["repository"]["full_name"]
-            card_id, column_id = self.cards.get(
-                    "{}/{}".format(repository_name, issue_number), (None, None))
+            issue_key = self.cards.issue_of(card_id)
+            if issue_key:
+                self.cards.set(card_id, issue_key, column_id)
 
-            if card_id and column_id == self.origin_column:
-                self._move_card(card_id, self.target_column, gh)
+    def _handle_commit(self, data, gh):
+        issue_keys = utils.issue_references(
+                (c["message"] for c in data["commits"] if c["distinct"]),
+                data["repository"]["full_name"])
+
+        origin_column_id = self._column_id(self.origin_column, gh)
+        target_column_id = self._column_id(self.target_column, gh)
+
+        # several commits might reference the same card
+        card_ids = OrderedDict()
+        for issue_key in issue_keys:
+            card_id, column_id = self.cards.get(issue_key, (None, None))
+            if card_id and column_id == origin_column_id:
+                card_ids[card_id] = None
+
+        if card_ids:
+            self._move_cards(list(card_ids), target_column_id, gh)
@@ -0,0 +1,101 @@
+import logging
+import threading
+from github import Github
+from typing import Any, Dict, Text, Union
+
+from gflows.flows import utils
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectRegistry:
+    """Resolves project and column names to ids, shared by all workflows.
+
+    All projects of an organization are fetched once (following the
+    pagination) and kept until a `project` or `project_column` webhook
+    signals a change."""
+
+    def __init__(self):
+        # org login -> project name -> project id
+        self._projects: Dict[Text, Dict[Text, int]] = {}
+        # project id -> column name -> column id
+        self._columns: Dict[int, Dict[Text, int]] = {}
+        self._lock = threading.RLock()
+
+    def project_id(self, org: Text, name: Text, gh: Github) -> int:
+        """Return the id of a project on an organization."""
+
+        with self._lock:
+            projects = self._projects.get(org.lower())
+            if projects is None:
+                projects = {p["name"]: p["id"]
+                            for p in utils.gh_request_pages(
+                                    gh, "/orgs/{}/projects".format(org))}
+                self._projects[org.lower()] = projects
+
+        if name not in projects:
+            raise ValueError("Unknown project name '{}'".format(name))
+        return projects[name]
+
+    def column_id(self, project_id: int, column: Union[int, Text],
+                  gh: Github) -> int:
+        """Return the id of a column given by id or by name."""
+
+        if isinstance(column, int):
+            return column
+
+        with self._lock:
+            columns = self._columns.get(project_id)
+            if columns is None:
+                columns = {c["name"]: c["id"]
+                           for c in utils.gh_request_pages(
+                                   gh,
+                                   "/projects/{}/columns".format(project_id))}
+                self._columns[project_id] = columns
+
+        if column not in columns:
+            raise ValueError("Unknown column name '{}'".format(column))
+        return columns[column]
+
+    async def column_id_async(self, project_id: int,
+                              column: Union[int, Text], gh) -> int:
+        """Like `column_id`, but fetches the columns with an
+        `aio.AsyncGithub` client."""
+
+        # needs the aio extra
+        from gflows.flows import async_utils
+
+        if isinstance(column, int):
+            return column
+
+        with self._lock:
+            columns = self._columns.get(project_id)
+        if columns is None:
+            columns = {c["name"]: c["id"]
+                       for c in await async_utils.gh_request_pages(
+                               gh, "/projects/{}/columns".format(project_id))}
+            with self._lock:
+                self._columns[project_id] = columns
+
+        if column not in columns:
+            raise ValueError("Unknown column name '{}'".format(column))
+        return columns[column]
+
+    def observe(self, event_type: Text, payload: Dict[Text, Any]) -> None:
+        """Forget the names changed by a webhook event."""
+
+        with self._lock:
+            if event_type == "project":
+                org = (payload.get("organization") or {}).get("login")
+                if org:
+                    self._projects.pop(org.lower(), None)
+                else:
+                    self._projects.clear()
+                self._columns.pop(payload["project"]["id"], None)
+            elif event_type == "project_column":
+                project_url = payload["project_column"]["project_url"]
+                self._columns.pop(int(project_url.split("/")[-1]), None)
+
+
+# shared by all workflows of the process
+registry = ProjectRegistry()
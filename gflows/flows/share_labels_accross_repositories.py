@@ -1,50 +1,340 @@
 import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from github import UnknownObjectException, GithubException
-from github.GithubObject import NotSet
 from github.Label import Label
+from typing import (
+    Any, Callable, Dict, List, Text, Tuple, Optional, NamedTuple)
 
+from gflows.cache import TTLCache
+from gflows.flows import utils
+from gflows.scheduler import scheduler, BULK
+from gflows.tracing import tracer
 from gflows.workflow import Workflow
 
 logger = logging.getLogger(__name__)
 
 
+class LabelChange(NamedTuple):
+    """A change needed to bring a repository's labels in sync."""
+
+    repository: Text
+    # "create", "edit" or "delete"
+    action: Text
+    # the label as it should be (`None` for deletions)
+    label: Optional[Dict[Text, Any]]
+    # the label as it is (`None` for creations)
+    current: Optional[Label]
+
+    def __str__(self):
+        name = self.label["name"] if self.label else self.current.name
+        return "{} label '{}' on {}".format(self.action, name, self.repository)
+
+
 class ShareLabelsAccrossRepositories(Workflow):
     name = "shared_labels"
 
-    def __init__(self, repositories):
-        """Creates the same label on all repositories."""
+    events = {"label": {"created", "edited", "deleted"}}
+
+    payload_paths = ["action", "label", "changes", "repository.full_name"]
+
+    def __init__(self, repositories, max_workers=8, echo_window=60.0,
+                 reconcile_on_start=False, reconcile_interval=None,
+                 source=None, dry_run=False):
+        """Creates the same label on all repositories.
+
+        Changes are applied to up to `max_workers` repositories at once.
+        Webhooks caused by our own changes are ignored if they arrive
+        within `echo_window` seconds.
+
+        Labels that drifted apart (e.g. while we were down) are brought
+        in sync on start with `reconcile_on_start` and every
+        `reconcile_interval` seconds, see `reconcile`. Both are off by
+        default, as without a `source` repository the labels are merged
+        and edited to the most common version. With `dry_run` the
+        changes are only logged."""
         self.repositories = [r.lower() for r in repositories]
+        self.max_workers = max_workers
+        self.reconcile_on_start = reconcile_on_start
+        self.reconcile_interval = reconcile_interval
+        self.source = source.lower() if source else None
+        self.dry_run = dry_run
+        self._stopped = threading.Event()
+        # label changes we made ourselves, github sends them back to us
+        self._own_changes = TTLCache(max_size=10000, ttl=echo_window)
+        # number of label events that were our own changes coming back
+        self.echoes_suppressed = 0
+        self._executor = None
+        self._lock = threading.Lock()
 
     @staticmethod
-    def _update_or_create_label(repo, name, label):
+    def _change_key(repository: Text, action: Text,
+                    label: Dict[Text, Any]) -> Tuple:
+        if action == "deleted":
+            return repository.lower(), action, label["name"]
+        else:
+            # creating a label might be reported as an edit and vice versa
+            return (repository.lower(), "changed", label["name"],
+                    label["color"].lower(), label.get("description") or "")
+
+    @contextmanager
+    def _own_change(self, repo, action: Text, label: Dict[Text, Any]):
+        """Remember a change we are about to make, unless it fails."""
+
+        key = self._change_key(repo.full_name, action, label)
+        self._own_changes.set(key, True)
+        try:
+            yield
+        except Exception:
+            self._own_changes.pop(key)
+            raise
+
+    def _is_echo(self, data: Dict[Text, Any]) -> bool:
+        """Check if a label event was caused by one of our changes."""
+
+        key = self._change_key(data["repository"]["full_name"],
+                               data["action"], data["label"])
+        if self._own_changes.pop(key):
+            with self._lock:
+                self.echoes_suppressed += 1
+            logger.debug("Ignoring our own change of label {} on {}."
+                         "".format(data["label"]["name"],
+                                   data["repository"]["full_name"]))
+            return True
+        return False
+
+    def _update_or_create_label(self, repo, name, label) -> Text:
+        # github sends labels without a description with `null`
+        description = label.get("description") or ""
         try:
             l: Label = repo.get_label(name)
             if (l.color != label["color"]
                     or l.name != label["name"]
-                    or l.description != label.get("description")):
+                    or (l.description or "") != description):
 
-                l.edit(label["name"],
-                       label["color"],
-                       label.get("description", NotSet))
+                with self._own_change(repo, "edited", label):
+                    l.edit(label["name"],
+                           label["color"],
+                           description)
                 logger.info("Updated Label {} on repo {}.".format(
                         l.name, repo.full_name))
+                return "updated"
+            return "unchanged"
         except UnknownObjectException:
-            repo.create_label(
-                    label["name"],
-                    label["color"],
-                    label.get("description", NotSet))
+            with self._own_change(repo, "created", label):
+                repo.create_label(
+                        label["name"],
+                        label["color"],
+                        description)
             logger.info("Created Label {} on repo {}.".format(
                     label["name"], repo.full_name))
+            return "created"
 
-    @staticmethod
-    def _delete_label(repo, name):
+    def _delete_label(self, repo, name) -> Text:
         try:
             l: Label = repo.get_label(name)
-            l.delete()
+            with self._own_change(repo, "deleted", {"name": name}):
+                l.delete()
             logger.info("Removed Label {} from repo {}.".format(
                     l.name, repo.full_name))
+            return "deleted"
         except UnknownObjectException:
-            pass
+            return "unchanged"
+
+    def start(self, gh):
+        if self.reconcile_on_start:
+            self._reconcile_safely(gh)
+
+        if self.reconcile_interval:
+            threading.Thread(target=self._reconcile_periodically,
+                             args=(gh,),
+                             name="gflows-reconcile-labels",
+                             daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown()
+
+    def _apply(self, repository, change, gh, span=None) -> Text:
+        # label fan-out can wait for more important requests
+        with scheduler.priority(BULK), tracer.activate(span):
+            try:
+                return change(utils.get_repo(repository, gh))
+            except GithubException as e:
+                logger.error("Failed to update labels of repo {}: {} {}"
+                             "".format(repository, e.status, e.data))
+                return "failed ({})".format(e.status)
+            except Exception as e:
+                # e.g. a network error, the other repositories go on
+                logger.exception("Failed to update labels of repo {}"
+                                 "".format(repository))
+                return "failed ({})".format(type(e).__name__)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="gflows-labels")
+            return self._executor
+
+    def _fan_out(self,
+                 repositories: List[Text],
+                 change: Callable,
+                 gh) -> Dict[Text, Text]:
+        """Apply a label change to all repositories concurrently.
+
+        Returns what happened on each repository."""
+
+        span = tracer.current()
+        results = self._get_executor().map(
+                lambda r: self._apply(r, change, gh, span), repositories)
+        return dict(zip(repositories, results))
+
+    def _list_labels(self, repository, gh) -> Optional[Dict[Text, Label]]:
+        with scheduler.priority(BULK):
+            try:
+                repo = utils.get_repo(repository, gh)
+                return {l.name.lower(): l for l in repo.get_labels()}
+            except GithubException as e:
+                logger.error("Failed to list labels of repo {}: {} {}"
+                             "".format(repository, e.status, e.data))
+                return None
+
+    @staticmethod
+    def _as_dict(label: Label) -> Dict[Text, Any]:
+        return {"name": label.name,
+                "color": label.color,
+                "description": label.description or ""}
+
+    def _wanted_labels(self,
+                       labels: Dict[Text, Dict[Text, Label]]
+                       ) -> Dict[Text, Dict[Text, Any]]:
+        """Decide which labels every repository should have.
+
+        With a `source` repository, its labels are copied. Otherwise it's
+        the union of all labels, if repositories disagree on the color or
+        description of a label, the most common version wins."""
+
+        if self.source:
+            return {k: self._as_dict(l)
+                    for k, l in labels.get(self.source, {}).items()}
+
+        versions = {}
+        for repository in self.repositories:
+            for k, l in labels.get(repository, {}).items():
+                version = (l.name, l.color, l.description or "")
+                versions.setdefault(k, Counter())[version] += 1
+
+        wanted = {}
+        for k, counts in versions.items():
+            name, color, description = counts.most_common(1)[0][0]
+            wanted[k] = {"name": name,
+                         "color": color,
+                         "description": description}
+        return wanted
+
+    def plan(self, gh) -> List[LabelChange]:
+        """Compute the changes needed to sync the labels.
+
+        Lists the labels of each repository once."""
+
+        listings = self._get_executor().map(
+                lambda r: self._list_labels(r, gh), self.repositories)
+        labels = {r: l
+                  for r, l in zip(self.repositories, listings)
+                  if l is not None}
+
+        if self.source and self.source not in labels:
+            logger.error("Can't reconcile labels without the labels of "
+                         "the source repository {}".format(self.source))
+            return []
+
+        wanted = self._wanted_labels(labels)
+        changes = []
+        for repository, current_labels in labels.items():
+            for k, label in wanted.items():
+                current = current_labels.get(k)
+                if current is None:
+                    changes.append(LabelChange(
+                            repository, "create", label, None))
+                elif self._as_dict(current) != label:
+                    changes.append(LabelChange(
+                            repository, "edit", label, current))
+
+            # without a source we can't tell new labels from deleted ones
+            if self.source:
+                for k, current in current_labels.items():
+                    if k not in wanted:
+                        changes.append(LabelChange(
+                                repository, "delete", None, current))
+        return changes
+
+    def _apply_change(self, repo, change: LabelChange) -> None:
+        label = change.label
+        if change.action == "create":
+            with self._own_change(repo, "created", label):
+                repo.create_label(label["name"],
+                                  label["color"],
+                                  label["description"])
+        elif change.action == "edit":
+            with self._own_change(repo, "edited", label):
+                # an empty description has to be sent to clear it
+                change.current.edit(label["name"],
+                                    label["color"],
+                                    label["description"])
+        elif change.action == "delete":
+            with self._own_change(repo, "deleted",
+                                  {"name": change.current.name}):
+                change.current.delete()
+
+    def reconcile(self, gh, dry_run=None) -> List[LabelChange]:
+        """Bring the labels of all repositories in sync.
+
+        Only the minimal set of create, edit and delete calls is sent.
+        With `dry_run` the planned changes are only logged."""
+
+        dry_run = self.dry_run if dry_run is None else dry_run
+        changes = self.plan(gh)
+        for change in changes:
+            logger.info("{}{}".format("[dry run] " if dry_run else "",
+                                      change))
+        if dry_run or not changes:
+            return changes
+
+        by_repository = {}
+        for change in changes:
+            by_repository.setdefault(change.repository, []).append(change)
+
+        def apply_all(repository, repo):
+            for change in by_repository[repository]:
+                self._apply_change(repo, change)
+            return "{} changes".format(len(by_repository[repository]))
+
+        results = self._get_executor().map(
+                lambda r: self._apply(r, partial(apply_all, r), gh),
+                by_repository)
+        summary = dict(zip(by_repository, results))
+        logger.info("Reconciled labels: {}".format(
+                ", ".join("{} {}".format(r, result)
+                          for r, result in summary.items())))
+        return changes
+
+    def _reconcile_safely(self, gh):
+        try:
+            self.reconcile(gh)
+        except Exception:
+            logger.exception("Failed to reconcile labels.")
+
+    def _reconcile_periodically(self, gh):
+        while not self._stopped.wait(self.reconcile_interval):
+            self._reconcile_safely(gh)
 
     def hook(self, event_type, data, gh):
         if (event_type != "label" or
@@ -52,43 +342,40 @@ class ShareLabelsAccrossRepositories(Workflow):
                     "full_name"].lower() not in self.repositories):
             return
 
+        if data.get("action") in self.events["label"] and self._is_echo(data):
+            return
+
         repositories = [r
                         for r in self.repositories
                         if r != data["repository"]["full_name"].lower()]
 
         action = data.get("action")
         if action == "created":
-            for repository in repositories:
-                try:
-                    repo = gh.get_repo(repository)
-                    self._update_or_create_label(
-                            repo,
-                            data["label"]["name"],
-                            data["label"])
-                except UnknownObjectException:
-                    continue
-                except GithubException:
-                    continue
+            summary = self._fan_out(
+                    repositories,
+                    lambda repo: self._update_or_create_label(
+                            repo, data["label"]["name"], data["label"]),
+                    gh)
         elif action == "edited":
-            for repository in repositories:
-                try:
-                    repo = gh.get_repo(repository)
-                    name = (data["changes"].get("name", {}).get("from") or
-                            data["label"]["name"])
-                    self._update_or_create_label(
-                            repo,
-                            name,
-                            data["label"])
-                except UnknownObjectException:
-                    continue
-                except GithubException:
-                    continue
+            name = (data["changes"].get("name", {}).get("from") or
+                    data["label"]["name"])
+            summary = self._fan_out(
+                    repositories,
+                    lambda repo: self._update_or_create_label(
+                            repo, name, data["label"]),
+                    gh)
         elif action == "deleted":
-            for repository in repositories:
-                try:
-                    repo = gh.get_repo(repository)
-                    self._delete_label(repo, data["label"]["name"])
-                except UnknownObjectException:
-                    continue
-                except GithubException:
-                    continue
+            summary = self._fan_out(
+                    repositories,
+                    lambda repo: self._delete_label(
+                            repo, data["label"]["name"]),
+                    gh)
+        else:
+            return
+
+        logger.info("Label {} {} on {}: {}".format(
+                data["label"]["name"],
+                action,
+                data["repository"]["full_name"],
+                ", ".join("{} {}".format(r, result)
+                          for r, result in summary.items())))
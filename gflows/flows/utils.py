@@ -1,22 +1,28 @@
 import logging
+import queue
 import re
+import threading
+from collections import OrderedDict
 from github import Consts, Github
 from github.Issue import Issue
-from typing import Text, Optional, Any, Dict
+from github.Repository import Repository
+from typing import Text, Optional, Any, Dict, Set, List, Iterable, Iterator
+
+from gflows import etags
+from gflows.cache import github_cache
+from gflows.scheduler import scheduler
+from gflows.tracing import tracer
+from gflows.transport import transport
 
 logger = logging.getLogger(__name__)
 
 
 def id_from_project_name(org: Text, name: Text, gh: Github) -> Text:
-    """Return the id of a project on an organization."""
+    """Return the id of a project on an organization.
 
-    headers, data = gh_request(
-            gh,
-            "GET",
-            "/orgs/{}/projects".format(org),
-            headers={"Accept": Consts.mediaTypeProjectsPreview})
+    Workflows should use the cached `projects.registry` instead."""
 
-    for p in data:
+    for p in gh_request_pages(gh, "/orgs/{}/projects".format(org)):
         if p.get("name") == name:
             return p.get("id")
 
@@ -36,7 +42,7 @@ def issue_from_card_id(card_id: Text, gh: Github) -> Optional[Issue]:
     if content_url:
         full_repo_name = "/".join(content_url.split("/")[-4:-2])
         issue_number = int(content_url.split("/")[-1])
-        repo = gh.get_repo(full_repo_name)
+        repo = get_repo(full_repo_name, gh)
         return repo.get_issue(issue_number)
     else:
         return None
@@ -103,36 +109,168 @@ def remove_card(card_id: Text, gh: Github) -> None:
     )
 
 
+def get_repo(full_name: Text, gh: Github) -> Repository:
+    """Return a repository, cached until a `repository` event arrives."""
+
+    return github_cache.get(("repo", full_name.lower()),
+                            lambda: gh.get_repo(full_name))
+
+
+def get_label_names(full_name: Text, gh: Github) -> Set[Text]:
+    """Return the label names of a repository.
+
+    Cached until a `label` event for the repository arrives."""
+
+    return github_cache.get(
+            ("labels", full_name.lower()),
+            lambda: {l.name for l in get_repo(full_name, gh).get_labels()})
+
+
 def has_write_permissions(user: Text, repo: Text, gh: Github):
-    p = gh.get_repo(repo).get_collaborator_permission(user)
+    p = github_cache.get(
+            ("permission", repo.lower(), user),
+            lambda: get_repo(repo, gh).get_collaborator_permission(user))
     return p in ["admin", "write"]
 
 
+# "#12" or "owner/repo#12"
+ISSUE_REFERENCE = re.compile(r"(?:([\w.-]+/[\w.-]+))?#(\d+)")
+
+
 def issue_id_from_commit_message(commit_message: Text) -> Optional[int]:
     """Return the issue referenced in a commit message.
 
     If there is no issue reference, `None` is returned."""
 
-    match = re.search("#(\d+)", commit_message)
+    match = ISSUE_REFERENCE.search(commit_message)
     if match:
-        return int(match.group(1))
+        return int(match.group(2))
     else:
         return None
 
 
-def gh_request(gh: Github, *args: Any, **kwargs: Any):
-    """Send a request to the github endpoint."""
-
+def issue_references(messages: Iterable[Text],
+                     repository: Text) -> List[Text]:
+    """Return all issues referenced in the messages without duplicates.
+
+    Issues are returned as "owner/repo/number", references without a
+    repository belong to `repository`."""
+
+    references = OrderedDict()
+    for message in messages:
+        for repo, number in ISSUE_REFERENCE.findall(message):
+            key = "{}/{}".format(repo or repository, number).lower()
+            references[key] = None
+    return list(references)
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(items: Iterable, buffer_size: int = 100) -> Iterator:
+    """Iterate over `items` while a background thread fetches ahead.
+
+    Loads the next pages of a paginated list while the current items are
+    processed. The order of the items is kept."""
+
+    buffer = queue.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+    done = object()
+    priority = scheduler.current_priority
+    span = tracer.current()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        with scheduler.priority(priority), tracer.activate(span):
+            try:
+                for item in items:
+                    put(item)
+                    if stopped.is_set():
+                        return
+            except Exception as e:
+                put(_Failed(e))
+            put(done)
+
+    threading.Thread(target=produce,
+                     name="gflows-prefetch",
+                     daemon=True).start()
     try:
-        logger.debug("fetching {}".format(
-                ", ".join(args)))
-    except Exception:
-        pass
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+
+
+def gh_request_pages(gh: Github,
+                     url: Text,
+                     per_page: int = 100) -> List[Dict[Text, Any]]:
+    """Fetch all pages of a project API listing."""
+
+    items = []
+    page = 1
+    while True:
+        _, data = gh_request(
+                gh,
+                "GET",
+                url,
+                parameters={"per_page": per_page, "page": page},
+                headers={"Accept": Consts.mediaTypeProjectsPreview})
+        items.extend(data or [])
+        if not data or len(data) < per_page:
+            return items
+        page += 1
+
+
+def gh_request(gh: Github,
+               verb: Text,
+               url: Text,
+               parameters: Optional[Dict[Text, Any]] = None,
+               headers: Optional[Dict[Text, Text]] = None,
+               input: Optional[Any] = None,
+               timeout: Optional[float] = None):
+    """Send a request to the github endpoint.
+
+    GET requests are sent conditionally if the response has been fetched
+    before. Github doesn't count a `304 Not Modified` against the rate
+    limit, in that case the stored body is returned. `timeout` overrides
+    the timeout of the `Github` instance for this request."""
+
+    logger.debug("fetching {}, {}".format(verb, url))
+
+    cache = etags.conditional_cache
+    key = etags.request_key(verb, url, parameters, headers or {})
+    cached = cache.get(key) if key else None
+    headers = etags.with_validators(dict(headers or {}), cached)
 
     # unfortunately, the library doesn't expose this yet, so we need to
     # do a hacky workaround
     # noinspection PyProtectedMember,PyUnresolvedReferences
-    return gh._Github__requester.requestJsonAndCheck(
-            *args,
-            **kwargs
-    )
+    requester = gh._Github__requester
+    with transport.timeout(timeout):
+        status, response_headers, output = requester.requestJson(
+                verb, url, parameters, headers, input)
+
+    if status == 304 and cached:
+        return response_headers, cache.revalidate(cached)
+
+    # raises the same exceptions as the library does for failed requests
+    # noinspection PyProtectedMember,PyUnresolvedReferences
+    response_headers, data = requester._Requester__check(
+            status, response_headers, output)
+
+    cache.store(key, response_headers, output)
+    return response_headers, data
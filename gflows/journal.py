@@ -0,0 +1,307 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Text
+
+logger = logging.getLogger(__name__)
+
+# put on the write queue to stop the writer
+_STOP = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id TEXT PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    received REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS completed (
+    delivery_id TEXT NOT NULL,
+    workflow TEXT NOT NULL,
+    PRIMARY KEY (delivery_id, workflow)
+);
+"""
+
+
+class JournalEntry:
+    """A delivery that hasn't been processed by all workflows yet."""
+
+    def __init__(self, delivery_id: Text, event_type: Text,
+                 payload: Dict[Text, Any], attempts: int,
+                 completed: Set[Text]):
+        self.delivery_id = delivery_id
+        self.event_type = event_type
+        self.payload = payload
+        self.attempts = attempts
+        self.completed = completed
+
+
+class _Write:
+    """Statements waiting to be committed by the writer thread."""
+
+    def __init__(self, statements, wait, release):
+        self.statements = statements
+        self.done = threading.Event() if wait else None
+        self.error = None
+        # delivery that may be replayed again once this is committed
+        self.release = release
+
+
+class Journal:
+    """Durable record of deliveries, stored in a sqlite file.
+
+    Deliveries are appended before they are processed and removed once
+    every workflow handled them. Failed deliveries are retried with an
+    exponential backoff, and deliveries that were still pending when the
+    process died are replayed on the next start.
+
+    All writes go through a single writer thread which commits whatever
+    accumulated in one transaction (group commit). The database runs in
+    WAL mode with `synchronous=NORMAL`, so there is no fsync per event.
+    """
+
+    def __init__(self,
+                 path: Text,
+                 batch_size: int = 100,
+                 flush_interval: float = 0.0,
+                 max_attempts: int = 8,
+                 backoff: float = 2.0,
+                 max_backoff: float = 600.0,
+                 poll_interval: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+
+        # deliveries currently being processed, they are not replayed
+        self._in_flight: Set[Text] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._writes = queue.Queue()
+        # connections reading the journal, one per thread
+        self._local = threading.local()
+        self._replayer = None
+
+        db = self._connect()
+        db.executescript(_SCHEMA)
+        db.close()
+
+        # started by the first write, worker processes of a
+        # `PartitionedDispatcher` are forked before any thread runs
+        self._writer: Optional[threading.Thread] = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def append(self, delivery_id: Text, event_type: Text,
+               payload: Dict[Text, Any]) -> Set[Text]:
+        """Store a delivery, returns once it has been committed.
+
+        Returns the workflows that already handled the delivery if it
+        was journaled before, e.g. by a run that went down."""
+
+        with self._lock:
+            self._in_flight.add(delivery_id)
+        self._submit([("INSERT OR IGNORE INTO deliveries "
+                       "(id, event_type, payload, received) "
+                       "VALUES (?, ?, ?, ?)",
+                       (delivery_id, event_type, json.dumps(payload),
+                        time.time()))],
+                     wait=True)
+        return {w for w, in self._reader().execute(
+                "SELECT workflow FROM completed WHERE delivery_id = ?",
+                (delivery_id,))}
+
+    def mark_done(self, delivery_id: Text, workflow: Text) -> None:
+        """Record that a workflow handled a delivery."""
+
+        self._submit([("INSERT OR IGNORE INTO completed "
+                       "(delivery_id, workflow) VALUES (?, ?)",
+                       (delivery_id, workflow))])
+
+    def finish(self, delivery_id: Text) -> None:
+        """Remove a delivery that was handled by all workflows."""
+
+        self.discard(delivery_id)
+
+    def discard(self, delivery_id: Text) -> None:
+        """Remove a delivery without processing it."""
+
+        self._submit([
+            ("DELETE FROM completed WHERE delivery_id = ?", (delivery_id,)),
+            ("DELETE FROM deliveries WHERE id = ?", (delivery_id,))],
+            release=delivery_id)
+
+    def retry_later(self, delivery_id: Text) -> None:
+        """Schedule the next attempt of a failed delivery.
+
+        Deliveries that failed `max_attempts` times are no longer replayed
+        but kept in the journal for inspection."""
+
+        logger.warning("Delivery {} failed, retrying later."
+                       "".format(delivery_id))
+        self._submit([("UPDATE deliveries "
+                       "SET attempts = attempts + 1, "
+                       "    next_attempt = ? + min(?, ? * (1 << attempts)) "
+                       "WHERE id = ?",
+                       (time.time(), self.max_backoff, self.backoff,
+                        delivery_id))],
+                     release=delivery_id)
+
+    def flush(self) -> None:
+        """Wait until all previous writes are committed."""
+
+        self._submit([], wait=True)
+
+    def pending(self) -> List[JournalEntry]:
+        """Return the deliveries that are due for another attempt.
+
+        Deliveries currently being processed are left out."""
+
+        self.flush()
+        db = self._connect()
+        try:
+            rows = db.execute(
+                    "SELECT id, event_type, payload, attempts "
+                    "FROM deliveries "
+                    "WHERE next_attempt <= ? AND attempts < ? "
+                    "ORDER BY received",
+                    (time.time(), self.max_attempts)).fetchall()
+            with self._lock:
+                in_flight = set(self._in_flight)
+            entries = []
+            for delivery_id, event_type, payload, attempts in rows:
+                if delivery_id in in_flight:
+                    continue
+                completed = {w for w, in db.execute(
+                        "SELECT workflow FROM completed "
+                        "WHERE delivery_id = ?", (delivery_id,))}
+                entries.append(JournalEntry(delivery_id, event_type,
+                                            json.loads(payload), attempts,
+                                            completed))
+            return entries
+        finally:
+            db.close()
+
+    def start(self, handler: Callable[..., Any]) -> None:
+        """Replay pending deliveries in the background.
+
+        `handler` is called with the event type, payload, delivery id
+        and the workflows that already completed the delivery."""
+
+        self._replayer = threading.Thread(target=self._replay_loop,
+                                          args=(handler,),
+                                          name="gflows-journal-replay",
+                                          daemon=True)
+        self._replayer.start()
+
+    def close(self) -> None:
+        """Stop replaying and commit all outstanding writes."""
+
+        self._stopped.set()
+        if self._replayer:
+            self._replayer.join()
+        with self._lock:
+            writer = self._writer
+        if writer:
+            self._writes.put(_STOP)
+            writer.join()
+
+    def _release(self, delivery_id):
+        with self._lock:
+            self._in_flight.discard(delivery_id)
+
+    def _submit(self, statements, wait=False, release=None):
+        # the replay loop must not pick up a delivery before its removal
+        # or next attempt is committed
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                        target=self._write_loop,
+                        name="gflows-journal-writer",
+                        daemon=True)
+                self._writer.start()
+        write = _Write(statements, wait, release)
+        self._writes.put(write)
+        if wait:
+            write.done.wait()
+            if write.error:
+                raise write.error
+
+    def _replay_loop(self, handler):
+        while not self._stopped.is_set():
+            for entry in self.pending():
+                with self._lock:
+                    if entry.delivery_id in self._in_flight:
+                        continue
+                    self._in_flight.add(entry.delivery_id)
+
+                logger.info("Replaying delivery {} (attempt {})".format(
+                        entry.delivery_id, entry.attempts + 1))
+                try:
+                    handler(entry.event_type, entry.payload,
+                            entry.delivery_id, entry.completed)
+                except Exception:
+                    # e.g. a full queue, the entry stays in the journal
+                    # and the rest are tried again on the next poll
+                    logger.exception("Replaying delivery {} failed."
+                                     "".format(entry.delivery_id))
+                    self._release(entry.delivery_id)
+                    break
+            self._stopped.wait(self.poll_interval)
+
+    def _write_loop(self):
+        db = self._connect()
+        stop = False
+        while not stop:
+            batch = [self._writes.get()]
+            if batch[0] is _STOP:
+                break
+
+            # collect everything that queued up while we were committing
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._writes.get(
+                            timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write is _STOP:
+                    stop = True
+                    break
+                batch.append(write)
+
+            error = None
+            try:
+                with db:
+                    for write in batch:
+                        for sql, params in write.statements:
+                            db.execute(sql, params)
+            except Exception as e:
+                logger.exception("Writing to the journal failed.")
+                error = e
+
+            for write in batch:
+                if write.release is not None:
+                    self._release(write.release)
+                if write.done:
+                    write.error = error
+                    write.done.set()
+        db.close()
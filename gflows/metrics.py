@@ -0,0 +1,256 @@
+"""Process metrics in the Prometheus text format.
+
+Recording doesn't take a lock: every thread counts into its own shard,
+the shards are only summed up when the metrics are scraped."""
+
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text, Tuple
+
+# seconds, covers quick cache hits up to multi page github requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: Any) -> Text:
+    return (str(value).replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_labels(names: Sequence[Text], values: Sequence[Any],
+                   extra: Text = "") -> Text:
+    labels = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> Text:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A metric whose samples are recorded into per thread shards."""
+
+    type = None
+
+    def __init__(self, name: Text, help: Text,
+                 labels: Sequence[Text] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        # (thread, samples) of every thread that recorded something
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        # samples of threads that ended
+        self._retired: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[Tuple, Any]:
+        try:
+            return self._local.samples
+        except AttributeError:
+            samples = self._local.samples = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), samples))
+            return samples
+
+    def _collect(self) -> Dict[Tuple, Any]:
+        """Sum up the samples of all threads."""
+
+        with self._lock:
+            alive = []
+            for thread, samples in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, samples))
+                else:
+                    # a finished thread doesn't write anymore
+                    for key, value in list(samples.items()):
+                        self._retired[key] = self._merge(
+                                self._retired.get(key), value)
+            self._shards = alive
+
+            total = dict(self._retired)
+            for _, samples in alive:
+                for key, value in list(samples.items()):
+                    total[key] = self._merge(total.get(key), value)
+        return total
+
+    def _merge(self, a, b):
+        raise NotImplementedError
+
+    def render(self) -> List[Text]:
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for key, value in sorted(self._collect().items()):
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> List[Text]:
+        return ["{}{} {}".format(self.name,
+                                 _format_labels(self.labels, key),
+                                 _format_value(value))]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values: Any, amount: float = 1) -> None:
+        samples = self._shard()
+        samples[label_values] = samples.get(label_values, 0) + amount
+
+    def _merge(self, a, b):
+        return (a or 0) + b
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: Text, help: Text,
+                 labels: Sequence[Text] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: Any) -> None:
+        samples = self._shard()
+        sample = samples.get(label_values)
+        if sample is None:
+            # a count per bucket (the last one is +Inf) and the sum
+            sample = samples[label_values] = [0] * (len(self.buckets) + 2)
+        sample[bisect.bisect_left(self.buckets, value)] += 1
+        sample[-1] += value
+
+    def _merge(self, a, b):
+        if a is None:
+            return list(b)
+        return [x + y for x, y in zip(a, b)]
+
+    def _render_sample(self, key, value) -> List[Text]:
+        lines = []
+        count = 0
+        for le, n in zip(self.buckets + (float("inf"),), value[:-1]):
+            count += n
+            lines.append("{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(self.labels, key,
+                                   'le="{}"'.format(_format_value(le))),
+                    count))
+        labels = _format_labels(self.labels, key)
+        lines.append("{}_sum{} {}".format(self.name, labels,
+                                          _format_value(value[-1])))
+        lines.append("{}_count{} {}".format(self.name, labels, count))
+        return lines
+
+
+class Gauge(_Metric):
+    """A value that is read when the metrics are scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name: Text, help: Text,
+                 read: Callable[[], Optional[float]]):
+        super().__init__(name, help)
+        self.read = read
+
+    def _collect(self):
+        value = self.read()
+        return {} if value is None else {(): value}
+
+
+class Registry:
+    """The metrics of the process, rendered for the `/metrics` endpoint."""
+
+    def __init__(self):
+        self._metrics: Dict[Text, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, replacing an earlier one with the same name."""
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: Text, help: Text,
+                labels: Sequence[Text] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: Text, help: Text,
+                  labels: Sequence[Text] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: Text, help: Text,
+              read: Callable[[], Optional[float]]) -> Gauge:
+        return self.register(Gauge(name, help, read))
+
+    def render(self) -> Text:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# shared by the whole process
+registry = Registry()
+
+hook_duration = registry.histogram(
+        "gflows_hook_duration_seconds",
+        "Time a workflow took to handle an event.",
+        ["event_type", "workflow"])
+
+hook_results = registry.counter(
+        "gflows_hooks_total",
+        "Events handled by a workflow.",
+        ["event_type", "workflow", "result"])
+
+coalesced_events = registry.counter(
+        "gflows_coalesced_events_total",
+        "Events merged into a later event of the same card or label.",
+        ["event_type"])
+
+coalesce_delay = registry.histogram(
+        "gflows_coalesce_delay_seconds",
+        "Time events were held back to merge them with later ones.",
+        ["event_type"])
+
+github_requests = registry.counter(
+        "gflows_github_requests_total",
+        "Requests sent to the github API.",
+        ["method", "endpoint", "status"])
+
+
+# path segments that are followed by names
+_NAMED = {
+    "repos": (":owner", ":repo"),
+    "orgs": (":org",),
+    "users": (":user",),
+    "collaborators": (":user",),
+    "labels": (":name",),
+    "teams": (":team",),
+}
+
+
+def endpoint(path: Text) -> Text:
+    """Turn a request path into an endpoint without ids and names, e.g.
+    "/repos/:owner/:repo/issues/:id"."""
+
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    if parts[:2] == ["api", "v3"]:
+        # github enterprise
+        parts = parts[2:]
+
+    result = []
+    names = ()
+    for part in parts:
+        if names:
+            result.append(names[0])
+            names = names[1:]
+        elif part.isdigit():
+            result.append(":id")
+        else:
+            result.append(part)
+            names = _NAMED.get(part, ())
+    return "/" + "/".join(result)
@@ -0,0 +1,86 @@
+import json
+import re
+import string
+from typing import Any, Collection, Dict, List, Optional, Text
+
+# github puts the action first, this lets us route without decoding
+_ACTION = re.compile(rb'\s*{\s*"action"\s*:\s*"([a-z_]+)"')
+
+# a path tree leaf, the whole value below it is kept
+_WHOLE = None
+
+
+def peek_action(raw: bytes) -> Optional[Text]:
+    """Return the action of a raw payload without decoding it.
+
+    Returns `None` if the action isn't the first key of the payload."""
+
+    match = _ACTION.match(raw)
+    if match:
+        return match.group(1).decode("ascii")
+    else:
+        return None
+
+
+def path_tree(paths: Collection[Text]) -> Dict[Text, Any]:
+    """Turn dotted paths into a tree, e.g. `{"commits": {"message": None}}`.
+
+    A path covers everything below it, so "project_card" wins over
+    "project_card.id"."""
+
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is _WHOLE:
+                break
+        else:
+            node[parts[-1]] = _WHOLE
+    return tree
+
+
+def format_paths(template: Text) -> List[Text]:
+    """Return the dotted paths of the fields a format string reads, e.g.
+    `["sender.login"]` for "{sender[login]} pushed"."""
+
+    paths = []
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field:
+            paths.append(re.sub(r"\[([^\]]*)\]", r".\1", field))
+    return paths
+
+
+def select(value: Any, tree: Optional[Dict[Text, Any]]) -> Any:
+    """Keep only the parts of a decoded value that are in the path tree.
+
+    Lists are traversed transparently, so "commits.message" selects the
+    message of every commit."""
+
+    if tree is _WHOLE:
+        return value
+    elif isinstance(value, list):
+        return [select(v, tree) for v in value]
+    elif isinstance(value, dict):
+        return {k: select(value[k], subtree)
+                for k, subtree in tree.items()
+                if k in value}
+    else:
+        return value
+
+
+def decode(raw: bytes,
+           tree: Optional[Dict[Text, Any]] = _WHOLE) -> Dict[Text, Any]:
+    """Decode a json payload and keep only the fields in the path tree.
+
+    The whole payload is decoded before it is projected, the projection
+    only shrinks what is queued and held by the hooks. Decoding is only
+    skipped for actions no workflow handles, see `peek_action`.
+
+    Raises a `ValueError` if the payload isn't a json object."""
+
+    data = json.loads(raw.decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("Payload is not a json object.")
+    return select(data, tree)
@@ -0,0 +1,326 @@
+"""Replays recorded deliveries straight into the workflow hooks, e.g. to
+catch up on the deliveries missed during an outage:
+
+    gflows-replay my_config:workflows deliveries/ --checkpoint replay.json
+
+The webhook server is skipped. Deliveries are handled in parallel but in
+order per card, label and repository (see `PartitionedDispatcher`), as
+fast as the request scheduler lets them use the rate limit. Redelivered
+duplicates are skipped, and so are events superseded by a later event
+about the same card or label. With a checkpoint an interrupted replay
+continues where it stopped."""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import runpy
+import sys
+import threading
+import time
+from typing import (
+    Any, Dict, Iterator, List, NamedTuple, Optional, Set, Text, Tuple)
+
+from gflows.coalesce import coalesce_key, replaceable
+from gflows.dispatch import PartitionedDispatcher, QueueFullError
+from gflows.workflow import Workflows
+
+logger = logging.getLogger(__name__)
+
+# how long to wait for the workers if their queues are full
+SUBMIT_RETRY_INTERVAL = 0.05
+
+
+class Delivery(NamedTuple):
+    # index of the delivery across all sources
+    position: int
+    event_type: Text
+    payload: Dict[Text, Any]
+    delivery_id: Optional[Text]
+
+
+def source_files(sources: List[Text]) -> List[Text]:
+    """Expand directories to the `.json` and `.jsonl` files in them."""
+
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(sorted(os.path.join(source, name)
+                                for name in os.listdir(source)
+                                if name.endswith((".json", ".jsonl"))))
+        else:
+            files.append(source)
+    return files
+
+
+def _parse(record: Dict[Text, Any]) -> Tuple[Text, Dict, Optional[Text]]:
+    """Read a recorded delivery, either with `event_type`, `payload` and
+    `delivery_id` or as returned by github's hook deliveries API."""
+
+    request = record.get("request") or {}
+    headers = request.get("headers") or {}
+    event_type = (record.get("event_type") or record.get("event")
+                  or headers.get("X-GitHub-Event"))
+    payload = record.get("payload", request.get("payload"))
+    delivery_id = (record.get("delivery_id") or record.get("guid")
+                   or headers.get("X-GitHub-Delivery"))
+
+    if not event_type or not isinstance(payload, dict):
+        raise ValueError("Not a recorded delivery: {}".format(
+                json.dumps(record)[:200]))
+    return event_type, payload, delivery_id
+
+
+def read_deliveries(files: List[Text]) -> Iterator[Delivery]:
+    """Stream the deliveries of json lines files and json files holding
+    a delivery or a list of them."""
+
+    position = 0
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = json.load(f)
+                if isinstance(records, dict):
+                    records = [records]
+
+            for record in records:
+                yield Delivery(position, *_parse(record))
+                position += 1
+
+
+class Replay:
+    """Streams recorded deliveries into the hooks of `workflows`.
+
+    The configured dispatcher, journal and coalescer of `workflows`
+    aren't used. Progress is logged every `progress_interval` seconds
+    and saved to `checkpoint_path`: the position up to which all
+    deliveries are handled and the ids of the deliveries that failed.
+    Failed deliveries are not retried when resuming."""
+
+    def __init__(self, workflows: Workflows, sources: List[Text],
+                 checkpoint_path: Optional[Text] = None,
+                 workers: int = 4,
+                 collapse: bool = True,
+                 progress_interval: float = 10.0):
+        self.workflows = workflows
+        self.files = source_files(sources)
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.collapse = collapse
+        self.progress_interval = progress_interval
+
+        self.total = 0
+        self.handled = 0
+        self.duplicates: Set[int] = set()
+        self.superseded: Set[int] = set()
+        self.failed: List[Text] = []
+        # all deliveries before this position are handled
+        self.position = 0
+        self._completed: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def _plan(self):
+        """Find the duplicates and superseded events in a first pass."""
+
+        seen = set()
+        latest: Dict[Text, int] = {}
+        for delivery in read_deliveries(self.files):
+            self.total += 1
+            if delivery.delivery_id:
+                if delivery.delivery_id in seen:
+                    self.duplicates.add(delivery.position)
+                    continue
+                seen.add(delivery.delivery_id)
+
+            # the same events the coalescer merges, see `Coalescer`
+            key = (coalesce_key(delivery.event_type, delivery.payload)
+                   if self.collapse else None)
+            if key is not None:
+                if key in latest:
+                    self.superseded.add(latest[key])
+                if replaceable(delivery.event_type, delivery.payload):
+                    latest[key] = delivery.position
+                else:
+                    latest.pop(key, None)
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(
+                self.checkpoint_path):
+            return
+
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("files") != self.files:
+            raise ValueError("Checkpoint {} belongs to a replay of other "
+                             "files.".format(self.checkpoint_path))
+        self.position = checkpoint["position"]
+        self.failed = checkpoint.get("failed", [])
+        logger.info("Resuming after {} deliveries.".format(self.position))
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+
+        with self._lock:
+            checkpoint = {"files": self.files,
+                          "position": self.position,
+                          "total": self.total,
+                          "failed": list(self.failed)}
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _complete(self, position, failed_delivery=None):
+        with self._lock:
+            if failed_delivery is not None:
+                self.failed.append(failed_delivery)
+            self._completed.add(position)
+            while self.position in self._completed:
+                self._completed.remove(self.position)
+                self.position += 1
+
+    def _handle(self, event_type, payload, delivery_id, position):
+        failed = True
+        try:
+            _, failed = self.workflows._run_hooks(event_type, payload,
+                                                  delivery_id)
+        finally:
+            with self._lock:
+                self.handled += 1
+            self._complete(position,
+                           (delivery_id or str(position)) if failed else None)
+
+    def _submit(self, dispatcher, delivery):
+        while True:
+            try:
+                dispatcher.submit(delivery.event_type, delivery.payload,
+                                  delivery.delivery_id, delivery.position)
+                return
+            except QueueFullError:
+                time.sleep(SUBMIT_RETRY_INTERVAL)
+
+    def report(self) -> Dict[Text, Any]:
+        with self._lock:
+            return {"total": self.total,
+                    "position": self.position,
+                    "handled": self.handled,
+                    "duplicates": len(self.duplicates),
+                    "superseded": len(self.superseded),
+                    "failed": len(self.failed)}
+
+    def _log_progress(self, started):
+        report = self.report()
+        rate = report["handled"] / max(time.time() - started, 1e-6)
+        logger.info("Replayed {position}/{total} deliveries ({handled} "
+                    "handled, {duplicates} duplicates, {superseded} "
+                    "superseded, {failed} failed), {rate:.1f}/s."
+                    "".format(rate=rate, **report))
+
+    def run(self) -> Dict[Text, Any]:
+        """Replay all deliveries, returns the counts of `report`."""
+
+        self._plan()
+        self._load_checkpoint()
+        logger.info("Replaying {} deliveries from {} files, skipping {} "
+                    "duplicates and {} superseded events.".format(
+                            self.total, len(self.files),
+                            len(self.duplicates), len(self.superseded)))
+        if self.position >= self.total:
+            return self.report()
+
+        # the hooks are called directly, not through the server
+        self.workflows.dispatcher = None
+        self.workflows.journal = None
+        self.workflows.coalescer = None
+        self.workflows.start()
+
+        dispatcher = PartitionedDispatcher(workers=self.workers)
+        dispatcher.start(self._handle)
+        started = last_progress = time.time()
+        try:
+            for delivery in read_deliveries(self.files):
+                if delivery.position < self.position:
+                    continue
+                if (delivery.position in self.duplicates
+                        or delivery.position in self.superseded):
+                    self._complete(delivery.position)
+                else:
+                    self._submit(dispatcher, delivery)
+
+                if time.time() - last_progress >= self.progress_interval:
+                    last_progress = time.time()
+                    self._log_progress(started)
+                    self._save_checkpoint()
+        finally:
+            dispatcher.shutdown()
+            self._save_checkpoint()
+            self.workflows.shutdown()
+
+        self._log_progress(started)
+        return self.report()
+
+
+def load_workflows(spec: Text) -> Workflows:
+    """Load the workflows configured in a module or python file, given
+    as "module:attribute" or "path/to/file.py:attribute".
+
+    The attribute defaults to `workflows`, if it is a function it is
+    called to create the workflows."""
+
+    location, _, attribute = spec.partition(":")
+    if location.endswith(".py"):
+        namespace = runpy.run_path(location)
+    else:
+        namespace = vars(importlib.import_module(location))
+
+    workflows = namespace.get(attribute or "workflows")
+    if callable(workflows) and not isinstance(workflows, Workflows):
+        workflows = workflows()
+    if not isinstance(workflows, Workflows):
+        raise ValueError("{} is not a Workflows configuration.".format(spec))
+    return workflows
+
+
+def main(argv: Optional[List[Text]] = None) -> int:
+    parser = argparse.ArgumentParser(
+            description="Replay recorded github deliveries into the "
+                        "workflows without the webhook server.")
+    parser.add_argument("config",
+                        help="the workflows, as module:attribute or "
+                             "file.py:attribute")
+    parser.add_argument("sources", nargs="+",
+                        help="json lines or json files of recorded "
+                             "deliveries, or directories containing them")
+    parser.add_argument("--checkpoint",
+                        help="file the progress is saved to and resumed "
+                             "from")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="deliveries handled at the same time")
+    parser.add_argument("--no-collapse", dest="collapse",
+                        action="store_false",
+                        help="also replay events superseded by later "
+                             "events of the same card or label")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="seconds between progress reports")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    replay = Replay(load_workflows(args.config),
+                    args.sources,
+                    checkpoint_path=args.checkpoint,
+                    workers=args.workers,
+                    collapse=args.collapse,
+                    progress_interval=args.progress_interval)
+    report = replay.run()
+    print(json.dumps(report))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Mapping, Optional, Text
+
+from gflows import metrics
+
+logger = logging.getLogger(__name__)
+
+# priorities of github requests, lower values are served first
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+# how long to back off from a secondary rate limit without a retry-after
+SECONDARY_LIMIT_WAIT = 60.0
+
+# how often coroutines check for their turn while threads are waiting
+ASYNC_POLL_INTERVAL = 0.05
+
+
+class RequestScheduler:
+    """Paces github requests based on the remaining rate limit.
+
+    Requests go through unpaced while more than the `watermark` share of
+    the rate limit remains. Below it, every request takes a token from a
+    bucket that is refilled so the remaining quota lasts until the limit
+    resets; interactive requests aren't held back by an empty bucket.
+    Waiting requests are served by priority. Once the quota drops below
+    the share reserved for more important work, requests of lower
+    priority are deferred until the limit resets. Secondary rate limits
+    pause all requests.
+
+    Only the core rate limit is tracked, responses announcing another
+    resource (e.g. graphql or search) don't change the quota."""
+
+    def __init__(self,
+                 burst: int = 50,
+                 min_rate: float = 1.0,
+                 reserves: Optional[Dict[int, float]] = None,
+                 max_retries: int = 3,
+                 watermark: float = 0.5):
+        self.burst = burst
+        self.min_rate = min_rate
+        # fraction of the rate limit below which requests are paced
+        self.watermark = watermark
+        # fraction of the rate limit kept for more important work
+        self.reserves = reserves or {
+            INTERACTIVE: 0.0, NORMAL: 0.05, BULK: 0.2}
+        self.max_retries = max_retries
+
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset = 0.0
+        self.blocked_until = 0.0
+
+        # requests per second, `None` until we know the rate limit
+        self._rate: Optional[float] = None
+        self._tokens = float(burst)
+        self._refilled = time.time()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @property
+    def current_priority(self) -> int:
+        return getattr(self._local, "priority", NORMAL)
+
+    @contextmanager
+    def priority(self, priority: int):
+        """Send the requests made in this block with a priority."""
+
+        previous = self.current_priority
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def acquire(self) -> None:
+        """Block until the current thread may send a request."""
+
+        priority = self.current_priority
+        ticket = (priority, next(self._tickets))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] == ticket:
+                        delay = self._delay(priority)
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self._cond.wait(delay)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+            self._take()
+
+    async def acquire_async(self, priority: Optional[int] = None) -> None:
+        """Wait without blocking the event loop until a request may be
+        sent.
+
+        Threads waiting with the same or a more important priority go
+        first."""
+
+        if priority is None:
+            priority = self.current_priority
+        while True:
+            with self._cond:
+                if not self._waiting or self._waiting[0][0] > priority:
+                    delay = self._delay(priority)
+                    if delay <= 0:
+                        self._take()
+                        return
+                else:
+                    delay = ASYNC_POLL_INTERVAL
+            await asyncio.sleep(delay)
+
+    def _take(self):
+        if self._pacing():
+            self._tokens -= 1
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def update(self, status: int, headers: Mapping[Text, Text],
+               body: Text = "", priority: Optional[int] = None) -> bool:
+        """Track the quota, returns `True` if the request was throttled
+        and should be retried."""
+
+        if priority is None:
+            priority = self.current_priority
+        now = time.time()
+        retry = False
+        # e.g. graphql requests have a quota of their own
+        resource = headers.get("X-RateLimit-Resource", "core")
+        with self._cond:
+            if "X-RateLimit-Remaining" in headers and resource == "core":
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+                self.limit = int(headers.get("X-RateLimit-Limit", 0)) or None
+                self.reset = float(headers.get("X-RateLimit-Reset", now))
+                self._refill(now)
+                self._rate = max(self.min_rate,
+                                 self.remaining / max(1.0, self.reset - now))
+
+            if status in (403, 429):
+                message = (body or "").lower()
+                if "Retry-After" in headers:
+                    self.blocked_until = now + float(headers["Retry-After"])
+                    retry = True
+                elif "secondary rate limit" in message or "abuse" in message:
+                    self.blocked_until = now + SECONDARY_LIMIT_WAIT
+                    retry = True
+                elif (resource == "core"
+                      and headers.get("X-RateLimit-Remaining") == "0"):
+                    # interactive work fails instead of waiting for a reset
+                    retry = priority != INTERACTIVE
+
+            if retry:
+                logger.warning("Hit the github rate limit, waiting {:.0f}s."
+                               "".format(max(self.blocked_until,
+                                             self.reset) - now))
+            self._cond.notify_all()
+        return retry
+
+    def _pacing(self):
+        """Check if the quota is low enough to pace requests."""
+
+        return (self._rate is not None
+                and (not self.limit
+                     or self.remaining <= self.watermark * self.limit))
+
+    def _refill(self, now):
+        if self._rate is not None:
+            self._tokens = min(float(self.burst),
+                               self._tokens
+                               + (now - self._refilled) * self._rate)
+        self._refilled = now
+
+    def _delay(self, priority):
+        """Seconds until a request of this priority may be sent."""
+
+        now = time.time()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        if (self.remaining is not None and self.limit and self.reset > now
+                and priority != INTERACTIVE
+                and self.remaining <= self.reserves[priority] * self.limit):
+            return self.reset - now
+
+        self._refill(now)
+        if (self._tokens >= 1 or priority == INTERACTIVE
+                or not self._pacing()):
+            return 0
+        return (1 - self._tokens) / self._rate
+
+
+# every github request of the process goes through this scheduler
+scheduler = RequestScheduler()
+
+metrics.registry.gauge("gflows_github_rate_limit_remaining",
+                       "Requests left until the github rate limit resets.",
+                       lambda: scheduler.remaining)
+metrics.registry.gauge("gflows_github_rate_limit_reset_seconds",
+                       "Seconds until the github rate limit resets.",
+                       lambda: (max(0.0, scheduler.reset - time.time())
+                                if scheduler.remaining is not None
+                                else None))
@@ -1,9 +1,13 @@
 import hashlib
 import hmac
+import inspect
 import logging
 
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, jsonify
 
+from gflows import metrics, payload
+from gflows.dispatch import QueueFullError
+from gflows.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -26,17 +30,87 @@ def _get_header(key):
         abort(400, 'Missing header: ' + key)
 
 
-def create_app(hook, gh_secret=None):
+def _decode(event_type, raw):
+    return payload.decode(raw)
+
+
+def _takes_delivery_id(hook):
+    """Check if a hook accepts the delivery id as third argument."""
+
+    try:
+        parameters = inspect.signature(hook).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    positional = [p
+                  for p in parameters
+                  if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    return (len(positional) >= 3
+            or any(p.kind == p.VAR_POSITIONAL for p in parameters))
+
+
+def _adapt_hook(hook):
+    """Call hooks written for `hook(event_type, data)` without the
+    delivery id."""
+
+    if _takes_delivery_id(hook):
+        return hook
+
+    if inspect.iscoroutinefunction(hook):
+        async def adapted(event_type, data, delivery_id):
+            return await hook(event_type, data)
+    else:
+        def adapted(event_type, data, delivery_id):
+            return hook(event_type, data)
+    return adapted
+
+
+def create_app(hook, gh_secret=None, accepts=None, ready=None, decode=None,
+               debug=False):
+    """Create the flask app receiving the github webhooks.
+
+    `hook` is called with the event type, payload and delivery id of
+    every verified delivery (hooks taking only the event type and
+    payload are still supported). If it raises a `QueueFullError` the delivery
+    is rejected with a 503. Deliveries of event types for which `accepts`
+    returns `False` are acknowledged without reading the body. While
+    `ready` returns `False`, the health check and deliveries get a 503.
+
+    `decode` turns the event type and raw body into the payload. If it
+    returns `None` the delivery is acknowledged without calling `hook`.
+
+    With `debug`, the traces of slow deliveries are served on
+    `/deliveries/<id>`, see `tracing`."""
+
     app = Flask(__name__)
+    decode = decode or _decode
+    hook = _adapt_hook(hook)
+
+    def is_ready():
+        return ready is None or ready()
 
     @app.route("/health")
     def hello_world():
+        if not is_ready():
+            return "starting up", 503
         return "all save and sound"
 
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.registry.render(),
+                        mimetype="text/plain; version=0.0.4")
+
     @app.route("/postreceive", methods=["POST"])
     def on_push():
         """Callback from Flask"""
 
+        if not is_ready():
+            abort(503, 'Starting up')
+
+        event_type = _get_header('X-Github-Event')
+        if accepts is not None and not accepts(event_type):
+            logger.debug('Skipping unsubscribed event %s', event_type)
+            return '', 204
+
         digest = _get_digest(gh_secret)
 
         if digest is not None:
@@ -46,20 +120,66 @@ def create_app(hook, gh_secret=None):
                     or not hmac.compare_digest(sig_parts[1], digest)):
                 abort(400, 'Invalid signature')
 
-        event_type = _get_header('X-Github-Event')
-        data = request.get_json()
+        # forged deliveries must not push out the traces of real ones
+        delivery_id = request.headers.get('X-Github-Delivery')
+        trace = tracer.begin(delivery_id)
+        try:
+            with tracer.activate(trace.root if trace else None), \
+                    tracer.span("receive", event_type=event_type):
+                return receive(event_type)
+        except Exception:
+            tracer.discard(delivery_id)
+            raise
+
+    def receive(event_type):
+        with tracer.span("decode"):
+            try:
+                data = decode(event_type, request.get_data())
+            except ValueError:
+                abort(400, 'Request body must contain json')
+
+        delivery_id = _get_header('X-Github-Delivery')
 
         if data is None:
-            abort(400, 'Request body must contain json')
+            logger.debug('Skipping unhandled %s event', event_type)
+            tracer.discard(delivery_id)
+            return '', 204
 
-        logger.info(
-                '%s (%s)', _format_event(event_type, data),
-                _get_header('X-Github-Delivery'))
+        logger.info('%s (%s)', _format_event(event_type, data), delivery_id)
 
-        hook(event_type, data)
+        try:
+            with tracer.span("dispatch"):
+                hook(event_type, data, delivery_id)
+        except QueueFullError:
+            abort(503, 'Too many queued events')
 
         return '', 204
 
+    if debug:
+        @app.route("/deliveries")
+        def slow_deliveries():
+            return jsonify([{"delivery_id": t.delivery_id,
+                             "duration_ms": round(t.root.duration * 1000)}
+                            for t in tracer.traces])
+
+        @app.route("/deliveries/<delivery_id>")
+        def delivery_trace(delivery_id):
+            trace = tracer.get(delivery_id)
+            if trace is None:
+                abort(404, 'No trace of delivery ' + delivery_id)
+            return jsonify(trace.as_dict())
+
+        @app.route("/deliveries/sampling", methods=["PUT"])
+        def set_sampling():
+            """Change the tracing with `?rate=0.1&threshold=2.5`"""
+
+            tracer.sample_rate = request.args.get(
+                    'rate', tracer.sample_rate, type=float)
+            tracer.threshold = request.args.get(
+                    'threshold', tracer.threshold, type=float)
+            return jsonify({"rate": tracer.sample_rate,
+                            "threshold": tracer.threshold})
+
     return app
 
 
@@ -0,0 +1,195 @@
+"""Records where the time of a delivery goes.
+
+A sampled delivery gets a tree of spans: receiving it, the workflow
+hooks and every github request they send. Deliveries that took longer
+than `threshold` seconds are kept in a bounded buffer for inspection."""
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """A timed step of a delivery with the steps it was made of."""
+
+    def __init__(self, name: Text, **attributes: Any):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def child(self, name: Text, **attributes: Any) -> "Span":
+        span = Span(name, **attributes)
+        # appending is atomic, spans of fanned out requests don't race
+        self.children.append(span)
+        return span
+
+    def as_dict(self, origin: float) -> Dict[Text, Any]:
+        return {"name": self.name,
+                "start_ms": round((self.start - origin) * 1000, 3),
+                "duration_ms": round(self.duration * 1000, 3),
+                "attributes": self.attributes,
+                "children": [c.as_dict(origin) for c in self.children]}
+
+
+class Trace:
+    def __init__(self, delivery_id: Text):
+        self.delivery_id = delivery_id
+        self.root = Span("delivery", delivery_id=delivery_id)
+
+    def as_dict(self) -> Dict[Text, Any]:
+        return self.root.as_dict(self.root.start)
+
+
+class Tracer:
+    """Traces a `sample_rate` fraction of the deliveries.
+
+    Both the sample rate and the `threshold` can be changed while
+    running. The slowest recent traces are kept, up to `max_traces`."""
+
+    def __init__(self, sample_rate: float = 0.0, threshold: float = 1.0,
+                 max_traces: int = 100, max_active: int = 1000):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.max_active = max_active
+        self.traces = deque(maxlen=max_traces)
+        # traces of deliveries that are still being handled
+        self._active: Dict[Text, Trace] = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def begin(self, delivery_id: Optional[Text],
+              sampled: Optional[bool] = None) -> Optional[Trace]:
+        """Start tracing a delivery if it is sampled.
+
+        `sampled` overrides the sample rate, e.g. for a delivery another
+        process decided to trace."""
+
+        if sampled is None:
+            sampled = (self.sample_rate > 0
+                       and random.random() < self.sample_rate)
+        if not delivery_id or not sampled:
+            return None
+
+        trace = Trace(delivery_id)
+        with self._lock:
+            self._active[delivery_id] = trace
+            while len(self._active) > self.max_active:
+                # e.g. deliveries rejected before they were handled
+                self._active.popitem(last=False)
+        return trace
+
+    def finish(self, delivery_id: Optional[Text]) -> None:
+        """Stop tracing a delivery, keeps the trace if it was slow."""
+
+        with self._lock:
+            trace = self._active.pop(delivery_id, None)
+        if trace is None:
+            return
+
+        trace.root.end = time.time()
+        if trace.root.duration >= self.threshold:
+            self.traces.append(trace)
+            logger.info("Slow delivery {} took {:.2f}s.".format(
+                    delivery_id, trace.root.duration))
+
+    def discard(self, delivery_id: Optional[Text]) -> None:
+        with self._lock:
+            self._active.pop(delivery_id, None)
+
+    def get(self, delivery_id: Text) -> Optional[Trace]:
+        """Return a recorded or still running trace."""
+
+        with self._lock:
+            if delivery_id in self._active:
+                return self._active[delivery_id]
+        for trace in list(self.traces):
+            if trace.delivery_id == delivery_id:
+                return trace
+        return None
+
+    def current(self) -> Optional[Span]:
+        """Return the span the current thread is working in."""
+
+        return getattr(self._local, "span", None)
+
+    @contextmanager
+    def activate(self, span: Optional[Span]) -> Iterator[Optional[Span]]:
+        """Record the spans of this thread as children of `span`, e.g.
+        in a worker thread the work was handed to."""
+
+        previous = self.current()
+        self._local.span = span
+        try:
+            yield span
+        finally:
+            self._local.span = previous
+
+    @contextmanager
+    def delivery(self, delivery_id: Optional[Text]
+                 ) -> Iterator[Optional[Span]]:
+        """Continue the trace of a delivery in this thread."""
+
+        with self.activate(self.root(delivery_id)) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name: Text, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Time a step of the delivery traced by this thread.
+
+        Does nothing (and yields `None`) if there is no trace."""
+
+        parent = self.current()
+        if parent is None:
+            yield None
+            return
+
+        with child_span(parent, name, **attributes) as span:
+            self._local.span = span or parent
+            try:
+                yield span
+            finally:
+                self._local.span = parent
+
+    def root(self, delivery_id: Optional[Text]) -> Optional[Span]:
+        """Return the root span of a delivery that is being traced."""
+
+        trace = self._active.get(delivery_id) if delivery_id else None
+        return trace.root if trace else None
+
+
+@contextmanager
+def child_span(parent: Optional[Span], name: Text,
+               **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time a step below an explicitly given span.
+
+    Coroutines share a thread, so they pass spans around instead of
+    using `Tracer.span`. Does nothing if `parent` is `None`."""
+
+    if parent is None:
+        yield None
+        return
+
+    span = parent.child(name, **attributes)
+    try:
+        yield span
+    except Exception as e:
+        span.attributes["error"] = repr(e)
+        raise
+    finally:
+        span.end = time.time()
+
+
+# shared by the whole process, tracing is off until a sample rate is set
+tracer = Tracer()
@@ -0,0 +1,164 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Text
+from urllib.parse import urlparse
+
+import requests
+from github import Github
+from github.Requester import RequestsResponse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from gflows import metrics
+from gflows.scheduler import scheduler
+from gflows.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Transport:
+    """Pooled keep-alive HTTP session shared by all github requests.
+
+    PyGithub opens a new session, and with it a new TLS connection, for
+    every request. The transport keeps up to `pool_size` connections per
+    host open instead. Requests that fail to connect, and idempotent
+    requests whose connection was reset, are retried up to `retries`
+    times."""
+
+    def __init__(self, pool_size: int = 32, retries: int = 3,
+                 backoff: float = 0.1):
+        self.session = requests.Session()
+        self._local = threading.local()
+        self.configure(pool_size, retries, backoff)
+
+    def configure(self, pool_size: int = 32, retries: int = 3,
+                  backoff: float = 0.1) -> None:
+        """Replace the connection pool, e.g. to change its size."""
+
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        # only failures without a response are retried, the scheduler
+        # takes care of throttled requests
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=pool_size,
+                              pool_block=True,
+                              max_retries=Retry(total=retries,
+                                                connect=retries,
+                                                read=retries,
+                                                status=0,
+                                                redirect=0,
+                                                backoff_factor=backoff,
+                                                raise_on_status=False))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @contextmanager
+    def timeout(self, seconds: Optional[float]):
+        """Use a different timeout for the requests made in this block."""
+
+        previous = getattr(self._local, "timeout", None)
+        self._local.timeout = seconds
+        try:
+            yield
+        finally:
+            self._local.timeout = previous
+
+    def request(self, verb: Text, url: Text,
+                headers: Optional[Dict[Text, Text]] = None,
+                data: Optional[Any] = None,
+                timeout: Optional[float] = None,
+                verify: bool = True) -> requests.Response:
+        """Send a request over a pooled connection.
+
+        A timeout set with `timeout()` takes precedence over `timeout`."""
+
+        timeout = getattr(self._local, "timeout", None) or timeout
+        return self.session.request(verb, url,
+                                    headers=headers,
+                                    data=data,
+                                    timeout=timeout,
+                                    verify=verify,
+                                    allow_redirects=False)
+
+
+# every github request of the process goes through this transport
+transport = Transport()
+
+
+class _PooledConnection:
+    """Mimics the httplib connection PyGithub expects, sending requests
+    over the shared transport once the scheduler lets them through."""
+
+    protocol = None
+    default_port = None
+
+    def __init__(self, host, port=None, strict=False, timeout=None,
+                 retry=None, **kwargs):
+        self.host = host
+        self.port = port or self.default_port
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+
+    def request(self, verb, url, input, headers):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+
+    def getresponse(self):
+        url = "{}://{}:{}{}".format(self.protocol, self.host, self.port,
+                                    self.url)
+        for attempt in range(scheduler.max_retries + 1):
+            with tracer.span("github", method=self.verb,
+                             url=self.url) as span:
+                scheduler.acquire()
+                response = transport.request(self.verb, url,
+                                             headers=self.headers,
+                                             data=self.input,
+                                             timeout=self.timeout,
+                                             verify=self.verify)
+                if span:
+                    span.attributes["status"] = response.status_code
+            metrics.github_requests.inc(self.verb,
+                                        metrics.endpoint(self.url),
+                                        response.status_code)
+            throttled = scheduler.update(response.status_code,
+                                         response.headers,
+                                         response.text)
+            if not throttled:
+                break
+        return RequestsResponse(response)
+
+    def close(self):
+        # the connection goes back to the pool
+        pass
+
+
+class PooledHTTPConnection(_PooledConnection):
+    protocol = "http"
+    default_port = 80
+
+
+class PooledHTTPSConnection(_PooledConnection):
+    protocol = "https"
+    default_port = 443
+
+
+def install(gh: Github, pool_size: Optional[int] = None) -> Github:
+    """Route the requests of `gh` through the shared transport and the
+    scheduler, other `Github` instances keep their own connections."""
+
+    if pool_size is not None and pool_size != transport.pool_size:
+        transport.configure(pool_size, transport.retries, transport.backoff)
+    # `Requester.injectConnectionClasses` would replace the connections
+    # of every instance, so only the one of this requester is swapped
+    # noinspection PyProtectedMember,PyUnresolvedReferences
+    requester = gh._Github__requester
+    # noinspection PyProtectedMember,PyUnresolvedReferences
+    scheme = urlparse(requester._Requester__base_url).scheme
+    requester._Requester__connectionClass = (
+            PooledHTTPSConnection if scheme == "https"
+            else PooledHTTPConnection)
+    return gh
@@ -1,43 +1,502 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from github import Github
-from typing import List, Dict, Text, Any
+from typing import (
+    List, Dict, Text, Any, Optional, Set, Tuple, Collection, Union, Iterator)
 
-from gflows.server import create_app
+from gflows import metrics, payload as payloads
+from gflows.cache import github_cache
+from gflows.coalesce import Coalescer
+from gflows.dedup import Deduplicator
+from gflows.dispatch import (
+    PartitionedDispatcher, QueueDispatcher, QueueFullError)
+from gflows.journal import Journal
+from gflows import transport
+from gflows.server import EVENT_DESCRIPTIONS, create_app
+from gflows.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# payload fields needed for routing and cache invalidation
+BASE_PAYLOAD_PATHS = ["action", "repository.full_name", "sender.login"]
+
+# payload fields of the event descriptions the server logs
+DESCRIPTION_PATHS = {event_type: payloads.format_paths(template)
+                     for event_type, template in EVENT_DESCRIPTIONS.items()}
+
+# events changing state every worker process keeps a copy of, besides
+# the cached github objects, e.g. the names of `projects.registry`
+SHARED_STATE_EVENTS = {"project", "project_column"}
+
 
 class Workflow:
+    # event types the workflow subscribes to, mapped to the actions it
+    # handles (`None` for all actions). `None` subscribes to all events.
+    events: Optional[Dict[Text, Optional[Set[Text]]]] = None
+    # dotted paths of the payload fields the workflow reads, e.g.
+    # "commits.message". `None` keeps the whole payload.
+    payload_paths: Optional[List[Text]] = None
+    # whether the workflow can run in the forked processes of a
+    # `PartitionedDispatcher`, i.e. events of other partitions only
+    # change the state its hook relies on through `observe`
+    process_safe: bool = True
+
     def start(self, gh: Github):
         pass
 
+    def observe(self, event_type: str, data: Dict[Text, Any]):
+        """Update state that is shared across partitions, e.g. names
+        resolved to ids, before `hook` is called.
+
+        With the processes of a `PartitionedDispatcher`, events changing
+        shared state are observed in every process."""
+
+        pass
+
     def hook(self, event_type: str, data: Dict[Text, Any], gh: Github):
         pass
 
+    def stop(self):
+        pass
+
+
+class _HookRun:
+    """The bookkeeping of running the hooks of an event, shared by the
+    blocking and the asyncio `Workflows`."""
+
+    def __init__(self, workflows: "Workflows", event_type: Text,
+                 payload: Dict[Text, Any], delivery_id: Optional[Text],
+                 completed: Collection[Text],
+                 timings: Optional[List[Tuple[Text, float, bool]]]):
+        self.workflows = workflows
+        self.event_type = event_type
+        self.payload = payload
+        self.delivery_id = delivery_id
+        self.completed = completed
+        self.timings = timings
+        self.journal = (workflows.journal
+                        if delivery_id and timings is None else None)
+        # keys of the workflows that handled the event
+        self.done: List[Text] = []
+        self.failed = False
+
+    def __iter__(self) -> Iterator[Workflow]:
+        """Yield the workflows that still have to handle the event."""
+
+        # drop cached github objects the event made stale
+        github_cache.observe(self.event_type, self.payload)
+
+        for workflow in self.workflows.subscribers(
+                self.event_type, self.payload.get("action")):
+            if self.workflows._key(workflow) not in self.completed:
+                yield workflow
+
+    @contextmanager
+    def call(self, workflow: Workflow) -> Iterator[None]:
+        """Time the hook of a workflow run in this block and record its
+        result, an exception is logged and doesn't stop the others."""
+
+        started = time.time()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+            key = self.workflows._key(workflow)
+            self.done.append(key)
+            if self.journal:
+                self.journal.mark_done(self.delivery_id, key)
+        except Exception:
+            self.failed = True
+            logger.exception("Hook failed. Payload: {}".format(self.payload))
+        finally:
+            duration = time.time() - started
+            if self.timings is None:
+                self.workflows._observe(self.event_type, workflow.name,
+                                        duration, succeeded)
+            else:
+                self.timings.append((workflow.name, duration, succeeded))
+
 
 class Workflows:
 
     def __init__(self, login_or_token=None, password=None, secret=None,
+                 dispatcher: Optional[Union[QueueDispatcher,
+                                            PartitionedDispatcher]] = None,
+                 journal: Optional[Journal] = None,
+                 deduplicator: Optional[Deduplicator] = None,
+                 coalescer: Optional[Coalescer] = None,
+                 pool_size: Optional[int] = None,
+                 debug: bool = False,
                  **kwargs):
-        self.gh = Github(login_or_token, password, **kwargs)
+        # share pooled connections between all workflows and pace their
+        # requests based on the rate limit
+        self.gh = transport.install(
+                Github(login_or_token, password, **kwargs), pool_size)
         self.secret = secret
+        self.dispatcher = dispatcher
+        self.journal = journal
+        self.deduplicator = deduplicator
+        # merges bursts of card and label events before they are handled
+        self.coalescer = coalescer
+        # serve the traces of slow deliveries
+        self.debug = debug
         self.workflows: List[Workflow] = []
+        # seconds each workflow took to start
+        self.startup_times: Dict[Text, float] = {}
+        self.ready = threading.Event()
+        self._routes: Optional[Dict[Text, List[Tuple[Workflow, Any]]]] = None
+        self._trees: Dict[Text, Any] = {}
+        self._forked = False
+        metrics.registry.gauge("gflows_pending_events",
+                               "Events queued or being handled.",
+                               self._pending_events)
+        metrics.registry.gauge("gflows_coalescing_events",
+                               "Cards and labels with an event held back.",
+                               self._coalescing_events)
 
     def add(self, workflow):
         self.workflows.append(workflow)
+        self._routes = None
 
-    def hook(self, event_type, payload):
-        for workflow in self.workflows:
-            try:
+    def _build_routes(self):
+        """Index the workflows by the event types they subscribe to."""
+
+        event_types = {e
+                       for w in self.workflows
+                       if w.events is not None
+                       for e in w.events}
+        # workflows without declared events get every event
+        routes = {None: [(w, None)
+                         for w in self.workflows
+                         if w.events is None]}
+        for event_type in event_types:
+            routes[event_type] = [
+                (w, None if w.events is None else w.events[event_type])
+                for w in self.workflows
+                if w.events is None or event_type in w.events]
+        self._routes = routes
+        self._trees = {event_type: self._path_tree(event_type, workflows)
+                       for event_type, workflows in routes.items()}
+
+    def _path_tree(self, event_type, routes):
+        """Merge the payload paths of the workflows handling an event."""
+
+        paths = BASE_PAYLOAD_PATHS + DESCRIPTION_PATHS.get(event_type, [])
+        for workflow, _ in routes:
+            if workflow.payload_paths is None:
+                return None
+            paths.extend(workflow.payload_paths)
+        return payloads.path_tree(paths)
+
+    def subscribed(self, event_type: Text) -> bool:
+        """Check if any workflow is interested in an event type."""
+
+        if self._routes is None:
+            self._build_routes()
+        return (event_type in self._routes
+                or bool(self._routes[None])
+                or event_type in github_cache.INVALIDATED_BY)
+
+    def subscribers(self, event_type: Text,
+                    action: Optional[Text] = None) -> List[Workflow]:
+        """Return the workflows handling an event type and action."""
+
+        if self._routes is None:
+            self._build_routes()
+        routes = self._routes.get(event_type, self._routes[None])
+        return [w
+                for w, actions in routes
+                if actions is None or action in actions]
+
+    def decode(self, event_type: Text, raw: bytes) -> Optional[Dict]:
+        """Decode the fields of a raw payload the workflows are reading.
+
+        Returns `None` without decoding if no workflow handles the action
+        of the event."""
+
+        if self._routes is None:
+            self._build_routes()
+
+        action = payloads.peek_action(raw)
+        if (action is not None
+                and event_type not in github_cache.INVALIDATED_BY
+                and not self.subscribers(event_type, action)):
+            return None
+
+        if event_type not in self._trees:
+            self._trees[event_type] = self._path_tree(event_type,
+                                                      self._routes[None])
+        return payloads.decode(raw, self._trees[event_type])
+
+    def _key(self, workflow: Workflow) -> Text:
+        """Identify a workflow in the journal."""
+
+        return "{}:{}".format(self.workflows.index(workflow), workflow.name)
+
+    def receive(self, event_type, payload, delivery_id=None):
+        """Accept a verified delivery from the server."""
+
+        if (self.deduplicator and delivery_id
+                and self.deduplicator.seen(delivery_id)):
+            tracer.discard(delivery_id)
+            return
+
+        completed = ()
+        if self.journal and delivery_id:
+            # a redelivery skips the workflows that already handled it
+            completed = self.journal.append(delivery_id, event_type,
+                                            payload)
+
+        try:
+            self._dispatch(event_type, payload, delivery_id, completed)
+        except QueueFullError:
+            if self.journal and delivery_id:
+                # github doesn't redeliver on its own, replay it later
+                logger.warning("Queue is full, journaled delivery {} for "
+                               "later.".format(delivery_id))
+                self.journal.retry_later(delivery_id)
+                return
+            if self.deduplicator and delivery_id:
+                # the rejected delivery may be redelivered by hand
+                self.deduplicator.forget(delivery_id)
+            raise
+
+    def _dispatch(self, event_type, payload, delivery_id=None,
+                  completed: Collection[Text] = ()):
+        if (self.coalescer
+                and self.coalescer.submit(event_type, payload, delivery_id,
+                                          completed)):
+            return
+
+        # a full queue raises, replayed journal entries stay journaled
+        self._submit(event_type, payload, delivery_id, completed)
+
+    def _submit(self, event_type, payload, delivery_id=None,
+                completed: Collection[Text] = ()):
+        """Queue an event, or run the hooks if there is no dispatcher."""
+
+        if not self.dispatcher:
+            self.hook(event_type, payload, delivery_id, completed)
+        elif self._in_processes():
+            # the worker process traces the hooks if we trace the delivery
+            self.dispatcher.submit(event_type, payload, delivery_id,
+                                   completed,
+                                   tracer.root(delivery_id) is not None)
+            if (event_type in SHARED_STATE_EVENTS
+                    or event_type in github_cache.INVALIDATED_BY):
+                # the other processes forget what the event changed
+                self.dispatcher.broadcast(event_type, payload)
+        else:
+            self.dispatcher.submit(event_type, payload, delivery_id,
+                                   completed)
+
+    def _merged(self, event_type, payload, delivery_id=None,
+                completed: Collection[Text] = ()):
+        """Settle a delivery superseded by a later event."""
+
+        self._settle(delivery_id, False)
+
+    def hook(self, event_type, payload, delivery_id=None,
+             completed: Collection[Text] = ()):
+        """Run the subscribed workflows on an event.
+
+        Workflows listed in `completed` already handled the event."""
+
+        _, failed = self._run_hooks(event_type, payload, delivery_id,
+                                    completed)
+        self._settle(delivery_id, failed)
+
+    def _run_hooks(self, event_type, payload, delivery_id=None,
+                   completed: Collection[Text] = (),
+                   timings: Optional[List[Tuple[Text, float, bool]]] = None
+                   ) -> Tuple[List[Text], bool]:
+        """Run the workflows, returns the keys of the workflows that
+        handled the event and whether any of them failed.
+
+        With `timings`, journaling and metrics are left to the caller,
+        the name, duration and success of every hook are appended to it
+        instead."""
+
+        run = _HookRun(self, event_type, payload, delivery_id, completed,
+                       timings)
+        for workflow in run:
+            with run.call(workflow), \
+                    tracer.delivery(delivery_id), \
+                    tracer.span("hook", workflow=workflow.name):
+                workflow.observe(event_type, payload)
                 workflow.hook(event_type, payload, self.gh)
-            except Exception as e:
-                logger.exception("Hook failed. Payload: {}".format(payload))
+        return run.done, run.failed
 
-    def app(self):
-        for workflow in self.workflows:
-            workflow.start(self.gh)
+    @staticmethod
+    def _observe(event_type, name, duration, succeeded):
+        metrics.hook_duration.observe(duration, event_type, name)
+        metrics.hook_results.inc(event_type, name,
+                                 "success" if succeeded else "failure")
+
+    def _pending_events(self) -> Optional[int]:
+        return self.dispatcher.pending if self.dispatcher else None
+
+    def _coalescing_events(self) -> Optional[int]:
+        return self.coalescer.pending if self.coalescer else None
+
+    def _in_processes(self) -> bool:
+        return (isinstance(self.dispatcher, PartitionedDispatcher)
+                and self.dispatcher.processes)
+
+    def _run_hooks_in_process(self, event_type, payload, delivery_id=None,
+                              completed: Collection[Text] = (),
+                              traced: bool = False):
+        # the journal, metrics and traces of the parent process are
+        # updated by `_record`, the ones of this process are never read
+        trace = tracer.begin(delivery_id, sampled=traced)
+        timings = []
+        try:
+            done, failed = self._run_hooks(event_type, payload, delivery_id,
+                                           completed, timings)
+        finally:
+            tracer.discard(delivery_id)
+        return done, failed, timings, trace.root.children if trace else ()
+
+    def _observe_in_process(self, event_type, payload):
+        github_cache.observe(event_type, payload)
+        for workflow in self.subscribers(event_type, payload.get("action")):
+            workflow.observe(event_type, payload)
+
+    def _record(self, args, result):
+        """Journal the result of an event handled in a worker process."""
+
+        event_type, delivery_id = args[0], args[2]
+        done, failed, timings, spans = result or ((), True, (), ())
+        for name, duration, succeeded in timings:
+            self._observe(event_type, name, duration, succeeded)
+        root = tracer.root(delivery_id)
+        if root is not None:
+            root.children.extend(spans)
+        if self.journal and delivery_id:
+            for key in done:
+                self.journal.mark_done(delivery_id, key)
+        self._settle(delivery_id, failed)
+
+    def _settle(self, delivery_id, failed):
+        tracer.finish(delivery_id)
+        if self.journal and delivery_id:
+            if failed:
+                self.journal.retry_later(delivery_id)
+            else:
+                self.journal.finish(delivery_id)
 
-        return create_app(self.hook, self.secret)
+    def _start_workflow(self, workflow: Workflow):
+        started = time.time()
+        workflow.start(self.gh)
+        key = self._key(workflow)
+        self.startup_times[key] = time.time() - started
+        logger.info("Started workflow {} in {:.2f}s.".format(
+                key, self.startup_times[key]))
+
+    def _start_workflows(self):
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, len(self.workflows)),
+                                thread_name_prefix="gflows-start") as pool:
+            for f in [pool.submit(self._start_workflow, w)
+                      for w in self.workflows]:
+                f.result()
+        logger.info("Started {} workflows in {:.2f}s.".format(
+                len(self.workflows), time.time() - started))
+
+    def _check_processes(self):
+        unsafe = [getattr(w, "name", type(w).__name__)
+                  for w in self.workflows
+                  if not w.process_safe]
+        if unsafe:
+            raise ValueError(
+                    "Workflows {} keep state across partitions and can't "
+                    "run in the processes of a PartitionedDispatcher, use "
+                    "threads instead.".format(", ".join(unsafe)))
+
+    def _fork(self):
+        """Fork the worker processes of the dispatcher, each of them
+        starts its own copy of the workflows.
+
+        Has to happen before any thread is started, see
+        `PartitionedDispatcher`."""
+
+        if self._forked:
+            return
+        self._check_processes()
+        self._build_routes()
+        self.dispatcher.start(self._run_hooks_in_process, self._record,
+                              initializer=self._start_workflows,
+                              observer=self._observe_in_process)
+        self._forked = True
+
+    def start(self):
+        """Start all workflows concurrently and begin processing events."""
+
+        if self._in_processes():
+            self._fork()
+            self.dispatcher.wait_started()
+        else:
+            self._start_workflows()
+            self._build_routes()
+            if self.dispatcher:
+                # acknowledge deliveries right away, workers run the hooks
+                self.dispatcher.start(self.hook)
+
+        if self.coalescer:
+            self.coalescer.start(self._submit, self._merged)
+
+        if self.journal:
+            # pick up deliveries that were pending when we went down
+            self.journal.start(self._dispatch)
+
+        self.ready.set()
+
+    def _start_in_background(self):
+        try:
+            self.start()
+        except Exception:
+            logger.exception("Failed to start the workflows.")
+
+    def app(self, wait=True):
+        """Create the webhook server.
+
+        If `wait` is `False`, the workflows are started in the background
+        and the server answers with a 503 until they are ready."""
+
+        if self._in_processes():
+            # before the server or the background start run any thread
+            self._fork()
+
+        if wait:
+            self.start()
+        else:
+            threading.Thread(target=self._start_in_background,
+                             name="gflows-start",
+                             daemon=True).start()
+
+        return create_app(self.receive, self.secret,
+                          accepts=self.subscribed,
+                          ready=self.ready.is_set,
+                          decode=self.decode,
+                          debug=self.debug)
+
+    def shutdown(self):
+        """Wait for queued events to be processed."""
+
+        if self.coalescer:
+            self.coalescer.shutdown()
+        if self.dispatcher:
+            self.dispatcher.shutdown()
+        if self.journal:
+            self.journal.close()
+        for workflow in self.workflows:
+            workflow.stop()
 
-    def run(self, port=8383):
-        self.app().run(host="0.0.0.0", port=port)
+    def run(self, port=8383, wait=True):
+        try:
+            self.app(wait).run(host="0.0.0.0", port=port)
+        finally:
+            self.shutdown()
@@ -24,15 +24,23 @@ install_requires = [
     "PyGithub~=1.43",
 ]
 
+extras_requires = {
+    "aio": ["aiohttp~=3.5"],
+}
+
 setup(
         name='gflows',
-        packages=find_packages(exclude=["tests", "tools"]),
+        packages=find_packages(exclude=["tests", "tools", "benchmarks"]),
         version=__version__,
         classifiers=[
             "Programming Language :: Python :: 3.6"
         ],
         install_requires=install_requires,
         tests_require=tests_requires,
+        extras_require=extras_requires,
+        entry_points={
+            "console_scripts": ["gflows-replay=gflows.replay:main"],
+        },
         include_package_data=True,
         description="GitHub workflow automation",
         long_description=long_description,
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.fake_github import FakeGithub
+from gflows import metrics
+from gflows.aio import AsyncGithub, AsyncWorkflows, create_app
+from gflows.cache import github_cache
+from gflows.dispatch import QueueDispatcher
+from gflows.flows import async_utils
+from gflows.flows.async_close_issues_in_column import (
+    AsyncCloseIssuesInColumn)
+from gflows.workflow import Workflow
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    github.add_repo("o/a", labels=["bug"])
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_client_sends_requests(github):
+    async def fetch():
+        gh = AsyncGithub("token", base_url=github.url)
+        try:
+            return await gh.request_json("GET", "/repos/o/a/labels")
+        finally:
+            await gh.close()
+
+    status, headers, output = run(fetch())
+    assert status == 200
+    assert "x-ratelimit-remaining" in headers
+    assert '"name": "bug"' in output
+
+
+def test_deliveries_are_verified():
+    received = []
+
+    async def post(body, secret):
+        app = create_app(lambda *args: received.append(args), b"secret")
+        async with TestClient(TestServer(app)) as client:
+            digest = hmac.new(secret, body, hashlib.sha1).hexdigest()
+            response = await client.post("/postreceive", data=body, headers={
+                    "X-Github-Event": "push",
+                    "X-Github-Delivery": "a",
+                    "X-Hub-Signature": "sha1=" + digest})
+            return response.status
+
+    assert run(post(b'{"ref": "master"}', b"guessed")) == 400
+    assert run(post(b"no json", b"secret")) == 400
+    assert run(post(b'{"ref": "master"}', b"secret")) == 204
+    assert received == [("push", {"ref": "master"}, "a")]
+
+
+class Blocking(Workflow):
+    name = "blocking"
+
+    def __init__(self):
+        self.clients = []
+
+    def hook(self, event_type, data, gh):
+        self.clients.append(type(gh).__name__)
+
+
+class Async(Blocking):
+    name = "async"
+
+    async def hook(self, event_type, data, gh):
+        self.clients.append(type(gh).__name__)
+
+
+def test_hooks_get_the_client_of_their_kind():
+    workflows = AsyncWorkflows()
+    blocking, async_ = Blocking(), Async()
+    workflows.add(blocking)
+    workflows.add(async_)
+
+    async def deliver():
+        workflows._loop = asyncio.get_event_loop()
+        await workflows.hook_async("push", {}, "a")
+        await workflows.agh.close()
+
+    run(deliver())
+    assert blocking.clients == ["Github"]
+    assert async_.clients == ["AsyncGithub"]
+
+
+class Failing(Workflow):
+    name = "failing-async"
+
+    async def hook(self, event_type, data, gh):
+        raise ValueError("failed on purpose")
+
+
+def test_failed_hooks_do_not_stop_the_others():
+    workflows = AsyncWorkflows()
+    async_ = Async()
+    workflows.add(Failing())
+    workflows.add(async_)
+
+    async def deliver():
+        workflows._loop = asyncio.get_event_loop()
+        await workflows.hook_async("push", {})
+        await workflows.agh.close()
+
+    run(deliver())
+    assert async_.clients == ["AsyncGithub"]
+    assert metrics.hook_results._collect()[
+            ("push", "failing-async", "failure")] == 1
+
+
+def test_dispatchers_are_refused():
+    with pytest.raises(ValueError):
+        AsyncWorkflows(dispatcher=QueueDispatcher())
+
+
+def test_async_utils(github):
+    project = github.add_board("o", "Board", ["Todo"], 1, "o/a")
+    card_id = github.columns[project["columns"][0]]["cards"][0]
+
+    async def fetch():
+        gh = AsyncGithub("token", base_url=github.url)
+        try:
+            return (await async_utils.id_from_project_name("o", "Board", gh),
+                    await async_utils.issue_from_card_id(card_id, gh),
+                    await async_utils.get_repo("O/A", gh))
+        finally:
+            await gh.close()
+
+    project_id, issue, repo = run(fetch())
+    assert project_id == project["id"]
+    assert issue["number"] == 1
+    assert repo["full_name"] == "o/a"
+    # the blocking `get_repo` caches `Repository` objects
+    assert github_cache.peek(("repo", "o/a")) is None
+
+
+def test_issues_are_closed_on_the_loop(github):
+    project = github.add_board("o", "Board", ["Todo", "Done"], 2, "o/a")
+    done = project["columns"][1]
+    card_id = github.columns[done]["cards"][0]
+    workflows = AsyncWorkflows("token", base_url=github.url)
+    workflows.add(AsyncCloseIssuesInColumn("o", "Board", "Done"))
+    workflows.start()
+
+    async def deliver():
+        workflows._loop = asyncio.get_event_loop()
+        await workflows.hook_async("project_card", {
+                "action": "moved",
+                "project_card": {"id": card_id,
+                                 "column_id": done,
+                                 "project_url": project["url"]}})
+        await workflows.agh.close()
+
+    run(deliver())
+    workflows.shutdown()
+    assert github.repos["o/a"]["issues"][2]["state"] == "closed"
+    assert github.repos["o/a"]["issues"][1]["state"] == "open"
@@ -0,0 +1,90 @@
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.cache import GithubCache, TTLCache, github_cache
+from gflows.flows.utils import get_label_names
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("gflows.cache.time.time", lambda: now[0])
+    cache = TTLCache(ttl=10.0)
+    cache.set("a", 1)
+
+    assert cache.peek("a") == 1
+    now[0] += 10.0
+    assert cache.peek("a") is None
+    assert cache.get("a", lambda: 2) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.peek("a")
+    cache.set("c", 3)
+
+    assert cache.peek("b") is None
+    assert cache.peek("a") == 1
+    assert cache.pop("c") == 3
+    assert cache.pop("c") is None
+
+
+@pytest.fixture
+def cache():
+    cache = GithubCache()
+    for kind in ["repo", "labels"]:
+        for repo in ["o/a", "o/b"]:
+            cache.set((kind, repo), True)
+    cache.set(("permission", "o/a", "x"), True)
+    return cache
+
+
+def cached(cache):
+    return sorted(k[:2] for k in cache._entries)
+
+
+def test_events_invalidate_their_repository(cache):
+    cache.observe("label", {"action": "created",
+                            "repository": {"full_name": "O/A"}})
+    assert cached(cache) == [("labels", "o/b"), ("permission", "o/a"),
+                             ("repo", "o/a"), ("repo", "o/b")]
+
+    cache.observe("push", {"repository": {"full_name": "o/b"}})
+    assert len(cached(cache)) == 4
+
+
+def test_renames_invalidate_all_repositories(cache):
+    cache.observe("repository", {"action": "renamed",
+                                 "repository": {"full_name": "o/c"}})
+    assert cached(cache) == []
+
+
+def test_memberships_invalidate_all_permissions(cache):
+    cache.observe("membership", {"action": "removed"})
+    assert cached(cache) == [("labels", "o/a"), ("labels", "o/b"),
+                             ("repo", "o/a"), ("repo", "o/b")]
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    github.add_repo("o/a", labels=["bug"])
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+def test_label_names_are_fetched_once(github):
+    gh = Workflows("token", base_url=github.url).gh
+
+    assert get_label_names("o/a", gh) == {"bug"}
+    assert get_label_names("O/A", gh) == {"bug"}
+    assert github.calls[("GET", "/repos/:owner/:repo/labels")] == 1
+
+    github_cache.observe("label", {"action": "deleted",
+                                   "repository": {"full_name": "o/a"}})
+    get_label_names("o/a", gh)
+    assert github.calls[("GET", "/repos/:owner/:repo/labels")] == 2
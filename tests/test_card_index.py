@@ -0,0 +1,63 @@
+import os
+
+from gflows.flows.card_index import CardIndex
+
+
+def test_issues_and_cards_are_indexed_both_ways():
+    cards = CardIndex()
+    cards.set(1, "O/Repo/5", 10)
+    assert cards.get("o/repo/5") == (1, 10)
+    assert cards.issue_of(1) == "o/repo/5"
+    assert len(cards) == 1
+
+    # the card now points at another issue
+    cards.set(1, "o/repo/6", 11)
+    assert cards.get("o/repo/5") is None
+    assert cards.get("o/repo/6") == (1, 11)
+
+    cards.remove_card(1)
+    assert cards.get("o/repo/6") is None
+    assert cards.issue_of(1) is None
+    assert len(cards) == 0
+
+
+def test_reconcile_replaces_the_index():
+    cards = CardIndex()
+    cards.set(1, "o/r/1", 10)
+    cards.set(2, "o/r/2", 10)
+    cards.begin_reconcile()
+    cards.finish_reconcile({2: ("o/r/2", 11), 3: ("o/r/3", 10)})
+
+    assert cards.get("o/r/1") is None
+    assert cards.get("o/r/2") == (2, 11)
+    assert cards.get("o/r/3") == (3, 10)
+
+
+def test_updates_during_reconcile_win_over_the_scan():
+    cards = CardIndex()
+    cards.set(1, "o/r/1", 10)
+    cards.begin_reconcile()
+    # webhooks arriving while the board is scanned
+    cards.set(1, "o/r/1", 12)
+    cards.set(4, "o/r/4", 10)
+    cards.remove_card(2)
+    cards.finish_reconcile({1: ("o/r/1", 11), 2: ("o/r/2", 10)})
+
+    assert cards.get("o/r/1") == (1, 12)
+    assert cards.get("o/r/4") == (4, 10)
+    assert cards.get("o/r/2") is None
+
+
+def test_snapshots_belong_to_a_project(tmpdir):
+    path = os.path.join(str(tmpdir), "cards.json")
+    cards = CardIndex()
+    cards.set(1, "o/r/1", 10)
+    cards.save(path, project_id=7)
+
+    loaded = CardIndex()
+    assert not loaded.load(path, project_id=8)
+    assert len(loaded) == 0
+    assert loaded.load(path, project_id=7)
+    assert loaded.get("o/r/1") == (1, 10)
+
+    assert not CardIndex().load(path + ".missing", project_id=7)
@@ -0,0 +1,133 @@
+import threading
+import time
+
+from gflows.coalesce import Coalescer, coalesce_key, replaceable
+from gflows.dispatch import QueueFullError
+
+
+def card(card_id, column_id):
+    return {"project_card": {"id": card_id, "column_id": column_id}}
+
+
+def label(name, repository="o/a", renamed_from=None):
+    payload = {"label": {"name": name},
+               "repository": {"full_name": repository}}
+    if renamed_from:
+        payload["changes"] = {"name": {"from": renamed_from}}
+    return payload
+
+
+class Sink:
+    def __init__(self, full=0):
+        self.events = []
+        self.merged = []
+        self.full = full
+        self.lock = threading.Lock()
+
+    def forward(self, event_type, payload, *args):
+        with self.lock:
+            if self.full:
+                self.full -= 1
+                raise QueueFullError()
+            self.events.append((event_type, payload) + args)
+
+    def on_merged(self, event_type, payload, *args):
+        with self.lock:
+            self.merged.append((event_type, payload) + args)
+
+
+def test_coalesce_key():
+    assert coalesce_key("project_card", card(1, 2)) == "card:1"
+    assert coalesce_key("label", label("Bug", "O/A")) == "label:o/a:bug"
+    # labels aren't merged across repositories
+    assert (coalesce_key("label", label("bug", "o/b"))
+            != coalesce_key("label", label("bug", "o/a")))
+    assert (coalesce_key("label", label("defect", renamed_from="bug"))
+            == "label:o/a:bug")
+    assert coalesce_key("label", {"label": {"name": "bug"}}) is None
+    assert coalesce_key("push", {"repository": {"full_name": "o/a"}}) is None
+
+    assert replaceable("label", label("bug"))
+    assert not replaceable("label", label("defect", renamed_from="bug"))
+
+
+def test_only_the_latest_event_is_forwarded():
+    sink = Sink()
+    coalescer = Coalescer(window=0.05)
+    coalescer.start(sink.forward, sink.on_merged)
+    for column_id in [1, 2, 3]:
+        assert coalescer.submit("project_card", card(7, column_id), "d")
+    assert coalescer.submit("project_card", card(8, 1), "e")
+    time.sleep(0.2)
+    coalescer.shutdown()
+
+    assert sorted(e[1]["project_card"]["column_id"]
+                  for e in sink.events) == [1, 3]
+    assert len(sink.merged) == 2
+    assert coalescer.merged == 2
+
+
+def test_events_without_key_are_not_held():
+    coalescer = Coalescer()
+    coalescer.start(Sink().forward)
+    assert not coalescer.submit("push", {})
+    coalescer.shutdown()
+
+
+def test_nothing_is_held_before_start_or_beyond_max_size():
+    coalescer = Coalescer(max_size=1)
+    assert not coalescer.submit("project_card", card(1, 1))
+
+    coalescer.start(Sink().forward)
+    assert coalescer.submit("project_card", card(1, 1))
+    assert not coalescer.submit("project_card", card(2, 1))
+    # events of a held entity are still merged
+    assert coalescer.submit("project_card", card(1, 2))
+    coalescer.shutdown()
+
+
+def test_events_are_held_at_most_max_delay():
+    sink = Sink()
+    coalescer = Coalescer(window=0.1, max_delay=0.15)
+    coalescer.start(sink.forward)
+    for column_id in range(5):
+        coalescer.submit("project_card", card(1, column_id))
+        time.sleep(0.05)
+    time.sleep(0.2)
+    coalescer.shutdown()
+
+    assert len(sink.events) >= 2
+
+
+def test_renames_are_never_replaced():
+    sink = Sink()
+    coalescer = Coalescer(window=10.0)
+    coalescer.start(sink.forward, sink.on_merged)
+    coalescer.submit("label", label("defect", renamed_from="bug"))
+    coalescer.submit("label", label("bug"))
+    coalescer.shutdown()
+
+    assert [e[1]["label"]["name"] for e in sink.events] == ["defect", "bug"]
+    assert sink.merged == []
+
+
+def test_shutdown_forwards_held_events():
+    sink = Sink()
+    coalescer = Coalescer(window=10.0)
+    coalescer.start(sink.forward)
+    coalescer.submit("project_card", card(1, 1))
+    coalescer.shutdown()
+
+    assert len(sink.events) == 1
+    assert coalescer.pending == 0
+    assert not coalescer.submit("project_card", card(1, 1))
+
+
+def test_full_queue_is_retried():
+    sink = Sink(full=3)
+    coalescer = Coalescer(window=0.01)
+    coalescer.start(sink.forward)
+    coalescer.submit("project_card", card(1, 1))
+    coalescer.shutdown()
+
+    assert len(sink.events) == 1
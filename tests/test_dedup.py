@@ -0,0 +1,46 @@
+import os
+import time
+
+from gflows.dedup import Deduplicator, SqliteBackend
+
+
+def test_redelivery_is_a_duplicate():
+    deduplicator = Deduplicator()
+    assert not deduplicator.seen("a")
+    assert deduplicator.seen("a")
+    assert not deduplicator.seen("b")
+    assert deduplicator.suppressed == 1
+
+
+def test_forgotten_delivery_is_accepted_again():
+    deduplicator = Deduplicator()
+    deduplicator.seen("a")
+    deduplicator.forget("a")
+    assert not deduplicator.seen("a")
+
+
+def test_oldest_ids_are_evicted():
+    deduplicator = Deduplicator(max_size=2)
+    for delivery_id in ["a", "b", "c"]:
+        deduplicator.seen(delivery_id)
+    assert not deduplicator.seen("a")
+    assert deduplicator.seen("c")
+
+
+def test_ids_expire_after_the_window():
+    deduplicator = Deduplicator(window=0.05)
+    deduplicator.seen("a")
+    time.sleep(0.1)
+    assert not deduplicator.seen("a")
+
+
+def test_backend_is_shared_between_deduplicators(tmpdir):
+    path = os.path.join(str(tmpdir), "dedup.db")
+    first = Deduplicator(backend=SqliteBackend(path))
+    second = Deduplicator(backend=SqliteBackend(path))
+
+    assert not first.seen("a")
+    assert second.seen("a")
+
+    first.forget("a")
+    assert not Deduplicator(backend=SqliteBackend(path)).seen("a")
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+from gflows import Workflows, metrics
+from gflows.coalesce import Coalescer
+from gflows.dispatch import (
+    PartitionedDispatcher, QueueFullError, partition_key)
+from gflows.journal import Journal
+from gflows.workflow import Workflow
+
+
+def card(card_id):
+    return {"project_card": {"id": card_id}}
+
+
+def label(name, repository="o/a", renamed_from=None):
+    payload = {"label": {"name": name},
+               "repository": {"full_name": repository}}
+    if renamed_from:
+        payload["changes"] = {"name": {"from": renamed_from}}
+    return payload
+
+
+def test_partition_key():
+    assert partition_key("project_card", card(3)) == "card:3"
+    assert partition_key("label", label("Bug")) == "label:bug"
+    # shared labels of all repositories go together
+    assert (partition_key("label", label("bug", "o/b"))
+            == partition_key("label", label("bug", "o/a")))
+    assert (partition_key("label", label("defect", renamed_from="Bug"))
+            == "label:bug")
+    assert partition_key("project", {"project": {"id": 7}}) == "project:7"
+    assert partition_key("project_column", {"project_column": {
+        "project_url": "https://api.github.com/projects/7"}}) == "project:7"
+    assert (partition_key("push", {"repository": {"full_name": "O/A"}})
+            == "repository:o/a")
+    assert partition_key("ping", {}) is None
+
+
+def test_events_of_a_partition_are_handled_in_order():
+    handled = defaultdict(list)
+    active = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def handler(event_type, payload, sequence):
+        key = payload["project_card"]["id"]
+        with lock:
+            if key in active:
+                overlaps.append(key)
+            active.add(key)
+        time.sleep(0.001)
+        with lock:
+            active.discard(key)
+            handled[key].append(sequence)
+
+    dispatcher = PartitionedDispatcher(workers=4, max_size=1000)
+    dispatcher.start(handler)
+    for sequence in range(200):
+        dispatcher.submit("project_card", card(sequence % 5), sequence)
+    dispatcher.shutdown()
+
+    assert overlaps == []
+    assert sum(len(s) for s in handled.values()) == 200
+    for sequences in handled.values():
+        assert sequences == sorted(sequences)
+    assert dispatcher.pending == 0
+
+
+def test_full_partition_rejects_events():
+    release = threading.Event()
+    dispatcher = PartitionedDispatcher(workers=1, max_size=1)
+    dispatcher.start(lambda *args: release.wait(5))
+    try:
+        with pytest.raises(QueueFullError):
+            for i in range(3):
+                dispatcher.submit("project_card", card(1))
+    finally:
+        release.set()
+        dispatcher.shutdown()
+
+
+def test_stopped_dispatcher_rejects_events():
+    dispatcher = PartitionedDispatcher(workers=1)
+    dispatcher.start(lambda *args: None)
+    dispatcher.shutdown()
+    with pytest.raises(QueueFullError):
+        dispatcher.submit("project_card", card(1))
+
+
+class Failing(Workflow):
+    name = "failing"
+
+    def start(self, gh):
+        raise ValueError("failed on purpose")
+
+
+def test_workflows_are_started_in_the_worker_processes():
+    workflows = Workflows(
+            dispatcher=PartitionedDispatcher(workers=2, processes=True))
+    workflows.add(Failing())
+    try:
+        with pytest.raises(RuntimeError, match="failed on purpose"):
+            workflows.start()
+    finally:
+        workflows.shutdown()
+
+
+class Idle(Workflow):
+    name = "idle"
+
+
+class Forking(PartitionedDispatcher):
+    def start(self, *args, **kwargs):
+        self.threads = [t.name for t in threading.enumerate()
+                        if t.name.startswith("gflows-")]
+        super().start(*args, **kwargs)
+
+
+def test_workers_are_forked_before_any_thread_starts(tmpdir):
+    dispatcher = Forking(workers=1, processes=True)
+    path = os.path.join(str(tmpdir), "journal.db")
+    journal = Journal(path)
+    journal.append("a", "push", {})
+    journal.close()
+
+    journal = Journal(path)
+    workflows = Workflows(dispatcher=dispatcher, journal=journal,
+                          coalescer=Coalescer())
+    workflows.add(Idle())
+    workflows.app(wait=False)
+    try:
+        assert workflows.ready.wait(5)
+    finally:
+        workflows.shutdown()
+    assert dispatcher.threads == []
+
+
+def test_broadcast_skips_the_worker_handling_the_event():
+    observed = []
+    dispatcher = PartitionedDispatcher(workers=4)
+    dispatcher.start(lambda *args: None,
+                     observer=lambda event_type, payload: observed.append(
+                             threading.current_thread().name))
+    dispatcher.broadcast("project_card", card(1))
+    dispatcher.shutdown()
+
+    owner = dispatcher.shard("project_card", card(1))
+    assert sorted(observed) == sorted(
+            "gflows-worker-{}".format(i) for i in range(4) if i != owner)
+
+
+class Renaming(Workflow):
+    name = "renaming"
+    events = {"project": None, "push": None}
+
+    def __init__(self):
+        self.renames = 0
+
+    def observe(self, event_type, data):
+        if event_type == "project":
+            self.renames += 1
+
+    def hook(self, event_type, data, gh):
+        if event_type == "push" and self.renames != 1:
+            raise ValueError("stale project names")
+
+
+def test_shared_state_is_updated_in_every_process():
+    workflows = Workflows(
+            dispatcher=PartitionedDispatcher(workers=2, processes=True))
+    workflows.add(Renaming())
+    workflows.start()
+    workflows.receive("project", {"action": "edited", "project": {"id": 1}})
+    for i in range(4):
+        workflows.receive("push", {"repository": {"full_name": str(i)}})
+    workflows.shutdown()
+
+    results = metrics.hook_results._collect()
+    assert results.get(("push", "renaming", "failure")) is None
+    assert results[("push", "renaming", "success")] == 4
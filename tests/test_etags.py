@@ -0,0 +1,116 @@
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows, etags
+from gflows.cache import github_cache
+from gflows.etags import ConditionalCache
+from gflows.flows.utils import gh_request
+
+
+def test_only_gets_are_stored():
+    assert etags.request_key("POST", "/a", None, {}) is None
+    # the accepted media type changes the response
+    assert (etags.request_key("GET", "/a", None, {})
+            != etags.request_key("GET", "/a", None, {"Accept": "x"}))
+    assert (etags.request_key("GET", "/a", {"b": 1, "c": 2}, {})
+            == etags.request_key("GET", "/a", {"c": 2, "b": 1}, {}))
+
+
+def test_validators():
+    assert etags.with_validators({}, None) == {}
+    assert etags.with_validators({"Accept": "x"},
+                                 ('"a"', "Mon", "{}")) == {
+        "Accept": "x", "If-None-Match": '"a"', "If-Modified-Since": "Mon"}
+    assert etags.with_validators({}, (None, "Mon", "{}")) == {
+        "If-Modified-Since": "Mon"}
+
+
+def test_responses_without_validators_are_not_stored():
+    cache = ConditionalCache()
+    cache.store("a", {}, b"{}")
+    assert cache.get("a") is None
+
+    cache.store("a", {"etag": '"1"'}, b'{"b": 2}')
+    entry = cache.get("a")
+    assert entry == ('"1"', None, '{"b": 2}')
+    assert cache.revalidate(entry) == {"b": 2}
+    assert cache.revalidated == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ConditionalCache(max_entries=2)
+    for key in ["a", "b"]:
+        cache.store(key, {"etag": key}, "{}")
+    cache.get("a")
+    cache.store("c", {"etag": "c"}, "{}")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "etags.db")
+
+
+def test_responses_are_persisted(path):
+    cache = ConditionalCache(max_entries=1, path=path)
+    cache.store("a", {"etag": "1", "last-modified": "Mon"}, "[]")
+    cache.store("b", {"etag": "2"}, "[]")
+
+    # evicted from memory, still on disk
+    assert cache.get("a") == ("1", "Mon", "[]")
+    assert ConditionalCache(path=path).get("b") == ("2", None, "[]")
+
+
+def test_the_file_is_capped(path):
+    cache = ConditionalCache(max_entries=1, path=path, max_disk_entries=2)
+    for key in ["a", "b", "a", "c"]:
+        cache.store(key, {"etag": key}, "[]")
+
+    cache = ConditionalCache(path=path)
+    # "b" was stored before the latest "a"
+    assert cache.get("b") is None
+    assert cache.get("a") == ("a", None, "[]")
+    assert cache.get("c") == ("c", None, "[]")
+
+
+@pytest.fixture
+def github(monkeypatch):
+    monkeypatch.setattr(etags, "conditional_cache", ConditionalCache())
+    github = FakeGithub().start()
+    github.add_repo("o/a", labels=["bug"])
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+def test_unchanged_responses_are_revalidated(github):
+    gh = Workflows("token", base_url=github.url).gh
+    _, labels = gh_request(gh, "GET", "/repos/o/a/labels")
+    remaining = github.remaining
+
+    assert gh_request(gh, "GET", "/repos/o/a/labels")[1] == labels
+    assert etags.conditional_cache.revalidated == 1
+    assert github.not_modified == 1
+    assert github.remaining == remaining
+
+    github.add_repo("o/b", labels=["bug"])
+    gh_request(gh, "GET", "/repos/o/a/labels", parameters={"page": 1})
+    gh_request(gh, "GET", "/repos/o/b/labels")
+    assert github.not_modified == 1
+
+
+def test_etags_of_servers_differ(github):
+    other = FakeGithub().start()
+    other.add_repo("o/a", labels=["bug"])
+    try:
+        gh_request(Workflows("token", base_url=other.url).gh,
+                   "GET", "/repos/o/a/labels")
+        # stored under the same key, but not the same response
+        gh_request(Workflows("token", base_url=github.url).gh,
+                   "GET", "/repos/o/a/labels")
+    finally:
+        other.stop()
+    assert github.not_modified == 0
@@ -0,0 +1,110 @@
+import base64
+
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.cache import github_cache
+from gflows.flows import CloseIssuesInColumn, graphql
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+@pytest.fixture
+def gh(github):
+    return Workflows("token", base_url=github.url).gh
+
+
+def page(nodes, after=None):
+    return {"pageInfo": {"hasNextPage": after is not None,
+                         "endCursor": after},
+            "nodes": nodes}
+
+
+def card(card_id, number):
+    return {"databaseId": card_id,
+            "content": {"__typename": "Issue",
+                        "id": "I{}".format(number),
+                        "number": number,
+                        "state": "OPEN",
+                        "url": "",
+                        "repository": {"nameWithOwner": "o/a"}}}
+
+
+def test_node_id():
+    assert (base64.b64decode(graphql.node_id("ProjectCard", 123))
+            == b"011:ProjectCard123")
+
+
+def test_board_is_fetched_in_pages(github, gh):
+    github.add_repo("o/a")
+    project = github.add_board("o", "Board", ["Todo"], 0, "o/a")
+    queries = []
+
+    def resolve(query, variables):
+        queries.append(variables)
+        if query == graphql.BOARD_QUERY:
+            column = {"id": "C", "databaseId": 7,
+                      "cards": page([card(1, 1),
+                                     {"databaseId": 2, "content": None}],
+                                    after="c1")}
+            return {"data": {"node": {"columns": page([column])}}}
+        assert query == graphql.COLUMN_CARDS_QUERY
+        return {"data": {"node": {"cards": page([card(3, 2)])}}}
+
+    github.graphql = resolve
+    # notes are left out
+    assert graphql.board_cards(project["id"], gh) == {
+            1: ("o/a/1", 7), 3: ("o/a/2", 7)}
+    assert queries == [{"project": project["node_id"], "after": None},
+                       {"column": "C", "after": "c1"}]
+
+
+def test_moves_are_batched(github, gh):
+    mutations = []
+
+    def resolve(query, variables):
+        mutations.append(variables)
+        return {"data": {}}
+
+    github.graphql = resolve
+    graphql.move_cards([(i, 10) for i in range(5)], gh, batch_size=2)
+
+    assert [len(variables) for variables in mutations] == [4, 4, 2]
+    assert mutations[2] == {
+            "card0": graphql.node_id("ProjectCard", 4),
+            "column0": graphql.node_id("ProjectColumn", 10)}
+
+
+def test_enterprise_endpoint(github):
+    gh = Workflows("token", base_url=github.url + "/api/v3").gh
+    github.graphql = lambda query, variables: {"data": {"node": None}}
+
+    assert graphql.card_content(1, gh) is None
+    assert github.calls[("POST", "/api/graphql")] == 1
+
+
+@pytest.mark.parametrize("typename, mutation", [
+    ("Issue", "closeIssue"),
+    ("PullRequest", "closePullRequest"),
+])
+def test_cards_are_closed(github, gh, typename, mutation):
+    content = dict(card(1, 1)["content"], __typename=typename)
+    mutations = []
+
+    def resolve(query, variables):
+        if query == graphql.CARD_QUERY:
+            return {"data": {"node": {"content": content}}}
+        mutations.append(query)
+        return {"data": {}}
+
+    github.graphql = resolve
+    CloseIssuesInColumn._close_issue_of_card_graphql(1, gh)
+    assert len(mutations) == 1
+    assert mutation + "(" in mutations[0]
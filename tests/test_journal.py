@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+
+import pytest
+
+from gflows import Workflows
+from gflows.dispatch import QueueDispatcher
+from gflows.journal import Journal
+from gflows.workflow import Workflow
+
+
+class Recorder(Workflow):
+    name = "recorder"
+    events = {"push": None}
+
+    def __init__(self, delay=0.0, fail=()):
+        self.delay = delay
+        self.fail = set(fail)
+        self.handled = []
+        self._lock = threading.Lock()
+
+    def hook(self, event_type, data, gh):
+        time.sleep(self.delay)
+        if data["i"] in self.fail:
+            raise ValueError("failed on purpose")
+        with self._lock:
+            self.handled.append(data["i"])
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def path(tmpdir):
+    return os.path.join(str(tmpdir), "journal.db")
+
+
+def test_pending_skips_entries_in_backoff(path):
+    journal = Journal(path, backoff=60.0)
+    journal.append("a", "push", {"i": 1})
+    journal.append("b", "push", {"i": 2})
+    journal.mark_done("a", "0:recorder")
+
+    journal.retry_later("b")
+    journal.close()
+
+    # after a restart
+    journal = Journal(path, backoff=60.0)
+    pending = journal.pending()
+    journal.close()
+
+    assert [e.delivery_id for e in pending] == ["a"]
+    assert pending[0].payload == {"i": 1}
+    assert pending[0].completed == {"0:recorder"}
+
+
+def test_no_replay_after_max_attempts(path):
+    journal = Journal(path, backoff=0.0, max_attempts=2)
+    journal.append("a", "push", {"i": 1})
+
+    journal.retry_later("a")
+    assert [e.attempts for e in journal.pending()] == [1]
+    journal.retry_later("a")
+    assert journal.pending() == []
+    journal.close()
+
+
+def test_finished_deliveries_are_removed(path):
+    journal = Journal(path)
+    journal.append("a", "push", {"i": 1})
+    journal.mark_done("a", "0:recorder")
+    journal.finish("a")
+    assert journal.pending() == []
+    journal.close()
+
+
+def test_pending_deliveries_are_replayed_on_start(path):
+    journal = Journal(path)
+    for i in range(3):
+        journal.append(str(i), "push", {"i": i})
+    journal.close()
+
+    journal = Journal(path, poll_interval=0.05)
+    workflows = Workflows(journal=journal)
+    recorder = Recorder()
+    workflows.add(recorder)
+    workflows.start()
+    try:
+        assert wait_for(lambda: len(recorder.handled) == 3)
+        assert wait_for(lambda: not journal.pending())
+    finally:
+        workflows.shutdown()
+    assert recorder.handled == [0, 1, 2]
+
+
+def test_failed_deliveries_are_retried_with_backoff(path):
+    journal = Journal(path, backoff=60.0, poll_interval=0.05)
+    workflows = Workflows(journal=journal)
+    workflows.add(Recorder(fail={1}))
+    workflows.start()
+    try:
+        workflows.receive("push", {"i": 1}, "a")
+        entries = journal.pending()
+    finally:
+        workflows.shutdown()
+
+    # not due before the backoff passed
+    assert entries == []
+    # but still journaled, the next attempt is the second one
+    journal = Journal(path, backoff=0.0)
+    journal.retry_later("a")
+    assert [e.attempts for e in journal.pending()] == [2]
+    journal.close()
+
+
+def test_full_queue_keeps_replayed_entries(path):
+    journal = Journal(path)
+    for i in range(10):
+        journal.append(str(i), "push", {"i": i})
+    journal.close()
+
+    journal = Journal(path, poll_interval=0.05)
+    workflows = Workflows(
+            dispatcher=QueueDispatcher(workers=1, max_size=2),
+            journal=journal)
+    recorder = Recorder(delay=0.02)
+    workflows.add(recorder)
+    workflows.start()
+    try:
+        assert wait_for(lambda: len(recorder.handled) == 10)
+        assert wait_for(lambda: not journal.pending())
+    finally:
+        workflows.shutdown()
+    assert sorted(recorder.handled) == list(range(10))
+
+
+def test_full_queue_journals_live_deliveries_for_later(path):
+    journal = Journal(path, backoff=0.0, poll_interval=0.05)
+    workflows = Workflows(
+            dispatcher=QueueDispatcher(workers=1, max_size=1),
+            journal=journal)
+    recorder = Recorder(delay=0.1)
+    workflows.add(recorder)
+    workflows.start()
+    try:
+        # more deliveries than the queue holds, none of them is lost
+        for i in range(5):
+            workflows.receive("push", {"i": i}, str(i))
+        assert wait_for(lambda: len(recorder.handled) == 5)
+        assert wait_for(lambda: not journal.pending())
+    finally:
+        workflows.shutdown()
+    assert sorted(recorder.handled) == list(range(5))
+
+
+class Other(Recorder):
+    name = "other"
+
+
+def test_redelivery_skips_completed_workflows(path):
+    journal = Journal(path, backoff=60.0)
+    journal.append("a", "push", {"i": 1})
+    journal.mark_done("a", "0:recorder")
+    # not replayed before the redelivery arrives
+    journal.retry_later("a")
+    journal.close()
+
+    journal = Journal(path)
+    workflows = Workflows(journal=journal)
+    recorder, other = Recorder(), Other()
+    workflows.add(recorder)
+    workflows.add(other)
+    workflows.start()
+    try:
+        workflows.receive("push", {"i": 1}, "a")
+    finally:
+        workflows.shutdown()
+    assert recorder.handled == []
+    assert other.handled == [1]
+
+
+def test_deliveries_in_flight_are_not_pending(path):
+    journal = Journal(path, backoff=0.0)
+    journal.append("a", "push", {"i": 1})
+    assert journal.pending() == []
+
+    journal.retry_later("a")
+    journal.flush()
+    assert [e.delivery_id for e in journal.pending()] == ["a"]
+    journal.close()
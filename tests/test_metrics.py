@@ -0,0 +1,113 @@
+import threading
+
+from gflows import Workflows, metrics
+from gflows.dispatch import PartitionedDispatcher
+from gflows.metrics import Registry, endpoint
+from gflows.workflow import Workflow
+
+
+def test_counts_of_all_threads_are_summed():
+    registry = Registry()
+    counter = registry.counter("events_total", "Events.", ["type"])
+
+    def count():
+        for _ in range(100):
+            counter.inc("push")
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counter.inc("label", amount=2)
+
+    # the counts of finished threads are kept
+    assert registry.render() == (
+            "# HELP events_total Events.\n"
+            "# TYPE events_total counter\n"
+            'events_total{type="label"} 2\n'
+            'events_total{type="push"} 400\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("duration_seconds", "Duration.",
+                                   buckets=[0.1, 1.0])
+    for value in [0.05, 0.5, 0.5, 5.0]:
+        histogram.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+            'duration_seconds_bucket{le="0.1"} 1',
+            'duration_seconds_bucket{le="1.0"} 3',
+            'duration_seconds_bucket{le="+Inf"} 4',
+            'duration_seconds_sum 6.05',
+            'duration_seconds_count 4']
+
+
+def test_gauges_are_read_when_scraped():
+    registry = Registry()
+    values = [None, 3]
+    registry.gauge("pending", "Pending.", values.pop)
+
+    assert registry.render().endswith("pending 3\n")
+    # nothing to report
+    assert registry.render().endswith("# TYPE pending gauge\n")
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("c", "C.", ["name"]).inc('say "hi"\n')
+    assert 'c{name="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_endpoint():
+    assert (endpoint("/repos/o/a/issues/12?page=2")
+            == "/repos/:owner/:repo/issues/:id")
+    assert (endpoint("/api/v3/repos/o/a/labels/bug")
+            == "/repos/:owner/:repo/labels/:name")
+    assert endpoint("/projects/columns/cards/3") == (
+            "/projects/columns/cards/:id")
+    assert endpoint("/orgs/o/projects") == "/orgs/:org/projects"
+
+
+def samples(metric):
+    return metric._collect()
+
+
+def test_hooks_are_measured():
+    class Failing(Workflow):
+        name = "failing-for-metrics"
+
+        def hook(self, event_type, data, gh):
+            raise ValueError("failed on purpose")
+
+    workflows = Workflows()
+    workflows.add(Failing())
+    workflows.hook("push", {})
+
+    assert samples(metrics.hook_results)[
+            ("push", "failing-for-metrics", "failure")] == 1
+    # the counts of the buckets, the last value is the sum
+    assert sum(samples(metrics.hook_duration)[
+            ("push", "failing-for-metrics")][:-1]) == 1
+
+
+class Succeeding(Workflow):
+    name = "succeeding-in-process"
+
+    def hook(self, event_type, data, gh):
+        pass
+
+
+def test_hooks_in_processes_are_measured():
+    workflows = Workflows(
+            dispatcher=PartitionedDispatcher(workers=2, processes=True))
+    workflows.add(Succeeding())
+    workflows.start()
+    for i in range(4):
+        workflows.receive("push", {"repository": {"full_name": str(i)}})
+    workflows.shutdown()
+
+    # measured in the worker processes, recorded in this one
+    assert samples(metrics.hook_results)[
+            ("push", "succeeding-in-process", "success")] == 4
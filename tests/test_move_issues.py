@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.cache import github_cache
+from gflows.flows import MoveIssues
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    github.add_repo("o/a", issues=1)
+    github.add_repo("o/b")
+    github.add_repo("o/c")
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+@pytest.fixture
+def workflow(tmpdir):
+    return MoveIssues("o", "Board", "To do", "Done",
+                      checkpoint_path=os.path.join(str(tmpdir), "moves.json"))
+
+
+def comments(github, repository, number):
+    return [c["body"]
+            for c in github.repos[repository]["issues"][number]["comments"]]
+
+
+def test_failed_move_resumes(github, workflow):
+    gh = Workflows("token", base_url=github.url).gh
+    github.repos["o/a"]["issues"][1]["comments"].append(
+            {"id": 1, "body": "first",
+             "user": {"login": "x", "html_url": "https://github.com/x"},
+             "created_at": "2019-01-01T00:00:00Z"})
+    copy_comments = workflow._copy_comments
+
+    def fail(*args):
+        raise IOError("connection reset")
+
+    workflow._copy_comments = fail
+    with pytest.raises(IOError):
+        workflow._move_issue(1, "o/a", "o/b", gh)
+    assert workflow.checkpoints.get("o/a/1")["issue"] == 1
+
+    workflow._copy_comments = copy_comments
+    workflow._move_issue(1, "o/a", "o/b", gh)
+
+    # the issue created by the failed attempt is reused
+    assert len(github.repos["o/b"]["issues"]) == 1
+    assert comments(github, "o/b", 1)[-1].endswith("first")
+    assert comments(github, "o/a", 1) == [
+        "first", "Moved to {}".format(
+                github.repos["o/b"]["issues"][1]["html_url"])]
+    assert workflow.checkpoints.get("o/a/1") == {}
+
+
+def test_move_to_another_target_starts_over(github, workflow):
+    gh = Workflows("token", base_url=github.url).gh
+    # a move to o/b got far before it failed
+    workflow.checkpoints.update("o/a/1", target="o/b", issue=1, comments=0,
+                                announced=True, card_created=True)
+    copy_comments = workflow._copy_comments
+
+    def fail(*args):
+        raise IOError("connection reset")
+
+    workflow._copy_comments = fail
+    with pytest.raises(IOError):
+        workflow._move_issue(1, "o/a", "o/c", gh)
+    progress = workflow.checkpoints.get("o/a/1")
+    assert progress == {"target": "o/c", "issue": 1, "comments": 0}
+
+    workflow._copy_comments = copy_comments
+    workflow._move_issue(1, "o/a", "o/c", gh)
+    assert comments(github, "o/a", 1) == ["Moved to {}".format(
+            github.repos["o/c"]["issues"][1]["html_url"])]
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from gflows import Workflows, payload
+from gflows.server import _format_event
+from gflows.workflow import Workflow
+
+
+def test_path_tree():
+    assert payload.path_tree(["action", "commits.message"]) == {
+        "action": None, "commits": {"message": None}}
+    # a path covers everything below it
+    assert payload.path_tree(["project_card", "project_card.id"]) == {
+        "project_card": None}
+    assert payload.path_tree(["project_card.id", "project_card"]) == {
+        "project_card": None}
+
+
+def test_select_keeps_only_the_paths():
+    data = {"action": "created",
+            "commits": [{"message": "a", "id": 1},
+                        {"message": "b", "id": 2}],
+            "repository": {"full_name": "o/r", "id": 3},
+            "sender": "x"}
+    tree = payload.path_tree(["action", "commits.message",
+                              "repository.full_name", "missing.field"])
+    assert payload.select(data, tree) == {
+        "action": "created",
+        "commits": [{"message": "a"}, {"message": "b"}],
+        "repository": {"full_name": "o/r"}}
+
+
+def test_select_without_tree_keeps_everything():
+    data = {"a": {"b": [1, 2]}}
+    assert payload.select(data, None) == data
+
+
+def test_decode():
+    raw = json.dumps({"action": "moved", "project_card": {"id": 1},
+                      "sender": {"login": "x"}}).encode("utf-8")
+    assert payload.peek_action(raw) == "moved"
+    assert payload.decode(raw, payload.path_tree(["project_card"])) == {
+        "project_card": {"id": 1}}
+    assert payload.peek_action(b'{"ref": "x", "action": "moved"}') is None
+
+    with pytest.raises(ValueError):
+        payload.decode(b"[1, 2]")
+
+
+def test_format_paths():
+    assert payload.format_paths("{pusher[name]} pushed {ref} in "
+                                "{repository[full_name]}") == [
+        "pusher.name", "ref", "repository.full_name"]
+
+
+class Reading(Workflow):
+    name = "reading"
+    events = {"push": None, "issues": None}
+    payload_paths = ["commits.message"]
+
+
+def test_logged_fields_are_kept():
+    workflows = Workflows()
+    workflows.add(Reading())
+    raw = json.dumps({"ref": "refs/heads/master",
+                      "pusher": {"name": "x", "email": "x@y"},
+                      "repository": {"full_name": "o/r", "id": 1},
+                      "commits": [{"message": "a", "id": 2}]}).encode("utf-8")
+
+    data = workflows.decode("push", raw)
+    assert data == {"ref": "refs/heads/master",
+                    "pusher": {"name": "x"},
+                    "repository": {"full_name": "o/r"},
+                    "commits": [{"message": "a"}]}
+    assert _format_event("push", data) == (
+            "x pushed refs/heads/master in o/r")
+    # events only decoded to invalidate the cache are described too
+    raw = json.dumps({"sender": {"login": "x"}, "member": {"login": "y"},
+                      "team": {"name": "t", "id": 3},
+                      "repository": {"full_name": "o/r"}}).encode("utf-8")
+    assert _format_event("team_add", workflows.decode("team_add", raw)) == (
+            "x added repository o/r to team t")
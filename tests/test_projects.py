@@ -0,0 +1,59 @@
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.cache import github_cache
+from gflows.flows.projects import ProjectRegistry
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    github.add_repo("o/a")
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+@pytest.fixture
+def gh(github):
+    return Workflows("token", base_url=github.url).gh
+
+
+def test_names_are_resolved_once(github, gh):
+    project = github.add_board("o", "Board", ["Todo", "Done"], 0, "o/a")
+    registry = ProjectRegistry()
+
+    for _ in range(2):
+        assert registry.project_id("O", "Board", gh) == project["id"]
+        assert (registry.column_id(project["id"], "Done", gh)
+                == project["columns"][1])
+    # columns given by id aren't looked up
+    assert registry.column_id(project["id"], 7, gh) == 7
+    assert github.calls[("GET", "/orgs/:org/projects")] == 1
+    assert github.calls[("GET", "/projects/:id/columns")] == 1
+
+    with pytest.raises(ValueError):
+        registry.project_id("o", "Missing", gh)
+    with pytest.raises(ValueError):
+        registry.column_id(project["id"], "Missing", gh)
+
+
+def test_changed_names_are_fetched_again(github, gh):
+    project = github.add_board("o", "Board", ["Todo"], 0, "o/a")
+    registry = ProjectRegistry()
+    registry.project_id("o", "Board", gh)
+    registry.column_id(project["id"], "Todo", gh)
+
+    registry.observe("project_column", {
+            "project_column": {"project_url": project["url"]}})
+    registry.column_id(project["id"], "Todo", gh)
+    assert github.calls[("GET", "/projects/:id/columns")] == 2
+    assert github.calls[("GET", "/orgs/:org/projects")] == 1
+
+    registry.observe("project", {"organization": {"login": "O"},
+                                 "project": {"id": project["id"]}})
+    registry.project_id("o", "Board", gh)
+    registry.column_id(project["id"], "Todo", gh)
+    assert github.calls[("GET", "/orgs/:org/projects")] == 2
+    assert github.calls[("GET", "/projects/:id/columns")] == 3
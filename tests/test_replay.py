@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from gflows import Workflows, replay
+from gflows.replay import Replay
+from gflows.workflow import Workflow
+
+
+def card(card_id, column_id, delivery_id):
+    return {"event_type": "project_card",
+            "payload": {"action": "moved",
+                        "project_card": {"id": card_id,
+                                         "column_id": column_id}},
+            "delivery_id": delivery_id}
+
+
+def test_recorded_deliveries_are_parsed():
+    assert replay._parse(card(1, 2, "a")) == (
+            "project_card", card(1, 2, "a")["payload"], "a")
+    # as listed by github's hook deliveries API
+    assert replay._parse({"guid": "b",
+                          "event": "push",
+                          "request": {"payload": {"ref": "x"}}}) == (
+            "push", {"ref": "x"}, "b")
+    assert replay._parse({"request": {
+            "headers": {"X-GitHub-Event": "push",
+                        "X-GitHub-Delivery": "c"},
+            "payload": {}}}) == ("push", {}, "c")
+
+    with pytest.raises(ValueError):
+        replay._parse({"event_type": "push", "payload": "x"})
+
+
+@pytest.fixture
+def sources(tmp_path):
+    directory = tmp_path / "deliveries"
+    directory.mkdir()
+    with open(str(directory / "1.jsonl"), "w") as f:
+        for record in [card(1, 10, "a"), card(2, 10, "b"),
+                       card(1, 20, "c"), card(2, 10, "b")]:
+            f.write(json.dumps(record) + "\n")
+    with open(str(directory / "2.json"), "w") as f:
+        json.dump(card(3, 30, "d"), f)
+    (directory / "notes.txt").write_text("skipped")
+    return str(directory)
+
+
+def test_directories_are_read_in_order(sources):
+    files = replay.source_files([sources])
+    assert [f[len(sources) + 1:] for f in files] == ["1.jsonl", "2.json"]
+    assert [(d.position, d.delivery_id)
+            for d in replay.read_deliveries(files)] == [
+        (0, "a"), (1, "b"), (2, "c"), (3, "b"), (4, "d")]
+
+
+class Recording(Workflow):
+    name = "recording"
+    events = {"project_card": None}
+
+    def __init__(self, failing=()):
+        self.moves = []
+        self.failing = failing
+
+    def hook(self, event_type, data, gh):
+        card = data["project_card"]
+        if card["id"] in self.failing:
+            raise ValueError("failed on purpose")
+        self.moves.append((card["id"], card["column_id"]))
+
+
+def replayed(sources, workflow, **kwargs):
+    workflows = Workflows()
+    workflows.add(workflow)
+    return Replay(workflows, [sources], **kwargs).run()
+
+
+def test_duplicates_and_superseded_events_are_skipped(sources):
+    workflow = Recording(failing={3})
+
+    assert replayed(sources, workflow) == {
+            "total": 5, "position": 5, "handled": 3, "duplicates": 1,
+            "superseded": 1, "failed": 1}
+    assert sorted(workflow.moves) == [(1, 20), (2, 10)]
+
+    workflow = Recording()
+    replayed(sources, workflow, collapse=False)
+    assert sorted(workflow.moves) == [(1, 10), (1, 20), (2, 10), (3, 30)]
+
+
+def test_replays_resume_from_the_checkpoint(sources, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    with open(checkpoint, "w") as f:
+        json.dump({"files": replay.source_files([sources]),
+                   "position": 3,
+                   "failed": ["x"]}, f)
+    workflow = Recording()
+
+    report = replayed(sources, workflow, checkpoint_path=checkpoint)
+    assert workflow.moves == [(3, 30)]
+    assert (report["position"], report["failed"]) == (5, 1)
+    with open(checkpoint) as f:
+        assert json.load(f)["position"] == 5
+
+    with pytest.raises(ValueError):
+        replayed(str(tmp_path / "deliveries" / "1.jsonl"), workflow,
+                 checkpoint_path=checkpoint)
+
+
+def test_workflows_are_loaded_from_a_file(tmp_path):
+    config = tmp_path / "config.py"
+    config.write_text("from gflows import Workflows\n"
+                      "def create():\n"
+                      "    return Workflows()\n"
+                      "other = 1\n")
+
+    assert isinstance(replay.load_workflows(str(config) + ":create"),
+                      Workflows)
+    with pytest.raises(ValueError):
+        replay.load_workflows(str(config) + ":other")
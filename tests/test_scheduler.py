@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from gflows.scheduler import (
+    BULK, INTERACTIVE, NORMAL, SECONDARY_LIMIT_WAIT, RequestScheduler)
+
+
+def quota(remaining, limit=5000, reset=3600, **headers):
+    return dict({"X-RateLimit-Remaining": str(remaining),
+                 "X-RateLimit-Limit": str(limit),
+                 "X-RateLimit-Reset": str(time.time() + reset)}, **headers)
+
+
+@pytest.fixture
+def scheduler():
+    return RequestScheduler(burst=1)
+
+
+def test_requests_are_paced_once_the_quota_runs_low(scheduler):
+    scheduler.update(200, quota(4000))
+    scheduler._take()
+    # more than half of the quota is left
+    assert scheduler._delay(NORMAL) == 0
+
+    scheduler.update(200, quota(2000))
+    scheduler._take()
+    assert scheduler._delay(NORMAL) > 0
+    assert scheduler._delay(INTERACTIVE) == 0
+
+
+def test_reserves_are_kept_for_more_important_work(scheduler):
+    scheduler.update(200, quota(500, reset=100))
+    assert scheduler._delay(NORMAL) == 0
+    assert scheduler._delay(BULK) == pytest.approx(100, abs=1)
+
+    scheduler.update(200, quota(100, reset=100))
+    assert scheduler._delay(NORMAL) == pytest.approx(100, abs=1)
+    assert scheduler._delay(INTERACTIVE) == 0
+
+
+def test_other_resources_leave_the_quota_alone(scheduler):
+    scheduler.update(200, quota(4000))
+    scheduler.update(200, quota(10, **{"X-RateLimit-Resource": "graphql"}))
+    assert scheduler.remaining == 4000
+
+
+def test_throttled_requests_are_retried(scheduler):
+    assert scheduler.update(403, {"Retry-After": "30"})
+    assert scheduler._delay(INTERACTIVE) == pytest.approx(30, abs=1)
+
+    scheduler.blocked_until = 0
+    assert scheduler.update(403, {}, "You have exceeded a secondary rate "
+                                     "limit.")
+    assert (scheduler._delay(NORMAL)
+            == pytest.approx(SECONDARY_LIMIT_WAIT, abs=1))
+
+    # interactive work fails instead of waiting for the reset
+    assert scheduler.update(403, quota(0), priority=NORMAL)
+    assert not scheduler.update(403, quota(0), priority=INTERACTIVE)
+    assert not scheduler.update(404, quota(10))
+
+
+def test_priorities_are_nested(scheduler):
+    with scheduler.priority(BULK):
+        with scheduler.priority(INTERACTIVE):
+            assert scheduler.current_priority == INTERACTIVE
+        assert scheduler.current_priority == BULK
+    assert scheduler.current_priority == NORMAL
+
+
+def test_waiting_requests_are_served_by_priority(scheduler):
+    scheduler.blocked_until = time.time() + 0.3
+    served = []
+
+    def request(priority):
+        with scheduler.priority(priority):
+            scheduler.acquire()
+        served.append(priority)
+
+    threads = [threading.Thread(target=request, args=(priority,))
+               for priority in [BULK, NORMAL, INTERACTIVE]]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    assert served == [INTERACTIVE, NORMAL, BULK]
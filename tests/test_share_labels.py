@@ -0,0 +1,193 @@
+import time
+
+import pytest
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows
+from gflows.cache import github_cache
+from gflows.flows import ShareLabelsAccrossRepositories
+
+
+class Repo:
+    def __init__(self, full_name):
+        self.full_name = full_name
+
+
+def event(action, name, color="ff0000", description=None,
+          repository="o/b"):
+    return {"action": action,
+            "label": {"name": name, "color": color,
+                      "description": description},
+            "repository": {"full_name": repository}}
+
+
+@pytest.fixture
+def workflow():
+    return ShareLabelsAccrossRepositories(["o/a", "o/b"])
+
+
+def test_change_key_matches_creates_and_edits():
+    key = ShareLabelsAccrossRepositories._change_key
+    label = {"name": "bug", "color": "FF0000", "description": None}
+    # creating a label might be reported as an edit and vice versa
+    assert (key("O/B", "created", label)
+            == key("o/b", "edited", dict(label, color="ff0000",
+                                         description="")))
+    assert key("o/b", "edited", label) != key("o/b", "edited",
+                                              dict(label, color="00ff00"))
+    assert key("o/b", "deleted", {"name": "bug"}) != key(
+            "o/b", "edited", label)
+
+
+def test_own_changes_are_ignored_once(workflow):
+    label = {"name": "bug", "color": "ff0000", "description": None}
+    with workflow._own_change(Repo("O/B"), "created", label):
+        pass
+
+    assert workflow._is_echo(event("created", "bug"))
+    assert workflow.echoes_suppressed == 1
+    # a second event is a change made by someone else
+    assert not workflow._is_echo(event("created", "bug"))
+
+
+def test_changes_of_others_are_not_echoes(workflow):
+    label = {"name": "bug", "color": "ff0000", "description": None}
+    with workflow._own_change(Repo("o/b"), "edited", label):
+        pass
+
+    assert not workflow._is_echo(event("edited", "bug", color="00ff00"))
+    assert not workflow._is_echo(event("edited", "bug", repository="o/a"))
+    assert not workflow._is_echo(event("deleted", "bug"))
+    assert workflow._is_echo(event("edited", "bug"))
+
+
+def test_failed_changes_are_forgotten(workflow):
+    with pytest.raises(ValueError):
+        with workflow._own_change(Repo("o/b"), "deleted", {"name": "bug"}):
+            raise ValueError("github said no")
+
+    assert not workflow._is_echo(event("deleted", "bug"))
+
+
+def test_echoes_are_not_shared(workflow):
+    with workflow._own_change(Repo("o/b"), "deleted", {"name": "bug"}):
+        pass
+
+    # the echo is dropped before any github request is made
+    workflow.hook("label", event("deleted", "bug"), None)
+    assert workflow.echoes_suppressed == 1
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+def labels(github, repository):
+    return {name: (l["color"], l["description"])
+            for name, l in github.repos[repository]["labels"].items()}
+
+
+def test_reconcile_converges(github):
+    for repository in ["o/a", "o/b", "o/c"]:
+        github.add_repo(repository, labels=["bug"])
+    github.repos["o/a"]["labels"]["bug"]["description"] = "Broken"
+    github.add_repo("o/d")
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(["o/a", "o/b", "o/c", "o/d"])
+
+    changes = workflow.reconcile(gh)
+    assert sorted((c.repository, c.action) for c in changes) == [
+        ("o/a", "edit"), ("o/d", "create")]
+    # the most common, empty description wins
+    for repository in ["o/a", "o/b", "o/c", "o/d"]:
+        assert labels(github, repository) == {"bug": ("ededed", "")}
+    assert workflow.plan(gh) == []
+
+    # github sends our own changes back
+    assert workflow._is_echo(event("edited", "bug", color="ededed",
+                                   description="", repository="o/a"))
+    workflow.stop()
+
+
+def test_reconcile_copies_the_source(github):
+    github.add_repo("o/a", labels=["bug", "feature"])
+    github.add_repo("o/b", labels=["bug", "wontfix"])
+    github.repos["o/a"]["labels"]["bug"]["color"] = "ff0000"
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(["o/a", "o/b"], source="o/a")
+
+    assert workflow.reconcile(gh, dry_run=True)
+    assert set(labels(github, "o/b")) == {"bug", "wontfix"}
+
+    workflow.reconcile(gh)
+    assert labels(github, "o/b") == labels(github, "o/a")
+    assert workflow.plan(gh) == []
+    workflow.stop()
+
+
+def test_nothing_is_deleted_without_the_source(github):
+    github.add_repo("o/b", labels=["bug"])
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(["o/a", "o/b"], source="o/a")
+
+    # o/a doesn't exist
+    assert workflow.plan(gh) == []
+    workflow.stop()
+
+
+def test_labels_are_reconciled_on_start_and_periodically(github):
+    github.add_repo("o/a", labels=["bug"])
+    github.add_repo("o/b")
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(
+            ["o/a", "o/b"], source="o/a", reconcile_on_start=True,
+            reconcile_interval=0.1)
+
+    workflow.start(gh)
+    try:
+        assert set(labels(github, "o/b")) == {"bug"}
+        github.repos["o/a"]["labels"].clear()
+        github_cache.clear()
+        deadline = time.time() + 5
+        while labels(github, "o/b") and time.time() < deadline:
+            time.sleep(0.05)
+        assert labels(github, "o/b") == {}
+    finally:
+        workflow.stop()
+
+
+def test_fan_out_reports_every_repository(github):
+    for repository in ["o/a", "o/b", "o/c"]:
+        github.add_repo(repository)
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(["o/a", "o/b", "o/c", "o/x"])
+
+    def change(repo):
+        if repo.full_name == "o/b":
+            raise IOError("connection reset")
+        return "created"
+
+    summary = workflow._fan_out(["o/a", "o/b", "o/c", "o/x"], change, gh)
+    workflow.stop()
+    assert summary == {"o/a": "created",
+                       "o/b": "failed (OSError)",
+                       "o/c": "created",
+                       "o/x": "failed (404)"}
+
+
+def test_created_labels_are_shared(github):
+    for repository in ["o/a", "o/b", "o/c"]:
+        github.add_repo(repository)
+    github.add_repo("o/d", labels=["bug"])
+    gh = Workflows("token", base_url=github.url).gh
+    workflow = ShareLabelsAccrossRepositories(["o/a", "o/b", "o/c", "o/d"])
+
+    workflow.hook("label", event("created", "bug", repository="o/a"), gh)
+    workflow.stop()
+    for repository in ["o/b", "o/c", "o/d"]:
+        assert labels(github, repository) == {"bug": ("ff0000", "")}
+    assert "bug" not in labels(github, "o/a")
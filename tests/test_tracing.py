@@ -0,0 +1,123 @@
+import hashlib
+import hmac
+
+import pytest
+
+from gflows import Workflows, tracing
+from gflows.dispatch import PartitionedDispatcher
+from gflows.server import create_app
+from gflows.tracing import Tracer, child_span
+from gflows.workflow import Workflow
+
+
+@pytest.fixture
+def tracer():
+    return Tracer(sample_rate=1.0, threshold=0.0)
+
+
+def names(span):
+    return [(c["name"], names(c)) for c in span["children"]]
+
+
+def test_spans_of_a_delivery_form_a_tree(tracer):
+    tracer.begin("a")
+    with tracer.delivery("a"):
+        with tracer.span("hook", workflow="w"):
+            with tracer.span("request"):
+                pass
+            with tracer.span("request"):
+                pass
+    tracer.finish("a")
+
+    trace = tracer.get("a").as_dict()
+    assert trace["attributes"] == {"delivery_id": "a"}
+    assert names(trace) == [("hook", [("request", []), ("request", [])])]
+    assert trace["children"][0]["attributes"] == {"workflow": "w"}
+
+
+def test_unsampled_deliveries_are_not_traced():
+    tracer = Tracer(sample_rate=0.0)
+    assert tracer.begin("a") is None
+    with tracer.delivery("a"), tracer.span("hook") as span:
+        assert span is None
+    tracer.finish("a")
+    assert tracer.get("a") is None
+
+
+def test_only_slow_deliveries_are_kept(tracer):
+    tracer.threshold = 60.0
+    tracer.begin("a")
+    # still running
+    assert tracer.get("a") is not None
+    tracer.finish("a")
+    assert tracer.get("a") is None
+
+
+def test_failed_steps_are_marked(tracer):
+    trace = tracer.begin("a")
+    with pytest.raises(ValueError):
+        with child_span(trace.root, "hook"):
+            raise ValueError("failed on purpose")
+    assert trace.root.children[0].attributes == {
+            "error": "ValueError('failed on purpose')"}
+    assert trace.root.children[0].end is not None
+
+
+def test_abandoned_traces_are_dropped(tracer):
+    tracer.max_active = 2
+    for delivery_id in ["a", "b", "c"]:
+        tracer.begin(delivery_id)
+    assert tracer.get("a") is None
+    assert tracer.get("c") is not None
+
+
+@pytest.fixture
+def sampled():
+    tracing.tracer.sample_rate = 1.0
+    tracing.tracer.threshold = 0.0
+    yield tracing.tracer
+    tracing.tracer.sample_rate = 0.0
+    tracing.tracer.threshold = 1.0
+    tracing.tracer.max_active = 1000
+
+
+def post(client, delivery_id, body, secret):
+    digest = hmac.new(secret, body, hashlib.sha1).hexdigest()
+    return client.post("/postreceive", data=body, headers={
+            "X-Github-Event": "push",
+            "X-Github-Delivery": delivery_id,
+            "X-Hub-Signature": "sha1=" + digest})
+
+
+def test_forged_deliveries_are_not_traced(sampled):
+    client = create_app(lambda *args: None, b"secret").test_client()
+    sampled.max_active = 1
+    sampled.begin("running")
+
+    assert post(client, "forged", b"{}", b"guessed").status_code == 400
+    # the trace of a delivery that is still handled isn't pushed out
+    assert sampled.get("running") is not None
+    sampled.finish("running")
+    assert post(client, "real", b"{}", b"secret").status_code == 204
+    assert sampled.get("real") is not None
+
+
+class Working(Workflow):
+    name = "working"
+
+    def hook(self, event_type, data, gh):
+        with tracing.tracer.span("work"):
+            pass
+
+
+def test_hooks_in_processes_are_traced(sampled):
+    workflows = Workflows(
+            dispatcher=PartitionedDispatcher(workers=1, processes=True))
+    workflows.add(Working())
+    workflows.start()
+    sampled.begin("a")
+    workflows.receive("push", {}, "a")
+    workflows.shutdown()
+
+    # recorded in the worker process
+    assert names(sampled.get("a").as_dict()) == [("hook", [("work", [])])]
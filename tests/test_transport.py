@@ -0,0 +1,59 @@
+import pytest
+from github import Github, UnknownObjectException
+
+from benchmarks.fake_github import FakeGithub
+from gflows import Workflows, metrics
+from gflows.cache import github_cache
+from gflows.transport import transport
+
+
+@pytest.fixture
+def github():
+    github = FakeGithub().start()
+    github.add_repo("o/a")
+    yield github
+    github.stop()
+    github_cache.clear()
+
+
+def requests_sent(status=200):
+    return metrics.github_requests._collect().get(
+            ("GET", "/repos/:owner/:repo", status), 0)
+
+
+def test_requests_go_through_the_transport(github):
+    gh = Workflows("token", base_url=github.url).gh
+    sent = requests_sent()
+
+    assert gh.get_repo("o/a").full_name == "o/a"
+    with pytest.raises(UnknownObjectException):
+        gh.get_repo("o/missing")
+
+    assert requests_sent() == sent + 1
+    assert requests_sent(404) >= 1
+
+
+def test_other_clients_keep_their_connections(github):
+    Workflows("token", base_url=github.url)
+    sent = requests_sent()
+
+    assert Github("token", base_url=github.url).get_repo("o/a")
+    assert requests_sent() == sent
+
+
+def test_timeouts_are_nested():
+    with transport.timeout(5):
+        with transport.timeout(1):
+            assert transport._local.timeout == 1
+        assert transport._local.timeout == 5
+    assert transport._local.timeout is None
+
+
+def test_pool_size_can_be_changed():
+    pool_size = transport.pool_size
+    Workflows(pool_size=pool_size + 1)
+    try:
+        assert (transport.session.get_adapter("https://api.github.com")
+                ._pool_maxsize == pool_size + 1)
+    finally:
+        transport.configure(pool_size, transport.retries, transport.backoff)
@@ -0,0 +1,20 @@
+from gflows.flows.utils import issue_id_from_commit_message, issue_references
+
+
+def test_issue_id_from_commit_message():
+    assert issue_id_from_commit_message("Fix the thing (#12)") == 12
+    assert issue_id_from_commit_message("Fix o/r#7 and #8") == 7
+    assert issue_id_from_commit_message("Fix the thing") is None
+
+
+def test_issue_references():
+    messages = ["Fix #1 and #2", "Also Other/Repo#3", "Again #1",
+                "nothing here"]
+    assert issue_references(messages, "O/Repo") == [
+        "o/repo/1", "o/repo/2", "other/repo/3"]
+
+
+def test_issue_references_keep_dots_and_dashes():
+    assert issue_references(["see my-org/my.repo#4"], "o/r") == [
+        "my-org/my.repo/4"]
+    assert issue_references([], "o/r") == []